@@ -0,0 +1,452 @@
+"""
+This script contains the implementation of the ScoreAggregates class, which keeps exponentially decayed scores and
+rolling hour, day and week windows of the scores of every user, so that their recent behaviour can be answered without
+scanning any history.
+"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from array import array
+
+from score_store import normalize_user_id
+
+DEFAULT_WINDOWS = {"hour": (60 * 60, 12), "day": (24 * 60 * 60, 24), "week": (7 * 24 * 60 * 60, 7)}
+
+
+class UserAggregate:
+    """
+    The aggregates of a single user: decayed scores, and one ring buffer of buckets per window.
+
+    A ring buffer stores, for each of its buckets, the sum of the scores of every category and the number of messages
+    in a flat array of single-precision floats, next to an array of the epoch each bucket currently holds. A bucket is
+    reused as soon as its epoch falls out of the window, so updates are O(1) and the memory of a user is fixed.
+    """
+
+    __slots__ = ('decayed', 'decayed_at', 'sums', 'epochs')
+
+    def __init__(self, columns, windows):
+        """
+        Initializes a new, empty instance of the UserAggregate class.
+
+        Parameters:
+            columns (int): Number of values summed per bucket, one per category plus the number of messages.
+            windows (dict): (length in seconds, number of buckets) of each window, keyed by name.
+        """
+        self.decayed = array('f', bytes(4 * (columns - 1)))
+        self.decayed_at = 0.0
+        self.sums = {name: array('f', bytes(4 * columns * buckets)) for name, (_, buckets) in windows.items()}
+        self.epochs = {name: array('q', [-1]) * buckets for name, (_, buckets) in windows.items()}
+
+    def copy(self):
+        """
+        Returns a snapshot of the aggregates, which later updates do not change.
+
+        Returns:
+            UserAggregate: The snapshot.
+        """
+        snapshot = UserAggregate.__new__(UserAggregate)
+        snapshot.decayed = array(self.decayed.typecode, self.decayed)
+        snapshot.decayed_at = self.decayed_at
+        snapshot.sums = {name: array(sums.typecode, sums) for name, sums in self.sums.items()}
+        snapshot.epochs = {name: array(epochs.typecode, epochs) for name, epochs in self.epochs.items()}
+        return snapshot
+
+
+class ScoreAggregates:
+    """
+    Per-user score aggregates updated incrementally with every scored message.
+
+    The decayed scores halve every half_life seconds, so they follow recent behaviour while still reflecting the whole
+    history, and the windows hold the exact sums of the scores of the last hour, day and week, at the resolution of
+    their buckets. The aggregates can be persisted to a file of JSON lines, so that they survive restarts of the bot.
+    Each save appends the users that changed since the previous one, and the file is only rewritten as a whole once it
+    holds twice as many lines as there are users, so saving costs O(1) per update rather than O(users).
+
+    When partitioned, as the scores of a GuildScoreStore, a user has separate aggregates in every guild. Each guild is
+    then persisted to its own file in the directory at path, loaded the first time the guild is accessed and dropped
+    from memory with drop_guild, so that memory follows the guilds whose scores are loaded.
+    """
+
+    snapshot_chunk = 1000
+
+    def __init__(self, categories, half_life=7 * 24 * 60 * 60, windows=None, path=None, partitioned=False):
+        """
+        Initializes a new instance of the ScoreAggregates class, and loads the persisted aggregates if path exists.
+
+        Parameters:
+            categories (list): The score categories.
+            half_life (float): Number of seconds after which a score counts half in the decayed scores.
+            windows (dict): (length in seconds, number of buckets) of each window, keyed by name; hour, day and week
+                windows if None.
+            path (str): The file path to persist the aggregates to, or the directory to persist one file per guild to
+                if partitioned; they are kept in memory only if None.
+            partitioned (bool): Whether the aggregates of a user are kept separately for every guild.
+
+        Raises:
+            ValueError: If the half life or a window is not positive.
+        """
+        self.windows = dict(windows if windows is not None else DEFAULT_WINDOWS)
+        if half_life <= 0 or any(length <= 0 or buckets < 1 for length, buckets in self.windows.values()):
+            raise ValueError("Invalid aggregate window.")
+
+        self.categories = list(categories)
+        self.columns = len(self.categories) + 1
+        self.decay_rate = math.log(2) / half_life
+        self.half_life = half_life
+        self.path = path
+        self.partitioned = partitioned
+        self.guilds = {}
+        self.dirty = {}
+        self.lines = {}
+        self.lock = threading.Lock()
+
+        if partitioned and path is not None:
+            os.makedirs(path, exist_ok=True)
+        elif path is not None and os.path.exists(path):
+            self.load()
+
+    def get_path(self, guild_id):
+        """
+        Returns the path of the file the aggregates of a guild are persisted to.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+
+        Returns:
+            str: The path, or None if the aggregates are kept in memory only.
+        """
+        if not self.partitioned or self.path is None:
+            return self.path
+
+        name = "direct" if guild_id is None else str(int(guild_id))
+        return os.path.join(self.path, f"{name}.json")
+
+    def get_users(self, guild_id):
+        """
+        Returns the aggregates of the users of a guild, loading them if they are not in memory. Must be called with
+        the lock held.
+
+        Parameters:
+            guild_id (int): The ID of the guild, ignored unless the aggregates are partitioned.
+
+        Returns:
+            dict: The aggregates of the users, keyed by user ID.
+        """
+        guild_id = guild_id if self.partitioned else None
+        users = self.guilds.get(guild_id)
+        if users is None:
+            users = self.guilds[guild_id] = {}
+            path = self.get_path(guild_id)
+            if self.partitioned and path is not None and os.path.exists(path):
+                persisted, self.lines[guild_id] = self.read(path)
+                users.update(persisted)
+
+        return users
+
+    def record(self, user_id, scores, weight=1, timestamp=None, guild_id=None):
+        """
+        Adds the scores of a message to the aggregates of its author.
+
+        Parameters:
+            user_id (str): The ID of the author.
+            scores (dict): The score of each category.
+            weight (int): The number of messages the scores stand for, more than one for sampled messages.
+            timestamp (float): When the message was sent, in seconds since the epoch; now if None.
+            guild_id (int): The ID of the guild the message was sent in, for partitioned aggregates.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        values = [scores[category] * weight for category in self.categories]
+
+        with self.lock:
+            users = self.get_users(guild_id)
+            aggregate = users.get(normalize_user_id(user_id))
+            if aggregate is None:
+                aggregate = users[normalize_user_id(user_id)] = UserAggregate(self.columns, self.windows)
+
+            self.dirty.setdefault(guild_id if self.partitioned else None, set()).add(normalize_user_id(user_id))
+
+            factor = self.decay_factor(aggregate, timestamp)
+            for index, value in enumerate(values):
+                aggregate.decayed[index] = aggregate.decayed[index] * factor + value
+            aggregate.decayed_at = max(aggregate.decayed_at, timestamp)
+
+            values.append(weight)
+            for name, (length, buckets) in self.windows.items():
+                epoch = int(timestamp // (length / buckets))
+                slot = epoch % buckets
+                sums = aggregate.sums[name]
+                offset = slot * self.columns
+
+                if aggregate.epochs[name][slot] != epoch:
+                    if aggregate.epochs[name][slot] > epoch:
+                        continue
+
+                    aggregate.epochs[name][slot] = epoch
+                    for column in range(self.columns):
+                        sums[offset + column] = 0.0
+
+                for column, value in enumerate(values):
+                    sums[offset + column] += value
+
+    def decay_factor(self, aggregate, timestamp):
+        """
+        Returns the factor the decayed scores of a user shrink by between their last update and a timestamp.
+
+        Parameters:
+            aggregate (UserAggregate): The aggregates of the user.
+            timestamp (float): The timestamp, in seconds since the epoch.
+
+        Returns:
+            float: The factor, 1.0 if the timestamp is not later than the last update.
+        """
+        return math.exp(-self.decay_rate * max(0.0, timestamp - aggregate.decayed_at))
+
+    def get_recent(self, user_id, timestamp=None, guild_id=None):
+        """
+        Returns the recent scores of a user.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            timestamp (float): The time to answer for, in seconds since the epoch; now if None.
+            guild_id (int): The ID of the guild to answer for, for partitioned aggregates.
+
+        Returns:
+            dict: The decayed scores, and the scores and number of messages of each window, or None if the user has no
+                aggregates.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+
+        with self.lock:
+            aggregate = self.get_users(guild_id).get(normalize_user_id(user_id))
+            if aggregate is None:
+                return None
+
+            factor = self.decay_factor(aggregate, timestamp)
+            recent = {"decayed": {c: v * factor for c, v in zip(self.categories, aggregate.decayed)}}
+
+            for name, (length, buckets) in self.windows.items():
+                oldest = int(timestamp // (length / buckets)) - buckets
+                totals = [0.0] * self.columns
+                sums = aggregate.sums[name]
+                for slot, epoch in enumerate(aggregate.epochs[name]):
+                    if epoch > oldest:
+                        for column in range(self.columns):
+                            totals[column] += sums[slot * self.columns + column]
+
+                recent[name] = dict(zip(self.categories + ["messages"], totals))
+
+        return recent
+
+    def reset(self, user_id, guild_id=None):
+        """
+        Forgets the aggregates of a user.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            guild_id (int): The ID of the guild whose aggregates are forgotten, for partitioned aggregates.
+        """
+        with self.lock:
+            if self.get_users(guild_id).pop(normalize_user_id(user_id), None) is not None:
+                self.dirty.setdefault(guild_id if self.partitioned else None, set()).add(normalize_user_id(user_id))
+
+    def drop_guild(self, guild_id):
+        """
+        Saves the aggregates of a guild if they changed, and drops them from memory. Does nothing unless the
+        aggregates are partitioned.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+        """
+        if not self.partitioned:
+            return
+
+        self.save(guild_id)
+        with self.lock:
+            self.guilds.pop(guild_id, None)
+            self.lines.pop(guild_id, None)
+
+    def read(self, path):
+        """
+        Reads persisted aggregates. Windows whose configuration changed are left empty.
+
+        Parameters:
+            path (str): The path of the file.
+
+        Returns:
+            tuple: The aggregates of the users keyed by user ID, and the number of lines of the file, None if the file
+                must be rewritten before lines are appended to it.
+        """
+        users = {}
+        lines = 0
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash, the file is rewritten by the next save
+                    lines = None
+                    continue
+
+                if "users" in entry:
+                    # a file written as a single JSON document by older versions
+                    users.update((user_id, self.decode(fields)) for user_id, fields in entry["users"].items())
+                    lines = None
+                elif "decayed" in entry:
+                    users[entry["user"]] = self.decode(entry)
+                else:
+                    users.pop(entry["user"], None)
+
+                if lines is not None:
+                    lines += 1
+
+        return users, lines
+
+    def decode(self, entry):
+        """
+        Returns the aggregates of a user persisted in an entry. Windows whose configuration changed are left empty.
+
+        Parameters:
+            entry (dict): The persisted decayed scores and windows.
+
+        Returns:
+            UserAggregate: The aggregates.
+        """
+        aggregate = UserAggregate(self.columns, self.windows)
+        if len(entry["decayed"]) == self.columns - 1:
+            aggregate.decayed = array('f', entry["decayed"])
+            aggregate.decayed_at = entry["decayed_at"]
+
+        for name, (sums, epochs) in entry["windows"].items():
+            if name in self.windows and len(epochs) == len(aggregate.epochs[name]):
+                aggregate.sums[name] = array('f', sums)
+                aggregate.epochs[name] = array('q', epochs)
+
+        return aggregate
+
+    def encode(self, user_id, aggregate):
+        """
+        Returns the line persisting the aggregates of a user.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            aggregate (UserAggregate): The aggregates of the user, None if they were reset.
+
+        Returns:
+            str: The JSON line, including its trailing newline.
+        """
+        if aggregate is None:
+            return json.dumps({"user": user_id}) + "\n"
+
+        entry = {
+            "user": user_id,
+            "decayed": aggregate.decayed.tolist(),
+            "decayed_at": aggregate.decayed_at,
+            "windows": {
+                name: [aggregate.sums[name].tolist(), aggregate.epochs[name].tolist()] for name in self.windows
+            },
+        }
+        return json.dumps(entry) + "\n"
+
+    def load(self):
+        """
+        Loads the aggregates persisted at path. The aggregates of partitioned guilds are loaded as they are accessed.
+        """
+        users, lines = self.read(self.path)
+        with self.lock:
+            self.guilds[None] = users
+            self.lines[None] = lines
+
+    def save(self, guild_id=None):
+        """
+        Persists the aggregates that changed to path, or only those of a guild if given. The users are copied under
+        the lock snapshot_chunk at a time, so that record never waits for long, and encoded outside of it. Does nothing
+        if the aggregates have no path.
+
+        Parameters:
+            guild_id (int): The ID of the guild to save, for partitioned aggregates; every guild if None.
+
+        Raises:
+            OSError: If a file could not be written, its users are saved again by the next call.
+        """
+        if self.path is None:
+            return
+
+        with self.lock:
+            guilds = [guild_id] if self.partitioned and guild_id is not None else list(self.dirty)
+            pending = []
+            for guild in guilds:
+                changed = self.dirty.pop(guild, None)
+                if not changed:
+                    continue
+
+                users = self.guilds.get(guild, {})
+                lines = self.lines.get(guild)
+                rewrite = lines is None or lines + len(changed) > 2 * len(users)
+                pending.append((guild, changed, rewrite, list(users if rewrite else changed)))
+
+        for guild, changed, rewrite, user_ids in pending:
+            snapshot = {}
+            for start in range(0, len(user_ids), self.snapshot_chunk):
+                with self.lock:
+                    users = self.guilds.get(guild, {})
+                    for user_id in user_ids[start : start + self.snapshot_chunk]:
+                        aggregate = users.get(user_id)
+                        snapshot[user_id] = aggregate.copy() if aggregate is not None else None
+
+            try:
+                self.write(self.get_path(guild), snapshot, rewrite)
+            except Exception:
+                with self.lock:
+                    self.dirty.setdefault(guild, set()).update(changed)
+                    # a failed append may have left half a line behind
+                    self.lines[guild] = None
+                raise
+
+            with self.lock:
+                self.lines[guild] = len(snapshot) if rewrite else self.lines.get(guild, 0) + len(snapshot)
+
+    def write(self, path, snapshot, rewrite):
+        """
+        Appends the aggregates of users to a file, or atomically rewrites the file with them.
+
+        Parameters:
+            path (str): The path of the file.
+            snapshot (dict): The aggregates of the users, None for those that were reset, keyed by user ID.
+            rewrite (bool): Whether the file is replaced rather than appended to.
+        """
+        text = "".join(self.encode(user_id, aggregate) for user_id, aggregate in snapshot.items())
+        if not rewrite:
+            with open(path, "a") as file:
+                file.write(text)
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(text)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def stats(self):
+        """
+        Returns the counters of the aggregates.
+
+        Returns:
+            dict: Number of guilds and users with aggregates in memory, and the number of bytes their ring buffers
+                take.
+        """
+        with self.lock:
+            aggregates = [aggregate for users in self.guilds.values() for aggregate in users.values()]
+            buffer_bytes = sum(
+                sums.itemsize * len(sums) + aggregate.epochs[name].itemsize * len(aggregate.epochs[name])
+                for aggregate in aggregates
+                for name, sums in aggregate.sums.items()
+            )
+            return {"guilds": len(self.guilds), "users": len(aggregates), "buffer_bytes": buffer_bytes}
@@ -0,0 +1,133 @@
+"""
+This script contains the implementation of the BatchScorer class, which collects the messages arriving within a short
+window and scores them together with a single OpenAI request.
+"""
+
+import asyncio
+
+
+class BatchScorer:
+    """
+    A micro-batching stage between the Discord bot and the OpenAI handler.
+
+    Messages waiting to be scored are collected until max_batch_size of them are pending or the oldest one waited
+    max_wait seconds, and the whole batch is then scored with OpenAIHandler.aget_batch_scores. Messages with
+    different scoring modes are scored in separate requests of the same batch. Each caller awaits the scores of its
+    own message, and is charged an equal share of the tokens its request consumed.
+    """
+
+    def __init__(self, openai_handler, max_batch_size=10, max_wait=0.5):
+        """
+        Initializes a new instance of the BatchScorer class.
+
+        Parameters:
+            openai_handler (Scorer): The scoring backend scoring the batches, usually the OpenAI API handler.
+            max_batch_size (int): Number of pending messages that triggers scoring immediately.
+            max_wait (float): Maximum number of seconds a message waits for other messages to join its batch.
+        """
+        self.openai_handler = openai_handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.batches = 0
+        self.messages = 0
+
+    async def score(self, content, usage=None, scoring_mode=None):
+        """
+        Adds a message to the current batch and waits for its scores.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the share of the message in the tokens of its batch is added to, if not None
+            scoring_mode (str): scoring mode of the message if it has to be scored on its own, the backend's own if
+                None
+
+        Returns:
+            dict: scores for each category
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((content, future, usage, scoring_mode))
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self):
+        """
+        Starts scoring the pending messages as one batch without waiting any longer.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        task = asyncio.get_running_loop().create_task(self.score_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def score_batch(self, batch):
+        """
+        Scores a batch of messages, one request per scoring mode, and resolves the future of each message.
+
+        Parameters:
+            batch (list): (content, future, usage, scoring_mode) tuples of the messages in the batch.
+        """
+        self.batches += 1
+        self.messages += len(batch)
+
+        groups = {}
+        for entry in batch:
+            groups.setdefault(entry[3], []).append(entry)
+
+        await asyncio.gather(*(self.score_group(group, scoring_mode) for scoring_mode, group in groups.items()))
+
+    async def score_group(self, group, scoring_mode):
+        """
+        Scores the messages of a batch sharing a scoring mode with a single request, and resolves their futures.
+
+        Parameters:
+            group (list): (content, future, usage, scoring_mode) tuples of the messages.
+            scoring_mode (str): The scoring mode of the messages.
+        """
+        batch_usage = {}
+
+        try:
+            results = await self.openai_handler.aget_batch_scores(
+                [entry[0] for entry in group], batch_usage, scoring_mode
+            )
+        except Exception as exception:
+            for _, future, _, _ in group:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        for (_, future, usage, _), scores in zip(group, results):
+            if usage is not None:
+                for key, tokens in batch_usage.items():
+                    usage[key] = usage.get(key, 0) + tokens / len(group)
+
+            if not future.done():
+                future.set_result(scores)
+
+    def stats(self):
+        """
+        Returns the counters of the batch scorer.
+
+        Returns:
+            dict: Number of batches and messages scored, the average batch size and the number of pending messages.
+        """
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "average_batch_size": self.messages / self.batches if self.batches else 0.0,
+            "pending": len(self.pending),
+        }
@@ -0,0 +1,390 @@
+"""
+This script benchmarks the message scoring pipeline of the ChatWizard Discord bot. It replays a synthetic or recorded
+stream of messages through DiscordBot.on_message against a FakeOpenAIServer with a configurable latency, and reports
+the throughput, the latency of every stage, the API calls and the persisted bytes per message. The results are saved as
+JSON so that they can be compared across versions:
+
+    python benchmark.py --messages 500 --latency 0.2 --output benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+import discord
+from discord_bot import DiscordBot
+from log_writer import LogWriter
+from openai_handler import OpenAIHandler, percentile
+from scorers import FakeOpenAIServer
+from score_store import BinaryScoreStore, JSONScoreStore, SQLiteScoreStore
+
+PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+SAMPLE_MESSAGES = [
+    "Good morning everyone, how is it going?",
+    "Thanks, that was really helpful!",
+    "u r so stupid",
+    "I would like to go out tonight.",
+    "lol that meme is hilarious",
+    "Can someone help me with my homework please?",
+    "This game is awful and so are you",
+    "Congrats on the new job, well deserved!",
+    "I will be going to out.",
+    "Why did the chicken cross the road? To get to the other side!",
+]
+
+
+class FakeChannel:
+    """
+    A stand-in for a Discord text channel that counts the embeds the bot sends to it.
+    """
+
+    def __init__(self, channel_id):
+        """
+        Initializes a new instance of the FakeChannel class.
+
+        Parameters:
+            channel_id (int): The ID of the channel.
+        """
+        self.id = channel_id
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        """
+        Counts a message sent to the channel.
+        """
+        self.sent += 1
+
+
+class Benchmark:
+    """
+    A benchmark replaying a stream of messages through a DiscordBot scoring them with a FakeOpenAIServer.
+
+    Every message goes through on_message, which scores it with get_message_score and applies the scores with
+    update_scores, and the user scores are then written to disk with save_user_scores every save_every messages. Each of
+    these stages is timed separately.
+
+    A JSON or binary score store rewrites its whole file on every save, so every save counts as the size of the file,
+    whereas an SQLite database writes the rows as they change, so its persisted bytes are how much it grew during the
+    run.
+    """
+
+    stages = ['on_message', 'get_message_score', 'update_scores', 'save_user_scores']
+
+    def __init__(
+        self,
+        messages,
+        latency=0.0,
+        scoring_mode="separate",
+        score_backend="json",
+        concurrency=1,
+        save_every=1,
+    ):
+        """
+        Initializes a new instance of the Benchmark class.
+
+        Parameters:
+            messages (list): (author, content) tuples of the messages to replay, in order.
+            latency (float): Number of seconds the fake OpenAI backend delays every response.
+            scoring_mode (str): The scoring mode of the OpenAI handler, "separate" or "combined".
+            score_backend (str): "json", "binary" or "sqlite", the score store the user scores are persisted to.
+            concurrency (int): Number of messages handled at the same time.
+            save_every (int): Number of messages after which the user scores are saved.
+
+        Raises:
+            ValueError: If the score backend is not recognized.
+        """
+        if score_backend not in ['json', 'binary', 'sqlite']:
+            raise ValueError("Invalid score backend.")
+
+        self.messages = messages
+        self.latency = latency
+        self.scoring_mode = scoring_mode
+        self.score_backend = score_backend
+        self.concurrency = concurrency
+        self.save_every = save_every
+        self.timings = {stage: [] for stage in self.stages}
+        self.persisted_bytes = 0
+
+    def run(self):
+        """
+        Runs the benchmark in a temporary directory.
+
+        Returns:
+            dict: The results of the benchmark.
+        """
+        server = FakeOpenAIServer(latency=self.latency).start()
+
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                bot = self.create_bot(server, directory)
+                try:
+                    size = self.store_size(bot.score_store)
+                    started = time.perf_counter()
+                    channels = asyncio.run(self.replay(bot))
+                    duration = time.perf_counter() - started
+
+                    if not isinstance(bot.score_store, JSONScoreStore):
+                        self.persisted_bytes = max(0, self.store_size(bot.score_store) - size)
+                finally:
+                    bot.log_writer.close()
+                    bot.openai_handler.close()
+                    bot.score_store.close()
+        finally:
+            server.stop()
+
+        return self.report(duration, server.requests, sum(channel.sent for channel in channels.values()))
+
+    def create_bot(self, server, directory):
+        """
+        Creates a DiscordBot scoring messages with the given fake OpenAI backend and persisting into directory.
+
+        Parameters:
+            server (FakeOpenAIServer): The running fake OpenAI backend.
+            directory (str): The directory the log file and the user scores are written to.
+
+        Returns:
+            DiscordBot: The instrumented bot.
+        """
+        openai_handler = OpenAIHandler(
+            api_key="benchmark",
+            grammar_prompt_path=os.path.join(PROMPTS_PATH, "grammar.txt"),
+            friendliness_prompt_path=os.path.join(PROMPTS_PATH, "friendliness.txt"),
+            humor_prompt_path=os.path.join(PROMPTS_PATH, "humor.txt"),
+            combined_prompt_path=os.path.join(PROMPTS_PATH, "combined.txt"),
+            batch_prompt_path=os.path.join(PROMPTS_PATH, "batch.txt"),
+            scoring_mode=self.scoring_mode,
+            api_base=server.url,
+        )
+
+        user_scores_path = os.path.join(directory, "user_scores.json")
+        if self.score_backend == "sqlite":
+            score_store = SQLiteScoreStore(os.path.join(directory, "user_scores.db"))
+        elif self.score_backend == "binary":
+            score_store = BinaryScoreStore(os.path.join(directory, "user_scores.bin"))
+        else:
+            score_store = JSONScoreStore(user_scores_path)
+
+        log_file_path = os.path.join(directory, "log.txt")
+        bot = DiscordBot(
+            intents=discord.Intents.default(),
+            openai_handler=openai_handler,
+            log_file_path=log_file_path,
+            user_scores_path=user_scores_path,
+            score_store=score_store,
+            log_writer=LogWriter(log_file_path),
+        )
+
+        for stage in self.stages[1:]:
+            self.instrument(bot, stage)
+
+        return bot
+
+    def instrument(self, bot, stage):
+        """
+        Replaces a method of the bot with one recording how long each call takes.
+
+        Parameters:
+            bot (DiscordBot): The bot to instrument.
+            stage (str): The name of the method.
+        """
+        method = getattr(bot, stage)
+        timings = self.timings[stage]
+
+        if asyncio.iscoroutinefunction(method):
+
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    timings.append(time.perf_counter() - started)
+
+        else:
+
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    timings.append(time.perf_counter() - started)
+
+        setattr(bot, stage, timed)
+
+    async def replay(self, bot):
+        """
+        Replays the messages through the bot, at most concurrency of them at the same time.
+
+        Parameters:
+            bot (DiscordBot): The instrumented bot.
+
+        Returns:
+            dict: The fake channels the bot answered in, keyed by author.
+        """
+        channels = {}
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def handle(index, author, content):
+            channel = channels.setdefault(author, FakeChannel(len(channels)))
+            message = SimpleNamespace(
+                author=SimpleNamespace(id=author, name=f"user{author}"), content=content, channel=channel, guild=None
+            )
+
+            async with slots:
+                started = time.perf_counter()
+                await bot.on_message(message)
+                self.timings["on_message"].append(time.perf_counter() - started)
+
+                if (index + 1) % self.save_every == 0:
+                    bot.save_user_scores()
+                    if isinstance(bot.score_store, JSONScoreStore):
+                        self.persisted_bytes += self.store_size(bot.score_store)
+
+        await asyncio.gather(*(handle(index, *message) for index, message in enumerate(self.messages)))
+        return channels
+
+    def store_size(self, score_store):
+        """
+        Returns the number of bytes the score store occupies on disk, its write-ahead log included.
+
+        Parameters:
+            score_store (ScoreStore): The score store.
+
+        Returns:
+            int: The size of the score store.
+        """
+        paths = [score_store.path, score_store.path + "-wal"]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def report(self, duration, api_calls, replies):
+        """
+        Summarizes the measurements of a run.
+
+        Parameters:
+            duration (float): Number of seconds the replay took.
+            api_calls (int): Number of requests the fake OpenAI backend answered.
+            replies (int): Number of embeds the bot sent.
+
+        Returns:
+            dict: The configuration and the results of the benchmark.
+        """
+        count = len(self.messages)
+        return {
+            "config": {
+                "messages": count,
+                "latency": self.latency,
+                "scoring_mode": self.scoring_mode,
+                "score_backend": self.score_backend,
+                "concurrency": self.concurrency,
+                "save_every": self.save_every,
+            },
+            "duration": duration,
+            "messages_per_second": count / duration if duration else 0.0,
+            "api_calls_per_message": api_calls / count if count else 0.0,
+            "persisted_bytes_per_message": self.persisted_bytes / count if count else 0.0,
+            "replies": replies,
+            "stages": {
+                stage: {
+                    "count": len(timings),
+                    "p50": percentile(timings, 0.5),
+                    "p95": percentile(timings, 0.95),
+                    "p99": percentile(timings, 0.99),
+                    "max": max(timings, default=0.0),
+                }
+                for stage, timings in self.timings.items()
+            },
+        }
+
+
+def generate_messages(count, authors=10, seed=0):
+    """
+    Generates a synthetic stream of messages.
+
+    Parameters:
+        count (int): Number of messages.
+        authors (int): Number of distinct authors.
+        seed (int): Seed of the random generator, so that runs can be compared.
+
+    Returns:
+        list: (author, content) tuples.
+    """
+    generator = random.Random(seed)
+    return [(generator.randrange(authors), generator.choice(SAMPLE_MESSAGES)) for _ in range(count)]
+
+
+def load_messages(path):
+    """
+    Loads a recorded stream of messages from a log file written by the bot.
+
+    Parameters:
+        path (str): The path of the log file, whose lines look like "nickname: content".
+
+    Returns:
+        list: (author, content) tuples.
+    """
+    authors = {}
+    messages = []
+
+    with open(path, "r") as file:
+        for line in file:
+            nickname, separator, content = line.rstrip("\n").partition(": ")
+            if separator:
+                messages.append((authors.setdefault(nickname, len(authors)), content))
+
+    return messages
+
+
+def parse_arguments(arguments):
+    """
+    Parses the command line arguments.
+
+    Parameters:
+        arguments (list): The command line arguments, without the script name.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the message scoring pipeline of ChatWizard.")
+    parser.add_argument("--messages", type=int, default=200, help="number of synthetic messages to replay")
+    parser.add_argument("--authors", type=int, default=10, help="number of distinct synthetic authors")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic messages")
+    parser.add_argument("--recorded", default=None, help="log file to replay instead of synthetic messages")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake OpenAI backend delays responses")
+    parser.add_argument("--scoring-mode", choices=["separate", "combined"], default="separate")
+    parser.add_argument("--score-backend", choices=["json", "binary", "sqlite"], default="json")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of messages handled at the same time")
+    parser.add_argument("--save-every", type=int, default=1, help="number of messages between saves of the scores")
+    parser.add_argument("--output", default="benchmark.json", help="file the JSON results are written to")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+
+    if arguments.recorded is not None:
+        messages = load_messages(arguments.recorded)
+    else:
+        messages = generate_messages(arguments.messages, arguments.authors, arguments.seed)
+
+    results = Benchmark(
+        messages,
+        latency=arguments.latency,
+        scoring_mode=arguments.scoring_mode,
+        score_backend=arguments.score_backend,
+        concurrency=arguments.concurrency,
+        save_every=arguments.save_every,
+    ).run()
+
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=4)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+This script contains the implementation of the MessageDebouncer class, which merges the messages an author sends in
+quick succession in a channel so that they are scored and answered together.
+"""
+
+import asyncio
+
+
+class MessageDebouncer:
+    """
+    A coalescing window per (channel, author) pair.
+
+    Each message restarts the window of its channel and author. Once no message arrived for window seconds, or
+    max_messages of them piled up, the messages are handed to the handler together as one list.
+    """
+
+    def __init__(self, window=2.0, max_messages=5):
+        """
+        Initializes a new instance of the MessageDebouncer class.
+
+        Parameters:
+            window (float): Number of seconds to wait for the next message of the same author in the same channel.
+            max_messages (int): Number of merged messages that closes the window immediately.
+
+        Raises:
+            ValueError: If the window or the maximum number of messages is not valid.
+        """
+        if window <= 0 or max_messages < 1:
+            raise ValueError("Invalid debounce window.")
+
+        self.window = window
+        self.max_messages = max_messages
+        self.handler = None
+        self.pending = {}
+        self.messages = 0
+        self.flushes = 0
+
+    def start(self, handler):
+        """
+        Sets the function the merged messages are handed to.
+
+        Parameters:
+            handler (callable): Function called on the event loop with the list of merged messages.
+        """
+        self.handler = handler
+
+    def stop(self):
+        """
+        Closes every window and hands its messages to the handler right away, so that no message is lost when the bot
+        shuts down.
+        """
+        for key in list(self.pending):
+            self.flush(key)
+
+    def add(self, key, message):
+        """
+        Adds a message to the window of its key, opening one if needed.
+
+        Parameters:
+            key (tuple): The key messages are merged by, usually the IDs of the channel and the author.
+            message (discord.Message): The message to merge.
+        """
+        self.messages += 1
+        messages, timer = self.pending.pop(key, ([], None))
+        if timer is not None:
+            timer.cancel()
+
+        messages.append(message)
+        if len(messages) >= self.max_messages:
+            self.dispatch(messages)
+            return
+
+        timer = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+        self.pending[key] = (messages, timer)
+
+    def flush(self, key):
+        """
+        Closes the window of a key and hands its messages to the handler.
+
+        Parameters:
+            key (tuple): The key whose window is closed.
+        """
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+
+        entry[1].cancel()
+        self.dispatch(entry[0])
+
+    def dispatch(self, messages):
+        """
+        Hands merged messages to the handler.
+
+        Parameters:
+            messages (list): The merged messages, oldest first.
+        """
+        self.flushes += 1
+        self.handler(messages)
+
+    def stats(self):
+        """
+        Returns the counters of the debouncer.
+
+        Returns:
+            dict: Number of messages received, merged batches handed on, messages saved by merging and open windows.
+        """
+        return {
+            "messages": self.messages,
+            "flushes": self.flushes,
+            "merged": self.messages - self.flushes - sum(len(messages) for messages, _ in self.pending.values()),
+            "open_windows": len(self.pending),
+        }
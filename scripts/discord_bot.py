@@ -3,9 +3,18 @@ This script contains the implementation of the DiscordBot class, which is respon
 Discord API and OpenAI's GPT-3.5-turbo API to analyze and score members' behavior based on different categories.
 """
 
+import asyncio
+import logging
 import discord
-import os
-import json
+from aggregates import ScoreAggregates
+from leaderboard import Leaderboard
+from log_writer import LogWriter
+from message_filter import MessageFilter
+from metrics import NULL_METRICS
+from score_store import JSONScoreStore, ScoreTable
+from scorers import LexiconScorer
+
+logger = logging.getLogger(__name__)
 
 
 class DiscordBot(discord.Client):
@@ -14,32 +23,214 @@ class DiscordBot(discord.Client):
     within a server by analyzing and scoring each member's behavior.
     """
 
-    def __init__(self, intents, openai_handler, log_file_path, user_scores_path):
+    def __init__(
+        self,
+        intents,
+        openai_handler,
+        log_file_path,
+        user_scores_path,
+        score_store=None,
+        log_writer=None,
+        batch_scorer=None,
+        message_filter=None,
+        work_queue=None,
+        debouncer=None,
+        metrics=None,
+        token_budget=None,
+        sampling_policy=None,
+        aggregates=None,
+        leaderboard=None,
+        **options,
+    ):
         """
         Initializes a new instance of the DiscordBot class.
 
         Parameters:
             intents (discord.Intents): The intents of the discord client.
-            openai_handler (OpenAIHandler): The OpenAI API handler for the bot.
+            openai_handler (Scorer): The scoring backend for the bot, usually the OpenAI API handler.
             log_file_path (str): The log file path to store logs.
             user_scores_path (str): The user scores file path to store user scores.
+            score_store (ScoreStore): The store persisting user scores, a JSONScoreStore writing behind to
+                user_scores_path is created if None.
+            log_writer (LogWriter): The background writer of the log file, one appending to log_file_path is created
+                if None.
+            batch_scorer (BatchScorer): The stage batching messages before they are scored, every message is scored
+                on its own if None.
+            message_filter (MessageFilter): The pre-classifier recognizing trivial messages, one with the default rules
+                is created if None.
+            work_queue (WorkQueue): The bounded queue messages wait in before a worker scores them, every message is
+                scored as soon as it arrives if None.
+            debouncer (MessageDebouncer): The coalescing window merging the messages an author sends in quick
+                succession in a channel, every message is scored on its own if None.
+            metrics (Metrics): The metrics the cost of each stage is recorded in, nothing is recorded if None.
+            token_budget (TokenBudget): The daily token budgets of the guilds, channels and users, which step scoring
+                down to the combined prompt, sampling and local scoring as they run out; tokens are not accounted if
+                None.
+            sampling_policy (SamplingPolicy): The policy deciding per channel whether every message is scored, a
+                weighted sample of them, or none; every message is scored if None.
+            aggregates (ScoreAggregates): The decayed and windowed recent scores of the users shown by !me, which must
+                be partitioned if the score store is; in-memory ones are created if None.
+            leaderboard (Leaderboard): The per-guild rankings !top is served from, filled from the stored scores and
+                as members are scored; an empty one is created if None.
+            **options: Further options of the discord client, such as shard_id and shard_count.
         """
 
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, **options)
         self.openai_handler = openai_handler
-        self.log_file_path = log_file_path
-        self.user_scores_path = user_scores_path
-        self.user_scores = self.load_user_scores()
+        self.log_writer = log_writer if log_writer is not None else LogWriter(log_file_path)
+        self.batch_scorer = batch_scorer
+        self.message_filter = message_filter if message_filter is not None else MessageFilter()
+        self.work_queue = work_queue
+        self.debouncer = debouncer
+        self.scoring_tasks = set()
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.token_budget = token_budget
+        self.sampling_policy = sampling_policy
+        self.local_scorer = LexiconScorer()
+        self.score_store = score_store if score_store is not None else JSONScoreStore(user_scores_path)
         self.categories = ['grammar', 'friendliness', 'humor']
+        self.aggregates = (
+            aggregates
+            if aggregates is not None
+            else ScoreAggregates(self.categories, partitioned=self.score_store.partitioned)
+        )
+        self.leaderboard = (
+            leaderboard
+            if leaderboard is not None
+            else Leaderboard(self.categories, partitioned=self.score_store.partitioned)
+        )
+        if self.score_store.partitioned:
+            self.score_store.on_load = self.leaderboard.load_guild
+            self.score_store.on_evict = self.drop_guild
+
+        self.user_scores = self.load_user_scores()
+        self.max_leaderboard_size = 25
+        self.shutdown_timeout = 10.0
+        self.flush_event = None
+        self.flush_task = None
+
+    @property
+    def user_scores(self):
+        """
+        dict: The in-memory user scores, owned by the score store.
+        """
+        return self.score_store.user_scores
+
+    @user_scores.setter
+    def user_scores(self, user_scores):
+        if not isinstance(user_scores, ScoreTable):
+            user_scores = ScoreTable(user_scores)
+
+        self.score_store.user_scores = user_scores
+
+    @property
+    def log_file_path(self):
+        """
+        str: The log file path of the log writer.
+        """
+        return self.log_writer.path
+
+    @log_file_path.setter
+    def log_file_path(self, log_file_path):
+        self.log_writer.path = log_file_path
+
+    @property
+    def user_scores_path(self):
+        """
+        str: The path where the score store keeps the user scores.
+        """
+        return self.score_store.path
+
+    @user_scores_path.setter
+    def user_scores_path(self, user_scores_path):
+        self.score_store.path = user_scores_path
+
+    async def setup_hook(self):
+        """
+        A callback method that is called once before the bot connects to Discord.
+        It starts the background task that writes the user scores behind, the workers of the work queue and the
+        debouncer.
+        """
+
+        self.flush_event = asyncio.Event()
+        self.flush_task = asyncio.create_task(self.flush_user_scores_periodically())
+
+        if self.work_queue is not None:
+            self.work_queue.start(self.score_queued)
+
+        if self.debouncer is not None:
+            self.debouncer.start(self.submit_messages)
+
+        if self.sampling_policy is not None:
+            self.sampling_policy.start(self.submit_sampled_message)
+
+    async def close(self):
+        """
+        Closes the connection to Discord, stops writing behind and flushes the remaining user scores and logs to disk.
+        The messages waiting in the debouncer and in the reservoirs of the sampling policy are scored first, for up to
+        shutdown_timeout seconds, while replies can still be sent.
+        """
+
+        if self.debouncer is not None:
+            self.debouncer.stop()
+
+        if self.sampling_policy is not None:
+            self.sampling_policy.stop()
+
+        await self.finish_scoring()
+
+        await super().close()
+
+        if self.work_queue is not None:
+            await self.work_queue.stop()
+
+        self.log_writer.close()
+        self.openai_handler.close()
+
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        self.score_store.close()
+        self.aggregates.save()
 
     async def on_ready(self):
         """
         A callback method that is called when bot connects to Discord.
-        It prints a message to the console indicating that the bot has connected to Discord.
+        It fills the leaderboard from the stored scores and prints a message to the console indicating that the bot
+        has connected to Discord.
         """
 
+        self.seed_leaderboard()
         print(f"{self.user} has connected to Discord!")
 
+    def drop_guild(self, guild_id):
+        """
+        Drops the rankings and the aggregates of a guild from memory, once the score store evicted its scores.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+        """
+
+        self.leaderboard.drop_guild(guild_id)
+        self.aggregates.drop_guild(guild_id)
+
+    def seed_leaderboard(self):
+        """
+        Fills the rankings of every guild the bot is in with the stored scores of its members, so that !top answers
+        right after a restart. With a score store partitioned by guild, the rankings of a guild are filled whenever
+        its scores are loaded instead.
+        """
+
+        if self.score_store.partitioned:
+            return
+
+        for guild in self.guilds:
+            members = {
+                member.id: self.user_scores[member.id] for member in guild.members if member.id in self.user_scores
+            }
+            self.leaderboard.load_guild(guild.id, members)
+
     async def on_message(self, message):
         """
         A callback method that is called when the bot receives a message from a user.
@@ -59,14 +250,18 @@ class DiscordBot(discord.Client):
             embed = discord.Embed(
                 title="Help on the way!",
                 url="https://realdrewdata.medium.com/",
-                description="**!help:** To get help\n**!me:**" " To see your stats" "\n**!reset:" "** Reset your stats",
+                description=(
+                    "**!help:** To get help\n**!me:** To see your stats\n**!top [category] [n]:** To see the "
+                    "leaderboard of the server\n**!reset:** Reset your stats"
+                ),
                 color=discord.Color.blue(),
             )
 
             await message.channel.send(embed=embed)
 
         elif message.content.startswith("!me"):
-            if str(message.author.id) not in self.user_scores:
+            particular_scores = self.get_user_scores(message.author.id, self.get_guild_id(message))
+            if particular_scores is None:
                 embed = discord.Embed(
                     title="Failure :(",
                     url="https://realdrewdata.medium.com/",
@@ -76,14 +271,16 @@ class DiscordBot(discord.Client):
 
                 await message.channel.send(embed=embed)
             else:
-                self.user_scores = self.load_user_scores()
-                particular_scores = self.user_scores[str(message.author.id)]
                 text = (
                     f"Grammar:** {particular_scores['grammar']}**\n"
                     f"Friendliness:** {particular_scores['friendliness']}"
                     f"**\nHumor:** {particular_scores['humor']}**"
                 )
 
+                recent = self.aggregates.get_recent(message.author.id, guild_id=self.get_guild_id(message))
+                if recent is not None:
+                    text += self.format_recent_scores(recent)
+
                 embed = discord.Embed(
                     title="Here are your scores!",
                     url="https://realdrewdata.medium.com/",
@@ -93,10 +290,16 @@ class DiscordBot(discord.Client):
 
                 await message.channel.send(embed=embed)
 
+        elif message.content.startswith("!top"):
+            await self.send_leaderboard(message)
+
         elif message.content.startswith("!reset"):
+            guild_id = self.get_guild_id(message)
             default_scores = self.openai_handler.generate_default_scores()
-            self.user_scores[message.author.id] = default_scores
-            self.save_user_scores()
+            self.score_store.for_guild(guild_id).user_scores[message.author.id] = default_scores
+            self.store_user_scores(message.author.id, guild_id)
+            self.aggregates.reset(message.author.id, guild_id)
+            self.leaderboard.update(message.author.id, default_scores, guild_id)
 
             embed = discord.Embed(
                 title="Success!",
@@ -107,28 +310,187 @@ class DiscordBot(discord.Client):
 
             await message.channel.send(embed=embed)
 
+        elif self.debouncer is not None:
+            self.debouncer.add((message.channel.id, message.author.id), message)
+
+        elif self.work_queue is not None:
+            self.work_queue.put(message.author.id, [message])
+
         else:
-            scores = self.openai_handler.get_message_score(message.content)
-            final_text = str()
-            for label, score in scores.items():
-                if not score == -1001:
-                    results = label.capitalize() + ": **" + self.get_corresponding_word(label, score) + "**\n"
-                    final_text += results
-                else:
-                    scores[label] = 0
-                    text = label.capitalize() + ":**" + " Not calculated\n**"
-                    final_text += text
-
-            self.update_scores(message.author.id, scores)
+            await self.score_message(message)
 
-            embed = discord.Embed(
-                title=message.content,
-                url="https://realdrewdata.medium.com/",
-                description=final_text,
-                color=discord.Color.blue(),
-            )
+    def submit_messages(self, messages):
+        """
+        Hands messages merged by the debouncer to the work queue, or starts scoring them right away if there is none.
 
-            await message.channel.send(embed=embed)
+        Parameters:
+            messages (list): The merged messages of an author in a channel, oldest first.
+        """
+        if self.work_queue is not None:
+            self.work_queue.put(messages[-1].author.id, messages)
+            return
+
+        self.start_scoring(self.score_messages(messages))
+
+    def submit_sampled_message(self, item, weight):
+        """
+        Hands a message the sampling policy held in a reservoir until the end of its window to the work queue, or
+        starts scoring it right away if there is none.
+
+        Parameters:
+            item (tuple): The message and the text to score.
+            weight (int): The weight of the scores of the message.
+        """
+        message, content = item
+        if self.work_queue is not None:
+            self.work_queue.put(message.author.id, (message, content, weight))
+            return
+
+        self.start_scoring(self.score_message(message, content, weight))
+
+    async def score_queued(self, item):
+        """
+        Scores an item of the work queue.
+
+        Parameters:
+            item (object): A list of merged messages, or a (message, content, weight) tuple released by the sampling
+                policy.
+        """
+        if isinstance(item, tuple):
+            await self.score_message(*item)
+        else:
+            await self.score_messages(item)
+
+    async def finish_scoring(self):
+        """
+        Waits for up to shutdown_timeout seconds until the messages handed on for scoring have been scored.
+        """
+        pending = [asyncio.gather(*self.scoring_tasks, return_exceptions=True)]
+        if self.work_queue is not None and self.work_queue.tasks:
+            pending.append(self.work_queue.join())
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending), timeout=self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def start_scoring(self, coroutine):
+        """
+        Runs a scoring coroutine in a task, keeping a reference to the task until it is done.
+
+        Parameters:
+            coroutine (coroutine): The coroutine scoring messages.
+        """
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.scoring_tasks.add(task)
+        task.add_done_callback(self.scoring_tasks.discard)
+
+    async def score_messages(self, messages):
+        """
+        Scores consecutive messages of an author in a channel as a single message, one line each, and responds once.
+
+        Parameters:
+            messages (list): The messages to score together, oldest first.
+        """
+        await self.score_message(messages[-1], "\n".join(message.content for message in messages))
+
+    async def score_message(self, message, content=None, weight=None):
+        """
+        Scores a message that is not a command, updates the scores of its author and responds with the scores.
+        Messages the message filter recognizes as trivial get a neutral score silently, or are not scored at all.
+        The sampling policy decides whether the message is scored, and with which weight. The tokens spent on the
+        message are charged to the token budget, whose level decides how it is scored.
+
+        Parameters:
+            message (discord.Message): The message recieved from the discord server.
+            content (str): The text to score in place of the content of the message, such as the merged content of
+                several messages.
+            weight (int): The weight of the scores of a message that was already filtered and sampled, the message
+                filter and the sampling policy decide if None.
+        """
+
+        if content is None:
+            content = message.content
+
+        guild_id = self.get_guild_id(message)
+        if weight is None:
+            action, _ = self.message_filter.classify(content, guild_id)
+            self.metrics.increment("chatwizard_messages_total", action=action)
+            if action == "skip":
+                return
+
+            if action == "neutral":
+                self.update_scores(message.author.id, {category: 0 for category in self.categories}, guild_id=guild_id)
+                return
+
+            weight = 1
+            if self.sampling_policy is not None:
+                weight = self.sampling_policy.sample(
+                    guild_id, message.channel.id, message.author.id, (message, content)
+                )
+                if weight is None:
+                    self.metrics.increment("chatwizard_messages_total", action="unsampled")
+                    return
+
+        if self.token_budget is None:
+            scores = await self.get_message_score(content)
+        else:
+            channel_id = message.channel.id
+            level = self.token_budget.get_level(guild_id, channel_id, message.author.id)
+            if level == "sampled":
+                if not self.token_budget.should_sample(guild_id, channel_id):
+                    self.metrics.increment("chatwizard_messages_total", action="unsampled")
+                    return
+
+                weight *= self.token_budget.sample_every
+
+            usage = {}
+            scores = await self.get_message_score(content, usage, level)
+            self.token_budget.record(guild_id, channel_id, message.author.id, usage.get("total_tokens", 0))
+
+        final_text = str()
+        for label, score in scores.items():
+            if not score == -1001:
+                results = label.capitalize() + ": **" + self.get_corresponding_word(label, score) + "**\n"
+                final_text += results
+            else:
+                self.metrics.increment("chatwizard_scoring_failures_total", category=label)
+                scores[label] = 0
+                text = label.capitalize() + ":**" + " Not calculated\n**"
+                final_text += text
+
+        self.update_scores(message.author.id, scores, weight, guild_id)
+
+        embed = discord.Embed(
+            title=content,
+            url="https://realdrewdata.medium.com/",
+            description=final_text,
+            color=discord.Color.blue(),
+        )
+
+        await message.channel.send(embed=embed)
+
+    async def get_message_score(self, content, usage=None, level="full"):
+        """
+        Generates the scores of a message, through the batch scorer if there is one.
+
+        Parameters:
+            content (str): The content of the message.
+            usage (dict): Token counts the tokens spent on the message are added to, if not None.
+            level (str): The level of the token budget: "full" to score the message normally, "combined" or "sampled"
+                to rate it with the combined prompt, or "local" to score it with the local scorer.
+
+        Returns:
+            dict: A dictionary containing scores on different categories.
+        """
+        if level == "local":
+            return await self.local_scorer.aget_message_score(content)
+
+        scoring_mode = "combined" if level in ("combined", "sampled") else None
+        if self.batch_scorer is not None:
+            return await self.batch_scorer.score(content, usage=usage, scoring_mode=scoring_mode)
+
+        return await self.openai_handler.aget_message_score(content, usage=usage, scoring_mode=scoring_mode)
 
     def scan_message(self, message):
         """
@@ -146,7 +508,37 @@ class DiscordBot(discord.Client):
 
         return True
 
-    def update_scores(self, user_id, scores):
+    def get_user_scores(self, user_id, guild_id=None):
+        """
+        Returns the scores of the given user from memory. The scores are reloaded first only if the score store was
+        changed by someone else and there are no updates of our own waiting to be written.
+
+        Parameters:
+            user_id (str): The user id whose scores are returned.
+            guild_id (int): The ID of the guild whose scores are returned, for score stores partitioned by guild.
+
+        Returns:
+            dict: The scores of the user, or None if the user has no scores.
+        """
+        store = self.score_store.for_guild(guild_id)
+        if not store.dirty and store.changed_externally():
+            store.load()
+            if self.score_store.partitioned:
+                self.leaderboard.load_guild(guild_id, store.user_scores)
+            else:
+                self.leaderboard.refresh(store.user_scores)
+
+        return store.user_scores.get(user_id)
+
+    def reload_user_scores(self):
+        """
+        Replaces the in-memory user scores, and the rankings filled from them, with the ones in the score store.
+        """
+        self.user_scores = self.load_user_scores()
+        if not self.score_store.partitioned:
+            self.leaderboard.refresh(self.user_scores)
+
+    def update_scores(self, user_id, scores, weight=1, guild_id=None):
         """
         Updates the scores of the given user ID with the
         scores from the most recent message they sent.
@@ -154,62 +546,186 @@ class DiscordBot(discord.Client):
         Parameters:
             user_id (str): The user id whose scores needs to be updated.
             scores (dict): A dictionary containing scores on different categories.
+            weight (int): The number of messages the scores stand for, more than one for sampled messages.
+            guild_id (int): The ID of the guild the message was sent in, whose leaderboard the user joins and whose
+                scores are updated if the score store is partitioned by guild; None for direct messages.
         """
-        if user_id not in self.user_scores:
-            self.user_scores[user_id] = self.openai_handler.generate_default_scores()
+        with self.metrics.timer("chatwizard_score_update_seconds"):
+            store = self.score_store.for_guild(guild_id)
+            if user_id not in store.user_scores and not store.fetch_user(user_id):
+                store.user_scores[user_id] = self.openai_handler.generate_default_scores()
 
-        self.save_updated_scores(user_id, scores)
+            self.save_updated_scores(user_id, scores, weight, guild_id)
+            self.leaderboard.update(user_id, store.user_scores[user_id], guild_id)
 
-    def save_updated_scores(self, user_id, scores):
+    def save_updated_scores(self, user_id, scores, weight=1, guild_id=None):
         """
         Updates the scores for the given user ID with the scores from the most recent message sent by the user.
 
         Parameters:
             user_id (str): Unique ID of the user whose scores are being updated.
             scores (dict): A dictionary containing the updated scores for the user.
+            weight (int): The number of messages the scores stand for, more than one for sampled messages.
+            guild_id (int): The ID of the guild whose scores are updated, for score stores partitioned by guild.
+        """
+        user_scores = self.score_store.for_guild(guild_id).user_scores
+        user_scores.add(user_id, {category: scores[category] for category in self.categories}, weight)
+        self.store_user_scores(user_id, guild_id)
+        self.aggregates.record(user_id, scores, weight, guild_id=guild_id)
+
+    async def send_leaderboard(self, message):
         """
-        self.user_scores[user_id]["grammar"] += scores["grammar"]
-        self.user_scores[user_id]["friendliness"] += scores["friendliness"]
-        self.user_scores[user_id]["humor"] += scores["humor"]
-        self.save_user_scores()
+        Responds to a !top command with the highest ranked members of the guild, in a category given as the first
+        argument or by their combined score, as many as given as the second argument or 10.
+
+        Parameters:
+            message (discord.Message): The message containing the command.
+        """
+        category = "combined"
+        count = 10
+        for argument in message.content.split()[1:]:
+            if argument.isdigit():
+                count = max(1, min(int(argument), self.max_leaderboard_size))
+            elif argument.lower() in self.categories + ["combined"]:
+                category = argument.lower()
+            else:
+                embed = discord.Embed(
+                    title="Failure :(",
+                    url="https://realdrewdata.medium.com/",
+                    description=f"Sorry, I don't know the category {argument}.",
+                    color=discord.Color.red(),
+                )
+
+                await message.channel.send(embed=embed)
+                return
+
+        guild_id = self.get_guild_id(message)
+        self.score_store.for_guild(guild_id)  # loads the scores of the guild, and with them its rankings, if needed
+        ranking = self.leaderboard.top(guild_id, category, count)
+        lines = [f"{position}. <@{user_id}>:** {score:g}**" for position, (user_id, score) in enumerate(ranking, 1)]
+
+        rank = self.leaderboard.rank(guild_id, message.author.id, category)
+        if rank is not None and rank > len(ranking):
+            lines.append(f"\nYou are ranked **#{rank}**.")
+
+        embed = discord.Embed(
+            title=f"Top {category} scores",
+            url="https://realdrewdata.medium.com/",
+            description="\n".join(lines) if lines else "Nobody has been scored here yet.",
+            color=discord.Color.blue(),
+        )
+
+        await message.channel.send(embed=embed)
+
+    def get_guild_id(self, message):
+        """
+        Returns the ID of the guild a message was sent in.
+
+        Parameters:
+            message (discord.Message): The message.
+
+        Returns:
+            int: The ID of the guild, or None for direct messages.
+        """
+        return message.guild.id if message.guild is not None else None
+
+    def format_recent_scores(self, recent):
+        """
+        Formats the recent scores of a user for the !me embed.
+
+        Parameters:
+            recent (dict): The recent scores, as returned by ScoreAggregates.get_recent.
+
+        Returns:
+            str: One line per window and one for the decayed scores, with the grammar, friendliness and humor scores.
+        """
+        lines = ["\n\n**Recent** (grammar / friendliness / humor)"]
+        for name in ['hour', 'day', 'week']:
+            if name in recent:
+                window = recent[name]
+                values = " / ".join(f"{window[category]:g}" for category in self.categories)
+                lines.append(f"Last {name}:** {values}** ({window['messages']:g} messages)")
+
+        values = " / ".join(f"{recent['decayed'][category]:.1f}" for category in self.categories)
+        lines.append(f"Trend:** {values}**")
+        return "\n".join(lines)
 
     def load_user_scores(self):
         """
-        Loads the user scores from the JSON file.
+        Loads the user scores from the score store.
 
         Returns:
             dict: A dictionary that maps user IDs to their scores.
         """
-        if not os.path.exists(self.user_scores_path):
-            return {}
-
-        with open(self.user_scores_path, "r") as file:
-            return json.load(file)
+        return self.score_store.load()
 
     def save_user_scores(self):
         """
-        Saves the user scores to the JSON file by writing the self.user_scores dictionary to the JSON file.
+        Saves the user scores immediately by writing the self.user_scores dictionary to the score store.
         """
 
-        with open(self.user_scores_path, "w") as file:
-            json.dump(self.user_scores, file)
+        with self.metrics.timer("chatwizard_persistence_seconds", operation="save"):
+            self.score_store.save()
+
+    def store_user_scores(self, user_id, guild_id=None):
+        """
+        Hands the changed scores of the given user to the score store, and wakes up the background flush early once
+        enough changes piled up.
+
+        Parameters:
+            user_id (str): Unique ID of the user whose scores changed.
+            guild_id (int): The ID of the guild whose scores changed, for score stores partitioned by guild.
+        """
+
+        if self.score_store.for_guild(guild_id).update_scores(user_id) and self.flush_event is not None:
+            self.flush_event.set()
+
+    async def flush_user_scores(self):
+        """
+        Writes the dirty user scores to disk without blocking the event loop. The snapshot is taken on the event loop
+        and written from the default executor.
+        """
+
+        if not self.score_store.dirty:
+            return
+
+        with self.metrics.timer("chatwizard_persistence_seconds", operation="flush"):
+            payload = self.score_store.serialize()
+            await asyncio.get_running_loop().run_in_executor(None, self.score_store.write, payload)
+
+    async def flush_user_scores_periodically(self):
+        """
+        Flushes the user scores and saves the score aggregates every flush interval, or earlier when enough updates
+        piled up, until the bot closes, and then lets the score store release what it has not used recently. A failed
+        write is logged and retried at the next flush.
+        """
+
+        while not self.is_closed():
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=self.score_store.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.flush_event.clear()
+            try:
+                await self.flush_user_scores()
+                await asyncio.get_running_loop().run_in_executor(None, self.aggregates.save)
+                self.score_store.release_idle()
+            except Exception:
+                logger.exception("Could not write the user scores.")
+                self.metrics.increment("chatwizard_persistence_errors_total")
 
     def update_log_file(self, nickname, content):
         """
-        Appends the nickname and message content to the log file.
-        If the log file does not exist, creates a new log file.
+        Queues the nickname and message content to be appended to the log file by the log writer.
+        If the log file does not exist, the log writer creates a new log file.
 
         Parameters:
             nickname (str): The nickname of the user who sent the message.
             content (str): The content of the message.
         """
 
-        if not os.path.exists(self.log_file_path):
-            with open(self.log_file_path, "w") as log_file:
-                log_file.write("Log file created.\n")
-
-        with open(self.log_file_path, "a") as log_file:
-            log_file.write(f"{nickname}: {content}\n")
+        self.log_writer.write(f"{nickname}: {content}\n")
 
     def score_to_word(self, score_map, score):
         """
@@ -252,3 +768,13 @@ class DiscordBot(discord.Client):
             raise ValueError("Invalid label.")
 
         return self.score_to_word(words[label], score)
+
+
+class ShardedDiscordBot(DiscordBot, discord.AutoShardedClient):
+    """
+    A DiscordBot connecting to Discord through several gateway shards in a single process.
+
+    Pass shard_count to choose the number of shards, and shard_ids to run only some of them in this process, so that
+    several processes can share the shards of a bot; the processes must then share a SQLiteScoreStore created with
+    shared=True.
+    """
@@ -0,0 +1,353 @@
+"""
+This script contains the implementation of the Leaderboard class, which keeps the members of every guild ranked by
+each score category and by their combined score, so that the !top command never has to sort the user scores.
+"""
+
+import math
+import random
+
+from score_store import normalize_user_id
+
+
+class SkipNode:
+    """
+    A node of a RankingIndex, linked to the next node on each of its levels along with the number of positions each
+    link skips.
+    """
+
+    __slots__ = ('key', 'next', 'widths')
+
+    def __init__(self, key, levels):
+        """
+        Initializes a new instance of the SkipNode class.
+
+        Parameters:
+            key (tuple): The sort key of the node, None for the head of the list.
+            levels (int): Number of levels the node is linked on.
+        """
+        self.key = key
+        self.next = [None] * levels
+        self.widths = [1] * levels
+
+
+class RankingIndex:
+    """
+    An indexable skiplist of members ordered by descending score.
+
+    Each link records how many positions it skips, so a member is inserted, removed or ranked in O(log n) expected
+    time, and the first n members are read in O(n) by following the bottom level from the head. Ties are broken by
+    member ID so that the order is deterministic.
+    """
+
+    max_levels = 24
+
+    def __init__(self, seed=None):
+        """
+        Initializes a new, empty instance of the RankingIndex class.
+
+        Parameters:
+            seed (int): Seed of the random generator drawing the levels of the nodes, for reproducible layouts.
+        """
+        self.random = random.Random(seed)
+        self.head = SkipNode(None, self.max_levels)
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find_chain(self, key):
+        """
+        Returns the last node before a key on every level, and how many positions each of them is from the head.
+
+        Parameters:
+            key (tuple): The sort key.
+
+        Returns:
+            tuple: The list of nodes, and the list of their positions.
+        """
+        chain = [None] * self.max_levels
+        positions = [0] * self.max_levels
+        node = self.head
+        position = 0
+
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.widths[level]
+                node = node.next[level]
+
+            chain[level] = node
+            positions[level] = position
+
+        return chain, positions
+
+    def insert(self, key):
+        """
+        Links a new node with the given key into the list.
+
+        Parameters:
+            key (tuple): The sort key.
+        """
+        chain, positions = self.find_chain(key)
+        levels = min(self.max_levels, 1 - int(math.log(1.0 - self.random.random(), 2.0)))
+        node = SkipNode(key, levels)
+
+        for level in range(levels):
+            previous = chain[level]
+            skipped = positions[0] - positions[level]
+            node.next[level] = previous.next[level]
+            node.widths[level] = previous.widths[level] - skipped
+            previous.next[level] = node
+            previous.widths[level] = skipped + 1
+
+        for level in range(levels, self.max_levels):
+            chain[level].widths[level] += 1
+
+    def remove(self, key):
+        """
+        Unlinks the node with the given key from the list.
+
+        Parameters:
+            key (tuple): The sort key, which must be in the list.
+        """
+        chain, _ = self.find_chain(key)
+        node = chain[0].next[0]
+
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.widths[level] += node.widths[level] - 1
+            previous.next[level] = node.next[level]
+
+        for level in range(len(node.next), self.max_levels):
+            chain[level].widths[level] -= 1
+
+    def update(self, member, score):
+        """
+        Sets the score of a member, adding the member if needed.
+
+        Parameters:
+            member (str): The ID of the member.
+            score (float): The score of the member.
+        """
+        key = (-score, member)
+        previous = self.keys.get(member)
+        if previous == key:
+            return
+
+        if previous is not None:
+            self.remove(previous)
+
+        self.insert(key)
+        self.keys[member] = key
+
+    def discard(self, member):
+        """
+        Removes a member if it is in the index.
+
+        Parameters:
+            member (str): The ID of the member.
+        """
+        key = self.keys.pop(member, None)
+        if key is not None:
+            self.remove(key)
+
+    def rank(self, member):
+        """
+        Returns the position of a member.
+
+        Parameters:
+            member (str): The ID of the member.
+
+        Returns:
+            int: The 1-based position of the member, or None if it is not in the index.
+        """
+        key = self.keys.get(member)
+        if key is None:
+            return None
+
+        _, positions = self.find_chain(key)
+        return positions[0] + 1
+
+    def top(self, count):
+        """
+        Returns the members with the highest scores.
+
+        Parameters:
+            count (int): Number of members to return.
+
+        Returns:
+            list: (member, score) tuples, the highest score first.
+        """
+        members = []
+        node = self.head.next[0]
+        while node is not None and len(members) < count:
+            members.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+
+        return members
+
+
+class Leaderboard:
+    """
+    Per-guild rankings of the members who were scored in each guild.
+
+    Every guild has one RankingIndex per category and one for the combined score, the sum of the categories. A user
+    joins the rankings of a guild when the guild is loaded with their stored scores or the first time one of their
+    messages there is scored, and from then on every change of their scores is applied to the rankings of each guild
+    they joined. When the scores are partitioned by guild, a
+    change only applies to the rankings of the guild the scores belong to.
+    """
+
+    def __init__(self, categories, seed=None, partitioned=False):
+        """
+        Initializes a new instance of the Leaderboard class.
+
+        Parameters:
+            categories (list): The score categories.
+            seed (int): Seed of the random generators of the rankings, for reproducible layouts.
+            partitioned (bool): Whether every guild has its own scores, as with a GuildScoreStore.
+        """
+        self.categories = list(categories)
+        self.partitioned = partitioned
+        self.boards = {}
+        self.guilds = {}
+        self.seed = seed
+
+    def update(self, user_id, scores, guild_id=None):
+        """
+        Applies the scores of a user to the rankings of every guild they joined, or only to those of guild_id if the
+        leaderboard is partitioned.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            scores (dict): The total score of each category of the user.
+            guild_id (int): The ID of the guild the user was scored in, which they join if they did not already;
+                no guild is joined if None, unless the leaderboard is partitioned.
+        """
+        user_id = normalize_user_id(user_id)
+        guilds = self.guilds.setdefault(user_id, set())
+        if guild_id is not None or self.partitioned:
+            guilds.add(guild_id)
+
+        combined = sum(scores[category] for category in self.categories)
+        for guild in [guild_id] if self.partitioned else guilds:
+            board = self.boards.get(guild)
+            if board is None:
+                board = self.boards[guild] = {
+                    category: RankingIndex(self.seed) for category in self.categories + ["combined"]
+                }
+
+            for category in self.categories:
+                board[category].update(user_id, scores[category])
+            board["combined"].update(user_id, combined)
+
+    def load_guild(self, guild_id, user_scores):
+        """
+        Replaces the rankings of a guild with the stored scores of its members, such as when the bot starts or the
+        scores of the guild are loaded from disk.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+            user_scores (dict): The scores of the members of the guild, keyed by user ID.
+        """
+        self.drop_guild(guild_id)
+        for user_id, scores in user_scores.items():
+            self.update(user_id, scores, guild_id)
+
+    def refresh(self, user_scores):
+        """
+        Applies reloaded scores to the ranked users. Only the users whose scores changed are moved in the rankings,
+        and those who no longer have scores are removed.
+
+        Parameters:
+            user_scores (dict): The scores of every user, keyed by user ID.
+        """
+        for user_id in list(self.guilds):
+            scores = user_scores.get(user_id)
+            if scores is None:
+                self.remove(user_id)
+            else:
+                self.update(user_id, scores)
+
+    def drop_guild(self, guild_id):
+        """
+        Forgets the rankings of a guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+        """
+        board = self.boards.pop(guild_id, None)
+        if board is None:
+            return
+
+        for user_id in board["combined"].keys:
+            guilds = self.guilds[user_id]
+            guilds.discard(guild_id)
+            if not guilds:
+                del self.guilds[user_id]
+
+    def remove(self, user_id):
+        """
+        Removes a user from the rankings of every guild.
+
+        Parameters:
+            user_id (str): The ID of the user.
+        """
+        user_id = normalize_user_id(user_id)
+        for guild in self.guilds.pop(user_id, set()):
+            for index in self.boards[guild].values():
+                index.discard(user_id)
+
+    def top(self, guild_id, category="combined", count=10):
+        """
+        Returns the highest ranked members of a guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+            category (str): A score category, or "combined".
+            count (int): Number of members to return.
+
+        Returns:
+            list: (user ID, score) tuples, the highest score first.
+
+        Raises:
+            ValueError: If the category is not recognized.
+        """
+        if category not in self.categories and category != "combined":
+            raise ValueError("Invalid category.")
+
+        board = self.boards.get(guild_id)
+        return board[category].top(count) if board is not None else []
+
+    def rank(self, guild_id, user_id, category="combined"):
+        """
+        Returns the position of a user in a ranking of a guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+            user_id (str): The ID of the user.
+            category (str): A score category, or "combined".
+
+        Returns:
+            int: The 1-based position of the user, or None if they are not ranked in the guild.
+
+        Raises:
+            ValueError: If the category is not recognized.
+        """
+        if category not in self.categories and category != "combined":
+            raise ValueError("Invalid category.")
+
+        board = self.boards.get(guild_id)
+        return board[category].rank(normalize_user_id(user_id)) if board is not None else None
+
+    def stats(self):
+        """
+        Returns the counters of the leaderboard.
+
+        Returns:
+            dict: Number of guilds with rankings, of ranked users, and of their memberships.
+        """
+        return {
+            "guilds": len(self.boards),
+            "users": len(self.guilds),
+            "memberships": sum(len(guilds) for guilds in self.guilds.values()),
+        }
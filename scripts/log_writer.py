@@ -0,0 +1,290 @@
+"""
+This script contains the implementation of the LogWriter class, which appends message logs to the log file from a
+background thread so that logging never blocks the handling of messages.
+"""
+
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import date, datetime
+
+from metrics import NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """
+    A buffered log writer fed by a queue.
+
+    Lines are collected by a background thread and appended to the log file in batches, either when max_batch lines
+    are waiting or flush_interval seconds have passed. The log file is rotated once it grows past max_bytes or, if
+    rotate_daily is set, when the day changes; rotated segments can optionally be compressed with gzip. A batch that
+    cannot be written, such as when the disk is full, is logged and dropped, and the log file is reopened for the next
+    one.
+    """
+
+    stop_sentinel = object()
+
+    def __init__(
+        self,
+        path,
+        max_batch=100,
+        flush_interval=1.0,
+        max_bytes=10 * 1024 * 1024,
+        rotate_daily=False,
+        compress=False,
+        max_queue=10000,
+        metrics=None,
+    ):
+        """
+        Initializes a new instance of the LogWriter class. The background thread starts with the first write.
+
+        Parameters:
+            path (str): The log file path to store logs.
+            max_batch (int): Number of waiting lines that triggers a write.
+            flush_interval (float): Maximum number of seconds a line waits before being written.
+            max_bytes (int): Size in bytes past which the log file is rotated, never rotated by size if None.
+            rotate_daily (bool): Whether the log file is rotated when the day changes.
+            compress (bool): Whether rotated segments are compressed with gzip.
+            max_queue (int): Maximum number of waiting lines, further lines are dropped until the queue drains.
+            metrics (Metrics): The metrics the cost of the writes is recorded in, nothing is recorded if None.
+        """
+        self.path = path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.errors = 0
+        self.written = 0
+        self.rotations = 0
+        self.file = None
+        self.file_date = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+
+    def write(self, line):
+        """
+        Queues a line to be appended to the log file. Never blocks; if the queue is full the line is dropped.
+
+        Parameters:
+            line (str): The line to append, including its trailing newline.
+        """
+        self.start()
+
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every line queued so far is written to the log file.
+
+        Parameters:
+            timeout (float): Maximum number of seconds to wait, waits forever if None.
+
+        Returns:
+            bool: Whether the lines were written before the timeout.
+        """
+        if self.thread is None:
+            return True
+
+        if not self.thread.is_alive():
+            return False
+
+        flushed = threading.Event()
+        try:
+            self.queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+
+        return flushed.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """
+        Writes the remaining lines, stops the background thread and closes the log file.
+
+        Parameters:
+            timeout (float): Maximum number of seconds to wait for the queue to make room and for the thread to stop.
+        """
+        if self.thread is None:
+            return
+
+        if self.thread.is_alive():
+            try:
+                self.queue.put(self.stop_sentinel, timeout=timeout)
+                self.thread.join(timeout)
+            except queue.Full:
+                logger.error("The log writer did not drain its queue, %d lines are lost.", self.queue.qsize())
+
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the background thread if it is not running yet.
+        """
+        if self.thread is not None:
+            return
+
+        with self.start_lock:
+            if self.thread is None:
+                thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+                thread.start()
+                self.thread = thread
+
+    def run(self):
+        """
+        The loop of the background thread, collecting lines into batches and writing them.
+        """
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, str):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.max_batch:
+                    continue
+
+            elif item is not None and item is not self.stop_sentinel:
+                self.write_batch(batch)
+                batch, deadline = [], None
+                item.set()
+                continue
+
+            self.write_batch(batch)
+            batch, deadline = [], None
+
+            if item is self.stop_sentinel:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def write_batch(self, batch):
+        """
+        Appends a batch of lines to the log file, rotating it first if needed.
+
+        Parameters:
+            batch (list): The lines to append.
+        """
+        if not batch:
+            return
+
+        text = "".join(batch)
+        try:
+            if self.should_rotate():
+                self.rotate()
+
+            if self.file is None:
+                self.open_file()
+
+            with self.metrics.timer("chatwizard_log_write_seconds"):
+                self.file.write(text)
+                self.file.flush()
+        except Exception:
+            logger.exception("Could not write %d lines to the log file %s.", len(batch), self.path)
+            self.errors += 1
+            self.dropped += len(batch)
+            self.metrics.increment("chatwizard_log_errors_total")
+            self.discard_file()
+            return
+
+        self.written += len(batch)
+        if self.metrics.enabled:
+            self.metrics.increment("chatwizard_log_bytes_total", len(text.encode("utf-8")))
+
+    def discard_file(self):
+        """
+        Closes the log file after a failed write, so that it is opened again for the next batch.
+        """
+        if self.file is None:
+            return
+
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+        self.file = None
+
+    def open_file(self):
+        """
+        Opens the log file for appending. If the log file does not exist, creates a new log file.
+        """
+        created = not os.path.exists(self.path)
+        self.file = open(self.path, "a")
+        self.file_date = date.today()
+
+        if created:
+            self.file.write("Log file created.\n")
+
+    def should_rotate(self):
+        """
+        Returns `True` if the log file grew past max_bytes, or the day changed and rotate_daily is set.
+
+        Returns:
+            bool: Whether the log file should be rotated before the next write.
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        if self.max_bytes is not None and os.path.getsize(self.path) >= self.max_bytes:
+            return True
+
+        if self.rotate_daily:
+            file_date = self.file_date
+            if file_date is None:
+                file_date = date.fromtimestamp(os.path.getmtime(self.path))
+            return file_date != date.today()
+
+        return False
+
+    def rotate(self):
+        """
+        Renames the log file to a timestamped segment, and compresses the segment if compress is set.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        segment_path = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, segment_path)
+
+        if self.compress:
+            with open(segment_path, "rb") as source, gzip.open(segment_path + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(segment_path)
+
+        self.rotations += 1
+
+    def stats(self):
+        """
+        Returns the counters of the log writer.
+
+        Returns:
+            dict: Number of waiting, written and dropped lines, and number of failed writes and of rotations.
+        """
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "rotations": self.rotations,
+        }
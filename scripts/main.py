@@ -3,24 +3,161 @@ This script is responsible for running the ChatWizard Discord bot. It takes in t
     1. OpenAI API key
     2. Discord API key
 
+The optional --shards argument connects through several gateway shards, and --processes spreads those shards over
+several processes sharing an SQLite score database (--score-backend sqlite) or keeping the scores of their guilds in
+separate files (--score-backend guild).
+
 This script runs the Discord client by initializing an instance of the DiscordBot class and passing it the appropriate
 arguments. It initializes a new instance of the OpenAIHandler class and passes the necessary API key and prompts for
 processing the text and generating various scores on different categories.
 """
 
+import argparse
+import multiprocessing
 import sys
 import discord
 from openai_handler import OpenAIHandler
-from discord_bot import DiscordBot
+from aggregates import ScoreAggregates
+from batch_scorer import BatchScorer
+from debouncer import MessageDebouncer
+from discord_bot import DiscordBot, ShardedDiscordBot
+from leaderboard import Leaderboard
+from log_writer import LogWriter
+from message_filter import MessageFilter
+from metrics import Metrics
+from request_scheduler import RequestScheduler
+from sampling import SamplingPolicy
+from score_cache import ScoreCache
+from scorers import FailoverScorer, FakeOpenAIServer, LexiconScorer
+from score_store import BinaryScoreStore, GuildScoreStore, JSONScoreStore, SQLiteScoreStore
+from token_budget import TokenBudget
+from work_queue import WorkQueue
 
 
-def run(open_ai_api_key, discord_api_key):
+def run(
+    open_ai_api_key,
+    discord_api_key,
+    scoring_mode="separate",
+    flush_interval=30.0,
+    flush_every=50,
+    score_backend="json",
+    log_max_bytes=10 * 1024 * 1024,
+    log_rotate_daily=False,
+    log_compress=False,
+    score_cache_size=10000,
+    score_cache_ttl=24 * 60 * 60,
+    persist_score_cache=False,
+    max_batch_size=1,
+    max_batch_wait=0.5,
+    requests_per_minute=3500,
+    tokens_per_minute=90000,
+    max_in_flight=8,
+    filter_rules=None,
+    guild_filter_rules=None,
+    scoring_backend="openai",
+    failover_latency=None,
+    shard_count=None,
+    shard_ids=None,
+    queue_size=1000,
+    queue_workers=4,
+    overload_policy="drop_oldest",
+    debounce_window=0.0,
+    debounce_max_messages=5,
+    http_pool_size=10,
+    connect_timeout=5.0,
+    read_timeout=30.0,
+    stream_ratings=False,
+    rating_max_tokens=5,
+    metrics_port=None,
+    guild_token_budget=None,
+    channel_token_budget=None,
+    user_token_budget=None,
+    budget_sample_every=5,
+    sampling_mode="full",
+    sampling_method="every",
+    sample_every=10,
+    sampling_window=60.0,
+    samples_per_window=1,
+    guild_sampling_modes=None,
+    channel_sampling_modes=None,
+    score_half_life=7 * 24 * 60 * 60,
+    guild_idle_timeout=600.0,
+    max_loaded_guilds=1000,
+):
     """
     Initializes instances of the OpenAIHandler and DiscordBot classes, and runs the Discord bot.
 
     Parameters:
         open_ai_api_key: A string representing the API key for OpenAI's GPT-3.5-turbo model.
         discord_api_key: A string representing the API key for the Discord bot.
+        scoring_mode: "separate" to rate each category with its own request, or "combined" to rate every category
+            with a single request.
+        flush_interval: Maximum number of seconds updated user scores are kept in memory before being written to disk.
+        flush_every: Number of user score updates that triggers a write before the flush interval ends.
+        score_backend: "json" to keep the user scores in a JSON file written behind, or "sqlite" to upsert them into
+            an SQLite database, "binary" to write them behind to a compact binary file, or "guild" to keep separate
+            scores for every guild in its own JSON file under json/guilds, and their recent score aggregates under
+            json/guild_aggregates. The SQLite database and the binary file import the JSON file once on their first
+            run.
+        log_max_bytes: Size in bytes past which the log file is rotated.
+        log_rotate_daily: Whether the log file is also rotated when the day changes.
+        log_compress: Whether rotated log files are compressed with gzip.
+        score_cache_size: Number of recently scored messages whose scores are reused for repeated messages, 0 to
+            send every message to OpenAI.
+        score_cache_ttl: Number of seconds the scores of a message are reused.
+        persist_score_cache: Whether the cached scores are saved to disk on shutdown and loaded on startup.
+        max_batch_size: Maximum number of messages scored together with a single request, 1 to score every message on
+            its own.
+        max_batch_wait: Maximum number of seconds a message waits for other messages to join its batch.
+        requests_per_minute: Maximum number of requests sent to OpenAI per minute.
+        tokens_per_minute: Maximum number of tokens sent to OpenAI per minute.
+        max_in_flight: Maximum number of requests waiting for a response from OpenAI at the same time.
+        filter_rules: Overrides of the MessageFilter rules deciding which trivial messages are scored locally.
+        guild_filter_rules: Overrides of the MessageFilter rules for particular guilds, keyed by guild ID.
+        scoring_backend: "openai" to score messages with OpenAI, "local" to score them with the local LexiconScorer, or
+            "fake" to send the OpenAI requests to a local FakeOpenAIServer.
+        failover_latency: Number of seconds after which a slow scoring backend is abandoned for the local
+            LexiconScorer, never fails over if None.
+        shard_count: Number of gateway shards of the bot, connects without sharding if None.
+        shard_ids: IDs of the shards run by this process, all of them if None. When set, other processes run the
+            remaining shards, so the SQLite score database is shared and the log file is named after the shards.
+        queue_size: Maximum number of messages waiting to be scored, 0 to score every message as soon as it arrives.
+        queue_workers: Number of messages scored at the same time.
+        overload_policy: What to do with a new message when the queue is full: "drop_oldest" to drop the message that
+            waited the longest, "coalesce" to replace the pending message of the same author, or "log_only" to only
+            log the new message.
+        debounce_window: Number of seconds within which consecutive messages of an author in a channel are merged and
+            scored together with a single reply, 0 to score every message on its own.
+        debounce_max_messages: Number of merged messages that are scored without waiting for the window to end.
+        http_pool_size: Number of connections to OpenAI kept alive and reused, which is also the number of threads
+            sending the requests.
+        connect_timeout: Number of seconds to wait for a connection to OpenAI.
+        read_timeout: Number of seconds to wait for a response of OpenAI.
+        stream_ratings: Whether the rating of each category is streamed and read only until the first number.
+        rating_max_tokens: Maximum number of tokens OpenAI generates for the rating of a category, unlimited if None.
+        metrics_port: Local port the metrics of the bot are served on at /metrics in the Prometheus text format, no
+            metrics are recorded if None.
+        guild_token_budget: Number of OpenAI tokens the messages of a guild may spend per day, unlimited if None. As
+            a budget runs out, messages are rated with the combined prompt, then only some of them are rated, and
+            finally they are scored locally.
+        channel_token_budget: Number of OpenAI tokens the messages of a channel may spend per day, unlimited if None.
+        user_token_budget: Number of OpenAI tokens the messages of a user may spend per day, unlimited if None.
+        budget_sample_every: One message in this many of a channel is rated once a budget is nearly spent.
+        sampling_mode: "full" to score every message, "sampled" to score a weighted sample of them, or "off" to score
+            none, in the channels without an override.
+        sampling_method: "every" to score one message in sample_every of a channel, or "reservoir" to score
+            samples_per_window random messages of each author in each channel per sampling window.
+        sample_every: One message in this many of a sampled channel is scored with the "every" method.
+        sampling_window: Number of seconds of the windows of the "reservoir" method.
+        samples_per_window: Number of messages of an author scored per window with the "reservoir" method.
+        guild_sampling_modes: Sampling modes of the channels of particular guilds, keyed by guild ID.
+        channel_sampling_modes: Sampling modes of particular channels, keyed by channel ID.
+        score_half_life: Number of seconds after which a score counts half in the trend !me shows next to the scores
+            of the last hour, day and week.
+        guild_idle_timeout: Number of seconds after which the scores, rankings and recent aggregates of a guild nobody
+            talked in are dropped from memory, with the "guild" score backend.
+        max_loaded_guilds: Number of guilds whose scores, rankings and recent aggregates are kept in memory, with the
+            "guild" score backend.
 
     Return:
         None
@@ -35,27 +172,221 @@ def run(open_ai_api_key, discord_api_key):
     try:
         log_file_path = "log/log.txt"
         user_scores_path = "json/user_scores.json"
+        user_scores_db_path = "json/user_scores.db"
+        user_scores_binary_path = "json/user_scores.bin"
+        guild_scores_path = "json/guilds"
+        guild_aggregates_path = "json/guild_aggregates"
         grammar_prompt_path = "prompts/grammar.txt"
         friendliness_prompt_path = "prompts/friendliness.txt"
         humor_prompt_path = "prompts/humor.txt"
+        combined_prompt_path = "prompts/combined.txt"
+        batch_prompt_path = "prompts/batch.txt"
+        score_cache_path = "json/score_cache.json"
+
+        metrics = Metrics(enabled=metrics_port is not None)
+
+        score_cache = None
+        if score_cache_size:
+            score_cache = ScoreCache(
+                max_entries=score_cache_size,
+                ttl=score_cache_ttl,
+                path=score_cache_path if persist_score_cache else None,
+            )
+
+        scheduler = RequestScheduler(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_in_flight=max_in_flight,
+        )
+
+        api_base = None
+        if scoring_backend == "fake":
+            api_base = FakeOpenAIServer().start().url
+        elif scoring_backend not in ("openai", "local"):
+            raise ValueError("Invalid scoring backend.")
 
         openai_handler = OpenAIHandler(
             api_key=open_ai_api_key,
             grammar_prompt_path=grammar_prompt_path,
             friendliness_prompt_path=friendliness_prompt_path,
             humor_prompt_path=humor_prompt_path,
+            combined_prompt_path=combined_prompt_path,
+            scoring_mode=scoring_mode,
+            score_cache=score_cache,
+            batch_prompt_path=batch_prompt_path,
+            scheduler=scheduler,
+            api_base=api_base,
+            pool_size=http_pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            streaming=stream_ratings,
+            max_tokens=rating_max_tokens,
+            metrics=metrics,
+        )
+
+        scorer = openai_handler
+        if scoring_backend == "local":
+            scorer = LexiconScorer()
+        elif failover_latency is not None:
+            scorer = FailoverScorer(
+                primary=openai_handler,
+                fallback=LexiconScorer(),
+                latency_threshold=failover_latency,
+            )
+
+        batch_scorer = None
+        if max_batch_size > 1:
+            batch_scorer = BatchScorer(
+                openai_handler=scorer,
+                max_batch_size=max_batch_size,
+                max_wait=max_batch_wait,
+            )
+
+        aggregates_path = "json/score_aggregates.json"
+        if shard_ids is not None:
+            log_file_path = f"log/log-shard-{shard_ids[0]}.txt"
+            aggregates_path = f"json/score_aggregates-shard-{shard_ids[0]}.json"
+
+        if score_backend == "sqlite":
+            score_store = SQLiteScoreStore(
+                path=user_scores_db_path,
+                shared=shard_ids is not None,
+                default_scores=scorer.generate_default_scores(),
+            )
+            score_store.migrate_from_json(user_scores_path)
+        elif score_backend == "json":
+            score_store = JSONScoreStore(
+                path=user_scores_path,
+                flush_interval=flush_interval,
+                flush_every=flush_every,
+            )
+        elif score_backend == "binary":
+            score_store = BinaryScoreStore(
+                path=user_scores_binary_path,
+                flush_interval=flush_interval,
+                flush_every=flush_every,
+            )
+            score_store.migrate_from_json(user_scores_path)
+        elif score_backend == "guild":
+            score_store = GuildScoreStore(
+                directory=guild_scores_path,
+                flush_interval=flush_interval,
+                flush_every=flush_every,
+                idle_timeout=guild_idle_timeout,
+                max_shards=max_loaded_guilds,
+            )
+        else:
+            raise ValueError("Invalid score backend.")
+
+        log_writer = LogWriter(
+            path=log_file_path,
+            max_bytes=log_max_bytes,
+            rotate_daily=log_rotate_daily,
+            compress=log_compress,
+            metrics=metrics,
+        )
+
+        message_filter = MessageFilter(
+            rules=filter_rules,
+            guild_rules=guild_filter_rules,
+            calls_per_message=1 if scoring_mode == "combined" else len(scorer.categories),
+        )
+
+        work_queue = None
+        if queue_size > 0:
+            work_queue = WorkQueue(
+                max_size=queue_size,
+                workers=queue_workers,
+                overload_policy=overload_policy,
+                metrics=metrics,
+            )
+
+        debouncer = None
+        if debounce_window > 0:
+            debouncer = MessageDebouncer(window=debounce_window, max_messages=debounce_max_messages)
+
+        token_budget = None
+        if any(budget is not None for budget in (guild_token_budget, channel_token_budget, user_token_budget)):
+            token_budget = TokenBudget(
+                guild_budget=guild_token_budget,
+                channel_budget=channel_token_budget,
+                user_budget=user_token_budget,
+                sample_every=budget_sample_every,
+            )
+
+        sampling_policy = None
+        if sampling_mode != "full" or guild_sampling_modes or channel_sampling_modes:
+            sampling_policy = SamplingPolicy(
+                mode=sampling_mode,
+                method=sampling_method,
+                every=sample_every,
+                window=sampling_window,
+                per_window=samples_per_window,
+                guild_modes=guild_sampling_modes,
+                channel_modes=channel_sampling_modes,
+            )
+
+        if score_store.partitioned:
+            aggregates_path = guild_aggregates_path
+
+        aggregates = ScoreAggregates(
+            categories=scorer.categories,
+            half_life=score_half_life,
+            path=aggregates_path,
+            partitioned=score_store.partitioned,
         )
+
         intents = discord.Intents.default()
         intents.members = True
         intents.message_content = True
 
-        bot = DiscordBot(
+        bot_class = DiscordBot
+        options = {}
+        if shard_count is not None:
+            bot_class = ShardedDiscordBot
+            options = {"shard_count": shard_count, "shard_ids": shard_ids}
+
+        bot = bot_class(
             intents=intents,
-            openai_handler=openai_handler,
+            openai_handler=scorer,
             log_file_path=log_file_path,
             user_scores_path=user_scores_path,
+            score_store=score_store,
+            log_writer=log_writer,
+            batch_scorer=batch_scorer,
+            message_filter=message_filter,
+            work_queue=work_queue,
+            debouncer=debouncer,
+            metrics=metrics,
+            token_budget=token_budget,
+            sampling_policy=sampling_policy,
+            aggregates=aggregates,
+            leaderboard=Leaderboard(scorer.categories, partitioned=score_store.partitioned),
+            **options,
         )
 
+        if metrics.enabled:
+            components = {
+                "chatwizard_openai": openai_handler,
+                "chatwizard_scheduler": scheduler,
+                "chatwizard_score_cache": score_cache,
+                "chatwizard_batch": batch_scorer,
+                "chatwizard_log": log_writer,
+                "chatwizard_filter": message_filter,
+                "chatwizard_queue": work_queue,
+                "chatwizard_debounce": debouncer,
+                "chatwizard_budget": token_budget,
+                "chatwizard_sampling": sampling_policy,
+                "chatwizard_aggregates": aggregates,
+                "chatwizard_leaderboard": bot.leaderboard,
+                "chatwizard_score_store": score_store if score_backend == "guild" else None,
+            }
+            for prefix, component in components.items():
+                if component is not None:
+                    metrics.add_collector(prefix, component.stats)
+
+            metrics.start_server(port=metrics_port)
+
         if discord_api_key and openai_handler:
             bot.run(discord_api_key)
 
@@ -64,10 +395,101 @@ def run(open_ai_api_key, discord_api_key):
         raise discord.errors.DiscordException
 
 
+def split_shards(shard_count, processes):
+    """
+    Splits the shards of the bot between processes.
+
+    Parameters:
+        shard_count: The number of gateway shards of the bot.
+        processes: The number of processes running the shards.
+
+    Return:
+        A list holding the shard IDs of each process.
+    """
+    return [list(range(index, shard_count, processes)) for index in range(min(processes, shard_count))]
+
+
+def launch_shards(open_ai_api_key, discord_api_key, shard_count, processes, **options):
+    """
+    Runs the Discord bot with the given number of gateway shards, spread over the given number of processes.
+
+    Parameters:
+        open_ai_api_key: A string representing the API key for OpenAI's GPT-3.5-turbo model.
+        discord_api_key: A string representing the API key for the Discord bot.
+        shard_count: The number of gateway shards of the bot.
+        processes: The number of processes running the shards.
+        **options: Further keyword arguments of run.
+
+    Return:
+        None
+
+    Exceptions:
+        Raises a ValueError if the shards are spread over several processes with the json score backend, whose single
+        file they would overwrite.
+    """
+    if processes <= 1:
+        run(open_ai_api_key, discord_api_key, shard_count=shard_count, **options)
+        return
+
+    if options.get("score_backend", "json") not in ("sqlite", "guild"):
+        raise ValueError("Running shards in several processes requires the sqlite or guild score backend.")
+
+    workers = [
+        multiprocessing.Process(
+            target=run,
+            args=(open_ai_api_key, discord_api_key),
+            kwargs=dict(options, shard_count=shard_count, shard_ids=shard_ids),
+            name=f"ChatWizard-shards-{shard_ids[0]}",
+        )
+        for shard_ids in split_shards(shard_count, processes)
+    ]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+
+def parse_arguments(arguments):
+    """
+    Parses the command line arguments.
+
+    Parameters:
+        arguments: The command line arguments, without the script name.
+
+    Return:
+        An argparse.Namespace holding the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Runs the ChatWizard Discord bot.")
+    parser.add_argument("open_ai_api_key", help="API key for OpenAI")
+    parser.add_argument("discord_api_key", help="API key for the Discord bot")
+    parser.add_argument("--shards", type=int, default=None, help="number of gateway shards, no sharding by default")
+    parser.add_argument("--processes", type=int, default=1, help="number of processes the shards are spread over")
+    parser.add_argument(
+        "--score-backend", choices=["json", "sqlite", "binary", "guild"], default="json", help="where scores are stored"
+    )
+    parsed = parser.parse_args(arguments)
+
+    if parsed.processes > 1 and parsed.shards is None:
+        parser.error("--processes requires --shards")
+
+    return parsed
+
+
 def main():
-    open_ai_api_key = sys.argv[1]
-    discord_api_key = sys.argv[2]
-    run(open_ai_api_key, discord_api_key)
+    arguments = parse_arguments(sys.argv[1:])
+
+    if arguments.shards is None:
+        run(arguments.open_ai_api_key, arguments.discord_api_key, score_backend=arguments.score_backend)
+    else:
+        launch_shards(
+            arguments.open_ai_api_key,
+            arguments.discord_api_key,
+            shard_count=arguments.shards,
+            processes=arguments.processes,
+            score_backend=arguments.score_backend,
+        )
 
 
 if __name__ == "__main__":
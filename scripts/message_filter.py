@@ -0,0 +1,180 @@
+"""
+This script contains the implementation of the MessageFilter class, which recognizes trivial messages locally so that
+they do not need to be sent to OpenAI for scoring.
+"""
+
+import re
+import threading
+import unicodedata
+
+CUSTOM_EMOJI = re.compile(r"<a?:\w+:\d+>")
+URL = re.compile(r"https?://\S+")
+
+
+class MessageFilter:
+    """
+    A fast local pre-classifier deciding what to do with a message before it is scored.
+
+    Each rule recognizes a kind of trivial message and maps it to an action: "score" sends the message to OpenAI as
+    usual, "neutral" gives it a neutral score without any request, and "skip" does not score it at all. The rules can
+    be overridden per guild.
+    """
+
+    actions = ['score', 'neutral', 'skip']
+    default_rules = {
+        "empty": "skip",
+        "link_only": "skip",
+        "emoji_only": "neutral",
+        "too_short": "neutral",
+        "min_length": 2,
+    }
+
+    def __init__(self, rules=None, guild_rules=None, calls_per_message=3):
+        """
+        Initializes a new instance of the MessageFilter class.
+
+        Parameters:
+            rules (dict): Overrides of the default rules, for every guild.
+            guild_rules (dict): Overrides of the rules for particular guilds, keyed by guild ID.
+            calls_per_message (int): Number of OpenAI requests a scored message costs, used to count the saved calls.
+
+        Raises:
+            ValueError: If a rule maps to an action that is not recognized.
+        """
+        self.rules = dict(self.default_rules, **(rules or {}))
+        self.guild_rules = {}
+        self.calls_per_message = calls_per_message
+        self.counts = {}
+        self.lock = threading.Lock()
+
+        self.validate_rules(self.rules)
+        for guild_id, overrides in (guild_rules or {}).items():
+            self.set_guild_rules(guild_id, overrides)
+
+    def validate_rules(self, rules):
+        """
+        Checks that every rule of the given rules maps to a recognized action.
+
+        Parameters:
+            rules (dict): The rules to check.
+
+        Raises:
+            ValueError: If a rule maps to an action that is not recognized.
+        """
+        for name, action in rules.items():
+            if name != "min_length" and action not in self.actions:
+                raise ValueError("Invalid action.")
+
+    def set_guild_rules(self, guild_id, overrides):
+        """
+        Overrides the rules for a particular guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild.
+            overrides (dict): The rules to override for the guild.
+
+        Raises:
+            ValueError: If a rule maps to an action that is not recognized.
+        """
+        rules = dict(self.rules, **overrides)
+        self.validate_rules(rules)
+        self.guild_rules[guild_id] = rules
+
+    def get_rules(self, guild_id=None):
+        """
+        Returns the rules in effect for a guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+
+        Returns:
+            dict: The rules of the guild.
+        """
+        return self.guild_rules.get(guild_id, self.rules)
+
+    def classify(self, content, guild_id=None):
+        """
+        Decides what to do with a message.
+
+        Parameters:
+            content (str): The content of the message.
+            guild_id (int): The ID of the guild the message was sent in, or None for direct messages.
+
+        Returns:
+            tuple: The action ("score", "neutral" or "skip") and the name of the rule that decided it, or None if no
+                rule matched.
+        """
+        rules = self.get_rules(guild_id)
+        rule = self.match_rule(content, rules["min_length"])
+        action = rules[rule] if rule is not None else "score"
+
+        if action != "score":
+            with self.lock:
+                self.counts[rule] = self.counts.get(rule, 0) + 1
+
+        return action, rule
+
+    def match_rule(self, content, min_length):
+        """
+        Returns the name of the first rule recognizing the message.
+
+        Parameters:
+            content (str): The content of the message.
+            min_length (int): Minimum number of characters of a message that is not too short.
+
+        Returns:
+            str: The name of the rule, or None if the message is not trivial.
+        """
+        stripped = content.strip()
+        if not stripped:
+            return "empty"
+
+        if URL.search(stripped) and not URL.sub("", stripped).strip():
+            return "link_only"
+
+        if self.is_emoji_only(stripped):
+            return "emoji_only"
+
+        if len(stripped) < min_length:
+            return "too_short"
+
+        return None
+
+    def is_emoji_only(self, content):
+        """
+        Returns `True` if the message consists of emoji only, custom Discord emoji included.
+
+        Parameters:
+            content (str): The stripped content of the message.
+
+        Returns:
+            bool: Whether the message consists of emoji only.
+        """
+        remaining = "".join(CUSTOM_EMOJI.sub("", content).split())
+        if not remaining:
+            return True
+
+        symbols = 0
+        for character in remaining:
+            category = unicodedata.category(character)
+            if category == "So":
+                symbols += 1
+            elif category not in ("Sk", "Mn", "Me", "Cf"):
+                return False
+
+        return symbols > 0
+
+    def stats(self):
+        """
+        Returns the counters of the filter.
+
+        Returns:
+            dict: Number of messages decided by each rule, and the number of OpenAI requests saved.
+        """
+        with self.lock:
+            filtered = sum(self.counts.values())
+            return {
+                "rules": dict(self.counts),
+                "filtered": filtered,
+                "api_calls_saved": filtered * self.calls_per_message,
+            }
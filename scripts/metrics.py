@@ -0,0 +1,259 @@
+"""
+This script contains the implementation of the Metrics class, which records counters and latency histograms of the
+stages of the ChatWizard pipeline and serves them in the Prometheus text format on a local /metrics endpoint.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timer:
+    """
+    A context manager observing the number of seconds its block took in a histogram.
+    """
+
+    __slots__ = ('metrics', 'name', 'labels', 'started')
+
+    def __init__(self, metrics, name, labels):
+        """
+        Initializes a new instance of the Timer class.
+
+        Parameters:
+            metrics (Metrics): The metrics the latency is recorded in.
+            name (str): The name of the histogram.
+            labels (dict): The labels of the histogram.
+        """
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    A thread-safe registry of counters and latency histograms.
+
+    When disabled, every method returns immediately without taking the lock or reading the clock, so the
+    instrumentation left in the hot paths costs a single attribute check. Gauges are not recorded on the hot paths at
+    all; the stats() methods of the components are registered as collectors and read only when the metrics are
+    scraped.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes a new instance of the Metrics class.
+
+        Parameters:
+            enabled (bool): Whether anything is recorded.
+            buckets (tuple): Upper bounds of the histogram buckets in seconds, in increasing order.
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Adds to a counter.
+
+        Parameters:
+            name (str): The name of the counter.
+            amount (float): The amount to add.
+            **labels: The labels of the counter.
+        """
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value, usually a latency in seconds, in a histogram.
+
+        Parameters:
+            name (str): The name of the histogram.
+            value (float): The value to record.
+            **labels: The labels of the histogram.
+        """
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def timer(self, name, **labels):
+        """
+        Returns a context manager recording how long its block took in a histogram.
+
+        Parameters:
+            name (str): The name of the histogram.
+            **labels: The labels of the histogram.
+
+        Returns:
+            Timer: The context manager, or a no-op one if the metrics are disabled.
+        """
+        if not self.enabled:
+            return nullcontext()
+
+        return Timer(self, name, labels)
+
+    def add_collector(self, prefix, collect):
+        """
+        Registers a function whose numeric results are exported as gauges whenever the metrics are rendered.
+
+        Parameters:
+            prefix (str): The prefix of the names of the gauges.
+            collect (callable): Function returning a possibly nested dict of numbers, such as a stats() method.
+        """
+        self.collectors[prefix] = collect
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(counts), total, count)) for key, (counts, total, count) in self.histograms.items()
+            )
+
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_name, labels), (counts, total, count) in histograms:
+                if histogram_name != name:
+                    continue
+
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{self.format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+
+        for prefix, collect in sorted(self.collectors.items()):
+            for name, value in self.flatten(prefix, collect()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def flatten(self, prefix, values):
+        """
+        Flattens a nested dict of numbers into gauge names and values.
+
+        Parameters:
+            prefix (str): The prefix of the names.
+            values (dict): The possibly nested dict of numbers.
+
+        Returns:
+            list: (name, value) tuples, skipping the values that are not numbers.
+        """
+        gauges = []
+        for key, value in values.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                gauges.extend(self.flatten(name, value))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges.append((name, value))
+
+        return gauges
+
+    def format_labels(self, labels):
+        """
+        Formats the labels of a metric.
+
+        Parameters:
+            labels (tuple): (name, value) tuples of the labels.
+
+        Returns:
+            str: The labels in braces, or an empty string if there are none.
+        """
+        if not labels:
+            return ""
+
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+    def start_server(self, host="127.0.0.1", port=9100):
+        """
+        Starts serving the metrics on http://host:port/metrics from a background thread.
+
+        Parameters:
+            host (str): The host to listen on.
+            port (int): The port to listen on, a free one is picked if 0.
+
+        Returns:
+            int: The port the metrics are served on.
+        """
+        metrics = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), RequestHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ChatWizard-metrics", daemon=True)
+        self.thread.start()
+        return self.server.server_address[1]
+
+    def stop_server(self):
+        """
+        Stops serving the metrics.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+
+
+NULL_METRICS = Metrics(enabled=False)
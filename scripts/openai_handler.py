@@ -3,10 +3,110 @@ This script handles interactions with OpenAI's API and includes methods to calcu
 grammar, friendliness, and humor.
 """
 
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import openai
+import requests
+from metrics import NULL_METRICS
+from prompt_cache import PromptCache
+from request_scheduler import TRANSIENT_ERRORS
+from scorers import Scorer
+
+
+def percentile(samples, fraction):
+    """
+    Returns the nearest-rank percentile of the given samples.
+
+    Parameters:
+        samples (list): The samples, in any order.
+        fraction (float): The percentile as a fraction, such as 0.95 for the 95th percentile.
+
+    Returns:
+        float: The percentile, or 0.0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1]
+
+
+class RatingParser:
+    """
+    An incremental parser extracting the first integer of a response, fed the response piece by piece as it streams
+    in. Only the digits of the integer are looked at, so any chatter of the model around it is skipped without
+    building up the text.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new instance of the RatingParser class.
+        """
+        self.value = None
+        self.complete = False
+
+    def feed(self, text):
+        """
+        Parses the next piece of a response.
+
+        Parameters:
+            text (str): the next piece of the response
+
+        Returns:
+            int: the rating, or None if the response did not yet reach the end of an integer
+        """
+        for character in text:
+            if "0" <= character <= "9":
+                self.value = (self.value or 0) * 10 + ord(character) - 48
+            elif self.value is not None:
+                self.complete = True
+                return self.value
+
+        return None
+
+    def finish(self):
+        """
+        Returns the rating once the whole response was fed.
+
+        Returns:
+            int: the rating
+
+        Raises:
+            ValueError: If the response contains no integer.
+        """
+        if self.value is None:
+            raise ValueError("Invalid rating.")
+
+        return self.value
 
 
-class OpenAIHandler:
+def parse_rating(text):
+    """
+    Extracts the first integer of a complete response, so that "7", "7." and "I would rate it 7/10" all give 7.
+
+    Parameters:
+        text (str): the response
+
+    Returns:
+        int: the rating
+
+    Raises:
+        ValueError: If the response contains no integer.
+    """
+    parser = RatingParser()
+    rating = parser.feed(text)
+    return rating if rating is not None else parser.finish()
+
+
+class OpenAIHandler(Scorer):
     """
     Initializes a new instance of the OpenAIHandler class.
 
@@ -15,9 +115,46 @@ class OpenAIHandler:
         grammar_prompt_path (str): Path to grammar prompt text file
         friendliness_prompt_path (str): Path to friendliness prompt text file
         humor_prompt_path (str): Path to humor prompt text file
+        combined_prompt_path (str): Path to the prompt text file that rates every category at once
+        scoring_mode (str): "separate" for one request per category, "combined" for a single request
+        executor (concurrent.futures.Executor): Executor running the blocking requests of the async API
+        owns_executor (bool): Whether the executor was created by the handler and is shut down when it closes
+        prompt_cache (PromptCache): Cache holding the prompt templates
+        score_cache (ScoreCache): Cache holding the scores of recently scored messages
+        batch_prompt_path (str): Path to the prompt text file that rates several messages at once
+        scheduler (RequestScheduler): Scheduler enforcing the rate limits and retrying the requests
+        api_base (str): Base URL of an OpenAI-compatible API to use instead of OpenAI's
+        pool_size (int): Number of kept-alive connections to the API
+        connect_timeout (float): Number of seconds to wait for a connection to the API
+        read_timeout (float): Number of seconds to wait for a response of the API
+        streaming (bool): Whether category ratings are streamed and the stream is stopped at the first rating
+        max_tokens (int): Maximum number of tokens generated for a category rating
+        metrics (Metrics): Metrics the latency, errors and token usage of the requests are recorded in
     """
 
-    def __init__(self, api_key, grammar_prompt_path, friendliness_prompt_path, humor_prompt_path):
+    scoring_modes = ['separate', 'combined']
+
+    def __init__(
+        self,
+        api_key,
+        grammar_prompt_path,
+        friendliness_prompt_path,
+        humor_prompt_path,
+        combined_prompt_path=None,
+        scoring_mode="separate",
+        executor=None,
+        prompt_cache=None,
+        score_cache=None,
+        batch_prompt_path=None,
+        scheduler=None,
+        api_base=None,
+        pool_size=10,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        streaming=False,
+        max_tokens=5,
+        metrics=None,
+    ):
         """
         Initializes a new instance of the OpenAIHandler class.
 
@@ -26,13 +163,83 @@ class OpenAIHandler:
             grammar_prompt_path (str): path to grammar prompt text file
             friendliness_prompt_path (str): path to friendliness prompt text file
             humor_prompt_path (str): path to humor prompt text file
+            combined_prompt_path (str): path to the prompt text file that rates every category at once
+            scoring_mode (str): "separate" for one request per category, "combined" for a single request
+            executor (concurrent.futures.Executor): executor running the blocking requests of the async API, a
+                pool of pool_size threads is created, and shut down by close, if None
+            prompt_cache (PromptCache): cache holding the prompt templates, a new one is created if None
+            score_cache (ScoreCache): cache holding the scores of recently scored messages, every message is sent to
+                OpenAI if None
+            batch_prompt_path (str): path to the prompt text file that rates several messages at once
+            scheduler (RequestScheduler): scheduler enforcing the rate limits and retrying the requests, requests are
+                sent directly and never retried if None
+            api_base (str): base URL of an OpenAI-compatible API to use instead of OpenAI's, such as the one of a
+                FakeOpenAIServer
+            pool_size (int): number of connections to the API kept alive and reused between requests, which should
+                match the number of threads of the executor
+            connect_timeout (float): number of seconds to wait for a connection to the API
+            read_timeout (float): number of seconds to wait for a response of the API
+            streaming (bool): whether category ratings are streamed, so that reading stops as soon as a rating
+                arrived
+            max_tokens (int): maximum number of tokens the model generates for a category rating, unlimited if None
+            metrics (Metrics): metrics the latency, errors and token usage of the requests are recorded in, nothing
+                is recorded if None
+
+        Raises:
+            ValueError: If the scoring mode is not recognized, or combined mode is requested without a prompt.
         """
+        if scoring_mode not in self.scoring_modes:
+            raise ValueError("Invalid scoring mode.")
+
+        if scoring_mode == "combined" and combined_prompt_path is None:
+            raise ValueError("Combined scoring mode requires a combined prompt path.")
+
         self.api_key = api_key
         self.grammar_prompt_path = grammar_prompt_path
         self.friendliness_prompt_path = friendliness_prompt_path
         self.humor_prompt_path = humor_prompt_path
+        self.combined_prompt_path = combined_prompt_path
+        self.scoring_mode = scoring_mode
+        self.owns_executor = executor is None
+        self.executor = (
+            executor
+            if executor is not None
+            else ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="ChatWizard-openai")
+        )
+        self.prompt_cache = prompt_cache if prompt_cache is not None else PromptCache()
+        self.prompt_version = None
+        self.score_cache = score_cache
+        self.batch_prompt_path = batch_prompt_path
+        self.scheduler = scheduler
+        self.api_base = api_base
+        self.pool_size = pool_size
+        self.request_timeout = (connect_timeout, read_timeout)
+        self.streaming = streaming
+        self.max_tokens = max_tokens
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.session = self.create_session()
 
         openai.api_key = api_key
+        openai.requestssession = self.session
+
+    def create_session(self):
+        """
+        Creates the HTTP session the requests to the API are sent with. Its connections are kept alive and pooled, so
+        that consecutive requests do not pay for a new connection and TLS handshake. Failed requests are retried by
+        the scheduler rather than by the session.
+
+        Returns:
+            requests.Session: The pooled session.
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def get_response(self, content):
         """
@@ -44,174 +251,717 @@ class OpenAIHandler:
         Returns:
             str: generated response from OpenAI API
         """
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": content},
-            ],
-        )
+        return self.create_chat_completion(content, model="gpt-4")
+
+    def create_chat_completion(self, prompt, model="gpt-3.5-turbo", max_tokens=None, usage=None):
+        """
+        Sends a single system prompt to the chat completion endpoint and returns the text of the first choice.
+
+        Parameters:
+            prompt (str): system prompt to send
+            model (str): name of the chat model to use
+            max_tokens (int): maximum number of tokens to generate, unlimited if None
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
+
+        Returns:
+            str: generated response from OpenAI API
+        """
+
+        def request():
+            return openai.ChatCompletion.create(**self.build_request(prompt, model, max_tokens))
+
+        response = self.send_request(request, prompt)
+        if isinstance(response, dict) and "usage" in response:
+            self.record_usage(response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"], usage)
+
         return response.choices[0]["message"]["content"]
 
-    def generate_default_scores(self):
+    def stream_rating(self, prompt, model="gpt-3.5-turbo", max_tokens=None, usage=None):
+        """
+        Streams the response to a rating prompt and stops reading it as soon as it contains a whole integer.
+
+        Streamed responses do not report their usage, so the prompt tokens are estimated and every chunk read counts
+        as one completion token. The rest of the stream is read in the background by release_stream, so that its
+        connection returns to the pool.
+
+        Parameters:
+            prompt (str): system prompt to send
+            model (str): name of the chat model to use
+            max_tokens (int): maximum number of tokens to generate, unlimited if None
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
+
+        Returns:
+            int: the rating
+
+        Raises:
+            ValueError: If the response contains no integer.
+        """
+
+        chunks = 0
+
+        def request():
+            nonlocal chunks
+            parser = RatingParser()
+            stream = openai.ChatCompletion.create(stream=True, **self.build_request(prompt, model, max_tokens))
+            for chunk in stream:
+                chunks += 1
+                rating = parser.feed(chunk.choices[0]["delta"].get("content", ""))
+                if rating is not None:
+                    self.release_stream(stream, max_tokens)
+                    return rating
+
+            return parser.finish()
+
+        try:
+            return self.send_request(request, prompt)
+        finally:
+            if chunks:
+                self.record_usage(self.estimate_tokens(prompt), chunks, usage)
+
+    def release_stream(self, stream, max_tokens):
+        """
+        Reads the rest of a streamed response from the executor, so that its connection returns to the pool once the
+        response ends. A stream whose length is not bounded by max_tokens, or that cannot be handed to the executor
+        because it shut down, is closed instead, which drops its connection.
+
+        Parameters:
+            stream (generator): The chunks of the streamed response that were not read yet.
+            max_tokens (int): The maximum number of tokens of the response, unlimited if None.
+        """
+
+        def drain():
+            try:
+                for _ in stream:
+                    pass
+            except Exception:
+                pass
+            finally:
+                stream.close()
+
+        if max_tokens is None:
+            stream.close()
+            return
+
+        try:
+            self.executor.submit(drain)
+        except RuntimeError:
+            stream.close()
+
+    def build_request(self, prompt, model, max_tokens):
+        """
+        Returns the keyword arguments of a chat completion request sending a single system prompt.
+
+        Parameters:
+            prompt (str): system prompt to send
+            model (str): name of the chat model to use
+            max_tokens (int): maximum number of tokens to generate, unlimited if None
+
+        Returns:
+            dict: the keyword arguments of openai.ChatCompletion.create
+        """
+        arguments = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": prompt},
+            ],
+            "api_key": self.api_key,
+            "api_base": self.api_base,
+            "request_timeout": self.request_timeout,
+        }
+
+        if max_tokens is not None:
+            arguments["max_tokens"] = max_tokens
+
+        return arguments
+
+    def send_request(self, request, prompt):
+        """
+        Sends a request through the scheduler if there is one, and records its latency.
+
+        Parameters:
+            request (callable): function sending the request and returning its result
+            prompt (str): the prompt sent by the request, used to estimate its tokens
+
+        Returns:
+            object: the result of the request
+        """
+
+        def timed_request():
+            started = time.perf_counter()
+            try:
+                return request()
+            except openai.error.OpenAIError as error:
+                self.metrics.increment("chatwizard_openai_errors_total", error=type(error).__name__)
+                raise
+            finally:
+                self.record_latency(time.perf_counter() - started)
+
+        if self.scheduler is None:
+            return timed_request()
+
+        return self.scheduler.submit(timed_request, tokens=self.estimate_tokens(prompt))
+
+    def record_latency(self, latency):
+        """
+        Records the latency of a request sent to the API, keeping the latest thousand of them.
+
+        Parameters:
+            latency (float): number of seconds the request took
+        """
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+        self.metrics.observe("chatwizard_openai_request_seconds", latency)
+
+    def record_usage(self, prompt_tokens, completion_tokens, usage=None):
+        """
+        Records the tokens a chat completion consumed.
+
+        Parameters:
+            prompt_tokens (int): number of tokens of the prompt
+            completion_tokens (int): number of tokens generated
+            usage (dict): token counts the tokens are added to, if not None
+        """
+        self.metrics.increment("chatwizard_openai_tokens_total", prompt_tokens, kind="prompt")
+        self.metrics.increment("chatwizard_openai_tokens_total", completion_tokens, kind="completion")
+
+        if usage is not None:
+            with self.lock:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + prompt_tokens
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + completion_tokens
+                usage["total_tokens"] = usage.get("total_tokens", 0) + prompt_tokens + completion_tokens
+
+    def stats(self):
+        """
+        Returns the number of requests sent to the API and the percentiles of their latencies.
+
+        Returns:
+            dict: number of requests, and the 50th, 95th and 99th percentiles and the maximum of the latest latencies
+        """
+        with self.lock:
+            latencies = list(self.latencies)
+            requests_sent = self.requests
+
+        return {
+            "requests": requests_sent,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=0.0),
+        }
+
+    def estimate_tokens(self, prompt):
+        """
+        Estimates the number of tokens a request consumes, counting roughly four characters per token.
+
+        Parameters:
+            prompt (str): system prompt to send
+
+        Returns:
+            int: estimated number of tokens
+        """
+        return len(prompt) // 4 + 1
+
+    def get_prompt_path(self, category):
+        """
+        Returns the prompt file path of the given category.
+
+        Parameters:
+            category (str): one of "grammar", "friendliness" or "humor"
+
+        Returns:
+            str: path to the prompt text file
+
+        Raises:
+            ValueError: If the category is not recognized.
+        """
+        prompt_paths = {
+            "grammar": self.grammar_prompt_path,
+            "friendliness": self.friendliness_prompt_path,
+            "humor": self.humor_prompt_path,
+        }
+
+        if category not in prompt_paths:
+            raise ValueError("Invalid category.")
+
+        return prompt_paths[category]
+
+    def read_prompt(self, prompt_path):
         """
-        Generates default scores for each category.
+        Returns the prompt template stored at the given path. The file is only read again when it has changed.
+
+        Parameters:
+            prompt_path (str): path to the prompt text file
 
         Returns:
-            dict: default scores for each category
+            str: the prompt template
         """
-        return {"grammar": 10, "friendliness": 10, "humor": 10}
+        return self.prompt_cache.get(prompt_path)
 
-    def get_message_score(self, content):
+    def get_message_score(self, content, usage=None, scoring_mode=None):
         """
         Processes the text and generates various scores on different categories.
 
+        Messages found in the score cache are answered without any request.
+
         Parameters:
             content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the requests are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the handler's own, if not None
 
         Returns:
             dict: scores for each category
         """
-        return {
-            "grammar": self.get_grammar_score(content),
-            "friendliness": self.get_friendliness_score(content),
-            "humor": self.get_humor_score(content),
-        }
+        if self.score_cache is None:
+            return self.calculate_message_score(content, usage, scoring_mode)
 
-    def get_grammar_score(self, content):
+        prompt_version = self.get_prompt_version()
+        scores = self.score_cache.get(content, prompt_version)
+        if scores is None:
+            scores = self.calculate_message_score(content, usage, scoring_mode)
+            self.cache_message_score(content, prompt_version, scores)
+
+        return scores
+
+    async def aget_message_score(self, content, usage=None, scoring_mode=None):
         """
-        Calculates the grammar score for a given message.
+        Asynchronous version of get_message_score that does not block the event loop.
 
         Parameters:
             content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the requests are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the handler's own, if not None
 
         Returns:
-            int: grammar score [-1, 0, 1]
+            dict: scores for each category
         """
-        with open(self.grammar_prompt_path, "r") as file:
-            prompt = file.read()
+        if self.score_cache is None:
+            return await self.acalculate_message_score(content, usage, scoring_mode)
 
-        prompt += content
+        prompt_version = self.get_prompt_version()
+        scores = self.score_cache.get(content, prompt_version)
+        if scores is None:
+            scores = await self.acalculate_message_score(content, usage, scoring_mode)
+            self.cache_message_score(content, prompt_version, scores)
 
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": prompt},
-                ],
-            )
+        return scores
 
-            grammar_score = response.choices[0]["message"]["content"]
+    def calculate_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Sends the text to OpenAI and generates various scores on different categories.
 
-            grammar_score = int(grammar_score)
-            grammar_score = ((grammar_score / 5) - 1) * 10
+        In combined mode a single request rates every category; if its response cannot be parsed, the scores are
+        calculated with one request per category instead.
 
-            if grammar_score < -10 or grammar_score > 10:
-                return -1001
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the requests are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the handler's own, if not None
 
-        except openai.error.AuthenticationError:
-            print("No API key provided")
-            return -1001
+        Returns:
+            dict: scores for each category
+        """
+        if self.use_combined_mode(scoring_mode):
+            scores = self.get_combined_score(content, usage)
+            if scores is not None:
+                return scores
 
-        except ValueError:  # meaning API did not produce a pure number
-            return -1001
+        return {category: self.get_category_score(category, content, usage) for category in self.categories}
 
-        if grammar_score <= 0:
-            return -1
-        if grammar_score == 0:
-            return 0
-        if grammar_score >= 0:
-            return 1
+    async def acalculate_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Asynchronous version of calculate_message_score that does not block the event loop.
 
-    def get_friendliness_score(self, content):
+        The blocking requests run in the executor, and the categories are scored concurrently.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the requests are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the handler's own, if not None
+
+        Returns:
+            dict: scores for each category
         """
-        Calculates the friendliness score for a given message.
+        if self.use_combined_mode(scoring_mode):
+            scores = await self.run_blocking(self.get_combined_score, content, usage)
+            if scores is not None:
+                return scores
+
+        results = await asyncio.gather(
+            *(self.aget_category_score(category, content, usage) for category in self.categories)
+        )
+        return dict(zip(self.categories, results))
+
+    def use_combined_mode(self, scoring_mode=None):
+        """
+        Returns `True` if messages are rated with the combined prompt.
+
+        Parameters:
+            scoring_mode (str): scoring mode to use instead of the handler's own, if not None
+
+        Returns:
+            bool: whether the combined prompt is used
+
+        Raises:
+            ValueError: If the scoring mode is not recognized, or combined mode is requested without a prompt.
+        """
+        if scoring_mode is None:
+            scoring_mode = self.scoring_mode
+
+        if scoring_mode not in self.scoring_modes:
+            raise ValueError("Invalid scoring mode.")
+
+        if scoring_mode == "combined" and self.combined_prompt_path is None:
+            raise ValueError("Combined scoring mode requires a combined prompt path.")
+
+        return scoring_mode == "combined"
+
+    def cache_message_score(self, content, prompt_version, scores):
+        """
+        Stores the scores of a message in the score cache, unless a category could not be calculated.
+
+        Parameters:
+            content (str): text the scores were generated for
+            prompt_version (str): version of the prompts that generated the scores
+            scores (dict): scores for each category
+        """
+        if -1001 not in scores.values():
+            self.score_cache.put(content, prompt_version, scores)
+
+    def get_prompt_version(self):
+        """
+        Returns a version of the prompt templates, which changes whenever one of the prompt files is edited. The prompt
+        files are only stat-ed, and the templates hashed again only when the modification time or the size of one of
+        them changed, so an edit is picked up by the next scored message even if it would be a cache hit.
+
+        Returns:
+            str: hash of the prompt templates
+        """
+        prompt_paths = [self.get_prompt_path(category) for category in self.categories]
+        for prompt_path in (self.combined_prompt_path, self.batch_prompt_path):
+            if prompt_path is not None:
+                prompt_paths.append(prompt_path)
+
+        signature = []
+        for prompt_path in prompt_paths:
+            stat = os.stat(prompt_path)
+            signature.append((prompt_path, stat.st_mtime_ns, stat.st_size))
+        signature = tuple(signature)
+
+        if self.prompt_version is not None and self.prompt_version[0] == signature:
+            return self.prompt_version[1]
+
+        digest = hashlib.sha256()
+        for prompt_path in prompt_paths:
+            digest.update(self.read_prompt(prompt_path).encode("utf-8"))
+            digest.update(b"\0")
+
+        self.prompt_version = (signature, digest.hexdigest()[:16])
+        return self.prompt_version[1]
+
+    def close(self):
+        """
+        Persists the score cache, if there is one, closes the pooled connections and shuts down the executor if the
+        handler created it. Requests still waiting for a thread are cancelled.
+        """
+        if self.score_cache is not None:
+            self.score_cache.save()
+
+        if openai.requestssession is self.session:
+            openai.requestssession = None
+
+        self.session.close()
+
+        if self.owns_executor:
+            with self.lock:
+                pending = list(self.pending)
+            for future in pending:
+                future.cancel()
+            self.executor.shutdown(wait=False)
+
+    async def run_blocking(self, function, *args):
+        """
+        Runs a blocking function in the executor without blocking the event loop. The call is tracked until it is
+        done, so that close can cancel it while it still waits for a thread.
+
+        Parameters:
+            function (callable): The function to run.
+            *args: The arguments of the function.
+
+        Returns:
+            object: The return value of the function.
+        """
+        future = self.executor.submit(function, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.forget_future)
+        return await asyncio.wrap_future(future)
+
+    def forget_future(self, future):
+        """
+        Stops tracking a call run by run_blocking once it is done.
 
         Parameters:
+            future (concurrent.futures.Future): The future of the call.
+        """
+        with self.lock:
+            self.pending.discard(future)
+
+    async def aget_category_score(self, category, content, usage=None):
+        """
+        Asynchronous version of get_category_score that does not block the event loop.
+
+        Parameters:
+            category (str): one of "grammar", "friendliness" or "humor"
             content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
 
         Returns:
-            int: friendliness score [-1, 0, 1]
+            int: category score [-1, 0, 1], or -1001 if it could not be calculated
+        """
+        return await self.run_blocking(self.get_category_score, category, content, usage)
+
+    def get_combined_score(self, content, usage=None):
         """
-        with open(self.friendliness_prompt_path, "r") as file:
-            prompt = file.read()
+        Calculates the scores of every category for a given message with a single request.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
 
-        prompt += content
+        Returns:
+            dict: scores for each category, or None if the response was malformed
+        """
+        prompt = self.read_prompt(self.combined_prompt_path) + content
 
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": prompt},
-                ],
-            )
+            with self.metrics.timer("chatwizard_scoring_seconds", category="combined"):
+                response = self.create_chat_completion(prompt, usage=usage)
+
+        except openai.error.AuthenticationError:
+            print("No API key provided")
+            return None
+
+        except TRANSIENT_ERRORS:  # meaning the request kept failing after every retry
+            return None
+
+        return self.ratings_to_scores(self.parse_combined_response(response))
+
+    def parse_combined_response(self, response):
+        """
+        Parses the JSON object produced by the combined prompt.
+
+        Parameters:
+            response (str): raw text generated by the model
+
+        Returns:
+            dict: integer rating for each category, or None if the response is malformed
+        """
+        return self.validate_ratings(self.extract_json(response, "{", "}"))
+
+    async def aget_batch_scores(self, contents, usage=None, scoring_mode=None):
+        """
+        Generates the scores of several messages, sending the ones missing from the score cache in a single request.
+
+        Messages the batch response does not rate properly are scored one by one with aget_message_score.
+
+        Parameters:
+            contents (list): texts to generate scores for
+            usage (dict): token counts the tokens consumed by the requests are added to, if not None
+            scoring_mode (str): scoring mode of the messages scored one by one, the handler's own if None
+
+        Returns:
+            list: scores for each category, one dict per text in the same order
+        """
+        cached = self.score_cache is not None
+        prompt_version = self.get_prompt_version() if cached else None
+        results = {}
+        for content in contents:
+            if content not in results:
+                results[content] = self.score_cache.get(content, prompt_version) if cached else None
+
+        missing = [content for content, scores in results.items() if scores is None]
+        if len(missing) > 1:
+            batch_scores = await self.run_blocking(self.get_batch_scores, missing, usage)
+            if batch_scores is not None:
+                for content, scores in zip(missing, batch_scores):
+                    if scores is not None:
+                        results[content] = scores
+                        if cached:
+                            self.cache_message_score(content, prompt_version, scores)
+
+        missing = [content for content, scores in results.items() if scores is None]
+        fallback_scores = await asyncio.gather(
+            *(self.aget_message_score(content, usage, scoring_mode) for content in missing)
+        )
+        results.update(zip(missing, fallback_scores))
 
-            friendliness_score = response.choices[0]["message"]["content"]
+        return [dict(results[content]) for content in contents]
 
-            friendliness_score = int(friendliness_score)
-            friendliness_score = ((friendliness_score / 5) - 1) * 10
+    def get_batch_scores(self, contents, usage=None):
+        """
+        Calculates the scores of every category for several messages with a single request.
 
-            if friendliness_score < -10 or friendliness_score > 10:
-                return -1001
+        Parameters:
+            contents (list): texts to generate scores for
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
+
+        Returns:
+            list: scores for each category, one dict per text in the same order, with None for the texts that were not
+                rated properly; or None if the response was malformed
+        """
+        sentences = "".join(f"{index}. {json.dumps(content)}\n" for index, content in enumerate(contents, start=1))
+        prompt = self.read_prompt(self.batch_prompt_path) + "\n" + sentences
+
+        try:
+            response = self.create_chat_completion(prompt, usage=usage)
 
         except openai.error.AuthenticationError:
             print("No API key provided")
-            return -1001
+            return None
 
-        except ValueError:  # meaning API did not produce a pure number
-            return -1001
+        except TRANSIENT_ERRORS:  # meaning the request kept failing after every retry
+            return None
 
-        if friendliness_score <= 0:
-            return -1
-        if friendliness_score == 0:
-            return 0
-        if friendliness_score >= 0:
-            return 1
+        parsed = self.extract_json(response, "[", "]")
+        if not isinstance(parsed, list) or len(parsed) != len(contents):
+            return None
 
-    def get_humor_score(self, content):
+        return [self.ratings_to_scores(self.validate_ratings(ratings)) for ratings in parsed]
+
+    def extract_json(self, response, opening, closing):
         """
-        Calculates the humor score for a given message.
+        Extracts the outermost JSON value delimited by the given characters from a response.
 
         Parameters:
-            content (str): text to generate score for
+            response (str): raw text generated by the model
+            opening (str): first character of the JSON value, "{" or "["
+            closing (str): last character of the JSON value, "}" or "]"
 
         Returns:
-            int: humor score [-1, 0, 1]
+            object: the decoded JSON value, or None if the response does not contain one
+        """
+        start = response.find(opening)
+        end = response.rfind(closing)
+        if start == -1 or end < start:
+            return None
 
-        Raises:
-            AuthenticationError: raised if no API key provided
-            ValueError: raised if API does not produce pure numerical output
+        try:
+            return json.loads(response[start : end + 1])
+        except ValueError:  # meaning API did not produce valid JSON
+            return None
+
+    def validate_ratings(self, parsed):
         """
-        with open(self.humor_prompt_path, "r") as file:
-            prompt = file.read()
+        Checks that a decoded JSON value holds an integer rating for every category.
 
-        prompt += content
+        Parameters:
+            parsed (object): decoded JSON value
 
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": prompt},
-                ],
-            )
+        Returns:
+            dict: integer rating for each category, or None if the value is malformed
+        """
+        if not isinstance(parsed, dict):
+            return None
 
-            humor_score = response.choices[0]["message"]["content"]
+        ratings = {}
+        for category in self.categories:
+            rating = parsed.get(category)
+            if isinstance(rating, bool) or not isinstance(rating, int):
+                return None
+            ratings[category] = rating
+
+        return ratings
+
+    def ratings_to_scores(self, ratings):
+        """
+        Converts the raw ratings of every category into category scores.
+
+        Parameters:
+            ratings (dict): rating between 0 and 10 for each category, or None
+
+        Returns:
+            dict: scores for each category, or None if the ratings are missing or out of range
+        """
+        if ratings is None:
+            return None
+
+        scores = {category: self.rating_to_score(rating) for category, rating in ratings.items()}
+        if -1001 in scores.values():
+            return None
+
+        return scores
+
+    def get_category_score(self, category, content, usage=None):
+        """
+        Calculates the score of a single category for a given message.
+
+        Parameters:
+            category (str): one of "grammar", "friendliness" or "humor"
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the request are added to, if not None
 
-            humor_score = int(humor_score)
-            humor_score = ((humor_score / 5) - 1) * 10
+        Returns:
+            int: category score [-1, 0, 1], or -1001 if it could not be calculated
+        """
+        prompt = self.read_prompt(self.get_prompt_path(category)) + content
 
-            if humor_score < -10 or humor_score > 10:
-                return -1001
+        try:
+            with self.metrics.timer("chatwizard_scoring_seconds", category=category):
+                if self.streaming:
+                    rating = self.stream_rating(prompt, max_tokens=self.max_tokens, usage=usage)
+                else:
+                    rating = parse_rating(self.create_chat_completion(prompt, max_tokens=self.max_tokens, usage=usage))
 
         except openai.error.AuthenticationError:
             print("No API key provided")
             return -1001
 
-        except ValueError:  # meaning API did not produce a pure number
+        except TRANSIENT_ERRORS:  # meaning the request kept failing after every retry
             return -1001
 
-        if humor_score <= 0:
-            return -1
-        if humor_score == 0:
-            return 0
-        if humor_score >= 0:
-            return 1
+        except ValueError:  # meaning API did not produce a number at all
+            return -1001
+
+        return self.rating_to_score(rating)
+
+    def get_grammar_score(self, content):
+        """
+        Calculates the grammar score for a given message.
+
+        Parameters:
+            content (str): text to generate score for
+
+        Returns:
+            int: grammar score [-1, 0, 1]
+        """
+        return self.get_category_score("grammar", content)
+
+    def get_friendliness_score(self, content):
+        """
+        Calculates the friendliness score for a given message.
+
+        Parameters:
+            content (str): text to generate score for
+
+        Returns:
+            int: friendliness score [-1, 0, 1]
+        """
+        return self.get_category_score("friendliness", content)
+
+    def get_humor_score(self, content):
+        """
+        Calculates the humor score for a given message.
+
+        Parameters:
+            content (str): text to generate score for
+
+        Returns:
+            int: humor score [-1, 0, 1]
+
+        Raises:
+            AuthenticationError: raised if no API key provided
+            ValueError: raised if API does not produce pure numerical output
+        """
+        return self.get_category_score("humor", content)
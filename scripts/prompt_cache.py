@@ -0,0 +1,77 @@
+"""
+This script contains the implementation of the PromptCache class, which keeps prompt templates in memory so they are
+not read from disk for every scored message, while still picking up edits made to the prompt files.
+"""
+
+import os
+import threading
+
+
+class PromptCache:
+    """
+    A cache of prompt templates keyed by file path.
+
+    A template is read from disk the first time it is requested, and read again only when the modification time or the
+    size of its file changes.
+    """
+
+    def __init__(self):
+        """
+        Initializes a new, empty instance of the PromptCache class.
+        """
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, prompt_path):
+        """
+        Returns the template stored at the given path.
+
+        Parameters:
+            prompt_path (str): path to the prompt text file
+
+        Returns:
+            str: the prompt template
+        """
+        stat = os.stat(prompt_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            cached = self.templates.get(prompt_path)
+            if cached is not None and cached[0] == signature:
+                self.hits += 1
+                return cached[1]
+
+            self.misses += 1
+
+        with open(prompt_path, "r") as file:
+            template = file.read()
+
+        with self.lock:
+            self.templates[prompt_path] = (signature, template)
+
+        return template
+
+    def invalidate(self, prompt_path=None):
+        """
+        Removes a template from the cache, or every template if no path is given.
+
+        Parameters:
+            prompt_path (str): path to the prompt text file to forget
+        """
+        with self.lock:
+            if prompt_path is None:
+                self.templates.clear()
+            else:
+                self.templates.pop(prompt_path, None)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: number of hits, misses and cached templates
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.templates)}
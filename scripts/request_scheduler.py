@@ -0,0 +1,240 @@
+"""
+This script contains the implementation of the RequestScheduler class, which keeps the requests sent to OpenAI within
+the rate limits of the account, bounds how many of them are in flight, and retries the ones that fail transiently.
+"""
+
+import random
+import threading
+import time
+
+import openai
+
+TRANSIENT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    openai.error.APIError,
+)
+
+
+def is_transient_error(error):
+    """
+    Returns `True` if a request that failed with the given error may succeed when sent again.
+
+    Parameters:
+        error (Exception): The error raised by the request.
+
+    Returns:
+        bool: Whether the request should be retried.
+    """
+    if type(error) is openai.error.APIError:
+        return error.http_status is None or error.http_status >= 500
+
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket holding up to capacity tokens and refilled continuously over a minute.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initializes a new, full instance of the TokenBucket class.
+
+        Parameters:
+            capacity (float): Number of tokens refilled per minute, which is also the maximum burst.
+        """
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = capacity / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Takes tokens from the bucket, going into debt if there are not enough of them.
+
+        Parameters:
+            amount (float): Number of tokens to take, capped to the capacity of the bucket.
+
+        Returns:
+            float: Number of seconds the caller must wait before the reserved tokens are available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+
+            if self.tokens >= 0:
+                return 0.0
+
+            return -self.tokens / self.rate
+
+
+class RequestScheduler:
+    """
+    A scheduler for the blocking requests sent to OpenAI.
+
+    Requests wait for a slot among max_in_flight concurrent ones and for both the requests-per-minute and the
+    tokens-per-minute budgets. Transient failures such as rate limits, timeouts and server errors are retried with
+    jittered exponential backoff, honoring the Retry-After header when the API sends one.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=3500,
+        tokens_per_minute=90000,
+        max_in_flight=8,
+        max_retries=4,
+        base_delay=1.0,
+        max_delay=30.0,
+    ):
+        """
+        Initializes a new instance of the RequestScheduler class.
+
+        Parameters:
+            requests_per_minute (int): Maximum number of requests sent per minute.
+            tokens_per_minute (int): Maximum number of tokens sent per minute.
+            max_in_flight (int): Maximum number of requests waiting for a response at the same time.
+            max_retries (int): Number of times a transiently failing request is sent again before giving up.
+            base_delay (float): Number of seconds waited before the first retry, doubled for every further retry.
+            max_delay (float): Maximum number of seconds waited before a retry.
+        """
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, request, tokens=0):
+        """
+        Sends a request once the budgets allow it, retrying it while it fails transiently.
+
+        Parameters:
+            request (callable): Function sending the request and returning its response.
+            tokens (int): Estimated number of tokens the request consumes.
+
+        Returns:
+            object: The response returned by request.
+
+        Raises:
+            OpenAIError: The error of the last attempt, if the request failed permanently or ran out of retries.
+        """
+        started = time.monotonic()
+        with self.lock:
+            self.queued += 1
+
+        self.slots.acquire()
+        try:
+            self.wait_for_budget(tokens)
+
+            waited = time.monotonic() - started
+            with self.lock:
+                self.queued -= 1
+                self.in_flight += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+            try:
+                return self.send(request, tokens)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+        finally:
+            self.slots.release()
+
+    def send(self, request, tokens):
+        """
+        Sends a request, retrying it with jittered exponential backoff while it fails transiently.
+
+        Parameters:
+            request (callable): Function sending the request and returning its response.
+            tokens (int): Estimated number of tokens the request consumes.
+
+        Returns:
+            object: The response returned by request.
+        """
+        attempt = 0
+        while True:
+            with self.lock:
+                self.requests += 1
+
+            try:
+                return request()
+
+            except openai.error.OpenAIError as error:
+                if not is_transient_error(error) or attempt >= self.max_retries:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+
+                with self.lock:
+                    self.retries += 1
+
+                time.sleep(self.backoff_delay(attempt, error))
+                attempt += 1
+                self.wait_for_budget(tokens)
+
+    def wait_for_budget(self, tokens):
+        """
+        Blocks until both the request and the token budgets allow one more request.
+
+        Parameters:
+            tokens (int): Estimated number of tokens the request consumes.
+        """
+        delay = max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens))
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt, error):
+        """
+        Returns the number of seconds to wait before retrying a failed request.
+
+        Parameters:
+            attempt (int): Number of retries already made for the request.
+            error (OpenAIError): The error raised by the last attempt.
+
+        Returns:
+            float: The delay before the next attempt.
+        """
+        headers = getattr(error, "headers", None) or {}
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def stats(self):
+        """
+        Returns the counters of the scheduler.
+
+        Returns:
+            dict: Queue depth, requests in flight, number of requests, retries and failures, and wait times.
+        """
+        with self.lock:
+            scheduled = self.requests - self.retries
+            return {
+                "queue_depth": self.queued,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "average_wait": self.total_wait / scheduled if scheduled else 0.0,
+                "max_wait": self.max_wait,
+            }
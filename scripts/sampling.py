@@ -0,0 +1,220 @@
+"""
+This script contains the implementation of the SamplingPolicy class, which decides per channel whether every message
+is scored, only a sample of them, or none, and weighs the sampled scores so that the totals stay comparable.
+"""
+
+import asyncio
+import math
+import random
+
+
+class SamplingPolicy:
+    """
+    A per-channel sampling policy for scoring.
+
+    Each channel is in one of three modes, set for every channel, per guild or per channel: "full" scores every
+    message, "off" scores none, and "sampled" scores a sample of them. Samples are taken with one of two methods:
+    "every" scores one message in every messages of a channel, and "reservoir" keeps a uniform reservoir of
+    per_window messages of each author in each channel for window seconds, and scores the reservoir when the window
+    ends.
+
+    A sampled message is weighted by the inverse of its probability of being sampled (the Horvitz-Thompson
+    estimator), so that the sum of the weighted scores is an unbiased estimate of the sum full scoring would give.
+    Fractional weights are rounded stochastically to integers, which keeps the estimate unbiased and the scores
+    integral.
+    """
+
+    modes = ['full', 'sampled', 'off']
+    methods = ['every', 'reservoir']
+
+    def __init__(
+        self,
+        mode="full",
+        method="every",
+        every=10,
+        window=60.0,
+        per_window=1,
+        guild_modes=None,
+        channel_modes=None,
+        seed=None,
+    ):
+        """
+        Initializes a new instance of the SamplingPolicy class.
+
+        Parameters:
+            mode (str): The mode of the channels without an override, one of modes.
+            method (str): How sampled channels are sampled, one of methods.
+            every (int): One message in this many is scored with the "every" method.
+            window (float): Number of seconds of the reservoir windows.
+            per_window (int): Number of messages of an author scored per window with the "reservoir" method.
+            guild_modes (dict): Modes of the channels of particular guilds, keyed by guild ID.
+            channel_modes (dict): Modes of particular channels, keyed by channel ID, overriding the guild ones.
+            seed (int): Seed of the random generator, for reproducible samples.
+
+        Raises:
+            ValueError: If a mode or the method is not recognized, or a sample size is not positive.
+        """
+        if method not in self.methods:
+            raise ValueError("Invalid sampling method.")
+
+        if every < 1 or window <= 0 or per_window < 1:
+            raise ValueError("Invalid sample size.")
+
+        self.guild_modes = dict(guild_modes or {})
+        self.channel_modes = dict(channel_modes or {})
+        for sampling_mode in [mode, *self.guild_modes.values(), *self.channel_modes.values()]:
+            if sampling_mode not in self.modes:
+                raise ValueError("Invalid sampling mode.")
+
+        self.mode = mode
+        self.method = method
+        self.every = every
+        self.window = window
+        self.per_window = per_window
+        self.random = random.Random(seed)
+        self.counters = {}
+        self.reservoirs = {}
+        self.handler = None
+        self.counts = {"seen": 0, "scored": 0, "held": 0, "skipped": 0}
+
+    def start(self, handler):
+        """
+        Sets the function the reservoirs are handed to when their window ends.
+
+        Parameters:
+            handler (callable): Function called on the event loop with a sampled item and its weight.
+        """
+        self.handler = handler
+
+    def stop(self):
+        """
+        Closes every reservoir and hands its items to the handler right away, so that no message is lost when the bot
+        shuts down. The reservoirs are only closed if no handler was set.
+        """
+        for key in list(self.reservoirs):
+            if self.handler is not None:
+                self.flush(key)
+            else:
+                self.reservoirs.pop(key)[2].cancel()
+
+    def get_mode(self, guild_id, channel_id):
+        """
+        Returns the mode of a channel.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+
+        Returns:
+            str: "full", "sampled" or "off".
+        """
+        if channel_id in self.channel_modes:
+            return self.channel_modes[channel_id]
+
+        return self.guild_modes.get(guild_id, self.mode)
+
+    def sample(self, guild_id, channel_id, user_id, item):
+        """
+        Decides whether a message is scored now.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+            item (object): The message, handed to the handler later if it is held in a reservoir.
+
+        Returns:
+            int: The weight of the scores of the message if it is scored now, or None if it is skipped or held.
+        """
+        self.counts["seen"] += 1
+        mode = self.get_mode(guild_id, channel_id)
+
+        if mode == "full":
+            self.counts["scored"] += 1
+            return 1
+
+        if mode == "off":
+            self.counts["skipped"] += 1
+            return None
+
+        if self.method == "reservoir":
+            self.hold(channel_id, user_id, item)
+            return None
+
+        count = self.counters.get(channel_id, 0)
+        self.counters[channel_id] = count + 1
+        if count % self.every:
+            self.counts["skipped"] += 1
+            return None
+
+        self.counts["scored"] += 1
+        return self.every
+
+    def hold(self, channel_id, user_id, item):
+        """
+        Offers a message to the reservoir of its author in its channel, opening a window if needed.
+
+        Parameters:
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+            item (object): The message.
+        """
+        key = (channel_id, user_id)
+        entry = self.reservoirs.get(key)
+        if entry is None:
+            timer = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+            entry = self.reservoirs[key] = [0, [], timer]
+
+        entry[0] += 1
+        reservoir = entry[1]
+        if len(reservoir) < self.per_window:
+            reservoir.append(item)
+            self.counts["held"] += 1
+            return
+
+        index = self.random.randrange(entry[0])
+        if index < self.per_window:
+            reservoir[index] = item
+
+        self.counts["skipped"] += 1
+
+    def flush(self, key):
+        """
+        Closes the window of a reservoir and hands its messages to the handler with their weights.
+
+        Parameters:
+            key (tuple): The IDs of the channel and the author of the reservoir.
+        """
+        entry = self.reservoirs.pop(key, None)
+        if entry is None:
+            return
+
+        count, reservoir, timer = entry
+        timer.cancel()
+        self.counts["held"] -= len(reservoir)
+        self.counts["scored"] += len(reservoir)
+
+        for item in reservoir:
+            self.handler(item, self.round_weight(count / len(reservoir)))
+
+    def round_weight(self, weight):
+        """
+        Rounds a weight to one of its neighboring integers, up with a probability equal to its fractional part.
+
+        Parameters:
+            weight (float): The weight.
+
+        Returns:
+            int: The rounded weight, whose expected value is the weight.
+        """
+        floor = math.floor(weight)
+        return floor + (1 if self.random.random() < weight - floor else 0)
+
+    def stats(self):
+        """
+        Returns the counters of the policy.
+
+        Returns:
+            dict: Number of messages seen, scored, held in reservoirs and skipped, and the number of open reservoirs.
+        """
+        return dict(self.counts, reservoirs=len(self.reservoirs))
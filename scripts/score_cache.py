@@ -0,0 +1,160 @@
+"""
+This script contains the implementation of the ScoreCache class, which remembers the scores of recently scored
+messages so that repeated messages do not need to be sent to OpenAI again.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ScoreCache:
+    """
+    An LRU cache of message scores with a time to live, keyed by a hash of the normalized message text and the version
+    of the prompts that produced the scores.
+
+    The cache can optionally be persisted to a JSON file, so that it survives restarts of the bot.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 60 * 60, path=None):
+        """
+        Initializes a new instance of the ScoreCache class, and loads the persisted entries if path exists.
+
+        Parameters:
+            max_entries (int): Maximum number of cached messages, the least recently used one is evicted beyond it.
+            ttl (float): Number of seconds a cached score stays valid.
+            path (str): The file path to persist the cache to, the cache is kept in memory only if None.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def normalize(self, content):
+        """
+        Normalizes a message so that messages differing only in case or whitespace share a cache entry.
+
+        Parameters:
+            content (str): The content of the message.
+
+        Returns:
+            str: The normalized content.
+        """
+        return " ".join(content.casefold().split())
+
+    def make_key(self, content, prompt_version):
+        """
+        Returns the cache key of a message scored with the given prompt version.
+
+        Parameters:
+            content (str): The content of the message.
+            prompt_version (str): The version of the prompts used for scoring.
+
+        Returns:
+            str: The cache key.
+        """
+        return hashlib.sha256(f"{prompt_version}\0{self.normalize(content)}".encode("utf-8")).hexdigest()
+
+    def get(self, content, prompt_version):
+        """
+        Returns the cached scores of a message, or None if the message is not cached or its entry expired.
+
+        Parameters:
+            content (str): The content of the message.
+            prompt_version (str): The version of the prompts used for scoring.
+
+        Returns:
+            dict: A copy of the cached scores for each category.
+        """
+        key = self.make_key(content, prompt_version)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, content, prompt_version, scores):
+        """
+        Caches the scores of a message.
+
+        Parameters:
+            content (str): The content of the message.
+            prompt_version (str): The version of the prompts used for scoring.
+            scores (dict): The scores for each category.
+        """
+        key = self.make_key(content, prompt_version)
+
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, dict(scores))
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def load(self):
+        """
+        Loads the unexpired entries persisted at path.
+        """
+        with open(self.path, "r") as file:
+            persisted = json.load(file)
+
+        now = time.time()
+        with self.lock:
+            for key, (expires_at, scores) in persisted.items():
+                if expires_at > now:
+                    self.entries[key] = (expires_at, scores)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        """
+        Atomically persists the unexpired entries to path. Does nothing if the cache has no path.
+        """
+        if self.path is None:
+            return
+
+        now = time.time()
+        with self.lock:
+            payload = json.dumps({key: entry for key, entry in self.entries.items() if entry[0] > now})
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            file.write(payload)
+        os.replace(temp_path, self.path)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: Number of hits, misses, evictions and cached messages, and the hit rate.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
@@ -0,0 +1,1101 @@
+"""
+This script contains the score stores persisting the user scores. Every store keeps the user scores in memory and
+implements the ScoreStore interface; JSONScoreStore writes them behind to a JSON file in batches, BinaryScoreStore does
+the same with a binary file, SQLiteScoreStore upserts the rows of each updated user into an embedded SQLite database,
+and GuildScoreStore keeps separate scores for every guild in JSON shards loaded on demand.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+def normalize_user_id(user_id):
+    """
+    Returns the key the scores of a user are stored under, so integer IDs coming from Discord and string IDs coming
+    from the score files refer to the same user.
+
+    Parameters:
+        user_id (int or str): The user id to normalize.
+
+    Returns:
+        str: The normalized user id.
+    """
+    return str(user_id)
+
+
+class ScoreRow(MutableMapping):
+    """
+    A live, dict-like view of the scores of one user in a ScoreTable. Reading and writing a category reads and writes
+    the column of the table directly.
+    """
+
+    __slots__ = ('table', 'user_id')
+
+    def __init__(self, table, user_id):
+        """
+        Initializes a new instance of the ScoreRow class.
+
+        Parameters:
+            table (ScoreTable): The table the scores are stored in.
+            user_id (str): The normalized ID of the user.
+        """
+        self.table = table
+        self.user_id = user_id
+
+    def __getitem__(self, category):
+        return self.table.get_score(self.user_id, category)
+
+    def __setitem__(self, category, score):
+        self.table.set_score(self.user_id, category, score)
+
+    def __delitem__(self, category):
+        self.table.delete_score(self.user_id, category)
+
+    def __iter__(self):
+        return iter(self.table.get_categories(self.user_id))
+
+    def __len__(self):
+        return len(self.table.get_categories(self.user_id))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ScoreTable(MutableMapping):
+    """
+    A compact table mapping user IDs to their scores, normalizing every user ID it is given with normalize_user_id.
+
+    The scores are stored in one contiguous array of 64-bit integers per category, and an index maps each user to a
+    row of the arrays, so a user costs a few machine words instead of a dictionary of boxed integers. A bit mask per row
+    records which categories the user has. Looking a user up returns a ScoreRow, a live dict-like view of their row.
+    Rows freed by removed users are reused.
+
+    The whole table is serialized to and from bytes in bulk by copying the arrays, see to_bytes and from_bytes.
+    """
+
+    max_categories = 64
+
+    def __init__(self, user_scores=()):
+        """
+        Initializes a new instance of the ScoreTable class.
+
+        Parameters:
+            user_scores (dict): The initial user scores.
+        """
+        self.categories = []
+        self.bits = {}
+        self.columns = {}
+        self.masks = array('Q')
+        self.users = []
+        self.index = {}
+        self.free_rows = []
+        self.update(user_scores)
+
+    def __getitem__(self, user_id):
+        user_id = normalize_user_id(user_id)
+        if user_id not in self.index:
+            raise KeyError(user_id)
+
+        return ScoreRow(self, user_id)
+
+    def __setitem__(self, user_id, scores):
+        scores = dict(scores)
+        user_id = normalize_user_id(user_id)
+        row = self.index.get(user_id)
+        if row is None:
+            row = self.add_row(user_id)
+
+        self.masks[row] = 0
+        for category, score in scores.items():
+            self.set_score(user_id, category, score)
+
+    def __delitem__(self, user_id):
+        row = self.index.pop(normalize_user_id(user_id))
+        self.users[row] = None
+        self.masks[row] = 0
+        self.free_rows.append(row)
+
+    def __contains__(self, user_id):
+        return normalize_user_id(user_id) in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def pop(self, user_id, *default):
+        user_id = normalize_user_id(user_id)
+        if user_id not in self.index:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+
+        scores = dict(self[user_id])
+        del self[user_id]
+        return scores
+
+    def setdefault(self, user_id, default=None):
+        if user_id not in self:
+            self[user_id] = default if default is not None else {}
+
+        return self[user_id]
+
+    def add_row(self, user_id):
+        """
+        Assigns a row to a new user, reusing a freed row if there is one.
+
+        Parameters:
+            user_id (str): The normalized ID of the user.
+
+        Returns:
+            int: The row of the user.
+        """
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.users[row] = user_id
+        else:
+            row = len(self.users)
+            self.users.append(user_id)
+            self.masks.append(0)
+            for column in self.columns.values():
+                column.append(0)
+
+        self.index[user_id] = row
+        return row
+
+    def add_category(self, category):
+        """
+        Adds a column for a category, with every existing user lacking it.
+
+        Parameters:
+            category (str): The category.
+
+        Raises:
+            ValueError: If the table already has max_categories categories.
+        """
+        if len(self.categories) >= self.max_categories:
+            raise ValueError("Invalid category.")
+
+        self.bits[category] = len(self.categories)
+        self.categories.append(category)
+        self.columns[category] = array('q', bytes(8 * len(self.users)))
+
+    def get_score(self, user_id, category):
+        """
+        Returns the score of a user in a category.
+
+        Parameters:
+            user_id (str): The normalized ID of the user.
+            category (str): The category.
+
+        Returns:
+            int: The score.
+
+        Raises:
+            KeyError: If the user has no score in the category.
+        """
+        row = self.index[user_id]
+        if category not in self.columns or not self.masks[row] >> self.bits[category] & 1:
+            raise KeyError(category)
+
+        return self.columns[category][row]
+
+    def set_score(self, user_id, category, score):
+        """
+        Sets the score of a user in a category, adding the category to the table if needed.
+
+        Parameters:
+            user_id (str): The normalized ID of the user.
+            category (str): The category.
+            score (int): The score, which must be integral.
+
+        Raises:
+            ValueError: If the score is not integral.
+        """
+        if score != int(score):
+            raise ValueError("Invalid score.")
+
+        if category not in self.columns:
+            self.add_category(category)
+
+        row = self.index[user_id]
+        self.columns[category][row] = int(score)
+        self.masks[row] |= 1 << self.bits[category]
+
+    def delete_score(self, user_id, category):
+        """
+        Removes the score of a user in a category.
+
+        Parameters:
+            user_id (str): The normalized ID of the user.
+            category (str): The category.
+
+        Raises:
+            KeyError: If the user has no score in the category.
+        """
+        self.get_score(user_id, category)
+        self.masks[self.index[user_id]] &= ~(1 << self.bits[category])
+
+    def get_categories(self, user_id):
+        """
+        Returns the categories a user has a score in.
+
+        Parameters:
+            user_id (str): The normalized ID of the user.
+
+        Returns:
+            list: The categories, in the order they were added to the table.
+        """
+        mask = self.masks[self.index[user_id]]
+        return [category for bit, category in enumerate(self.categories) if mask >> bit & 1]
+
+    def add(self, user_id, scores, weight=1):
+        """
+        Adds scores to those of a user, who must be in the table.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            scores (dict): The score to add in each category.
+            weight (int): The factor the scores are multiplied by.
+        """
+        user_id = normalize_user_id(user_id)
+        row = self.index[user_id]
+        for category, score in scores.items():
+            if category in self.columns:
+                self.columns[category][row] += score * weight
+                self.masks[row] |= 1 << self.bits[category]
+            else:
+                self.set_score(user_id, category, score * weight)
+
+    def to_dict(self):
+        """
+        Returns a plain copy of the table, reading every column in bulk.
+
+        Returns:
+            dict: A dictionary that maps user IDs to dictionaries of their scores.
+        """
+        columns = [
+            (1 << bit, category, self.columns[category].tolist()) for bit, category in enumerate(self.categories)
+        ]
+        return {
+            user_id: {category: values[row] for bit, category, values in columns if self.masks[row] & bit}
+            for user_id, row in self.index.items()
+        }
+
+    def to_bytes(self):
+        """
+        Serializes the table by copying its arrays.
+
+        Returns:
+            bytes: A JSON header with the categories, the users of every row and the byte order, followed by the masks
+                and then every column as raw arrays.
+        """
+        header = json.dumps({"categories": self.categories, "users": self.users, "byteorder": sys.byteorder}).encode()
+        arrays = [self.masks] + [self.columns[category] for category in self.categories]
+        return b"".join([struct.pack("<I", len(header)), header] + [values.tobytes() for values in arrays])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserializes a table serialized with to_bytes.
+
+        Parameters:
+            data (bytes): The serialized table.
+
+        Returns:
+            ScoreTable: The table.
+
+        Raises:
+            ValueError: If the data is truncated.
+        """
+        (length,) = struct.unpack_from("<I", data)
+        header = json.loads(data[4 : 4 + length])
+        rows = len(header["users"])
+        if len(data) != 4 + length + 8 * rows * (len(header["categories"]) + 1):
+            raise ValueError("Invalid score table.")
+
+        table = cls()
+        table.categories = header["categories"]
+        table.bits = {category: bit for bit, category in enumerate(table.categories)}
+        table.users = header["users"]
+        offset = 4 + length
+        for name in [None] + table.categories:
+            values = array('Q' if name is None else 'q', data[offset : offset + 8 * rows])
+            if header["byteorder"] != sys.byteorder:
+                values.byteswap()
+
+            if name is None:
+                table.masks = values
+            else:
+                table.columns[name] = values
+            offset += 8 * rows
+
+        for row, user_id in enumerate(table.users):
+            if user_id is None:
+                table.free_rows.append(row)
+            else:
+                table.index[user_id] = row
+
+        return table
+
+
+# kept for the callers of the dictionary the user scores used to be stored in
+UserScores = ScoreTable
+
+
+class ScoreStore:
+    """
+    The interface of the stores persisting the user scores.
+
+    A store owns the in-memory user_scores dictionary. Callers mutate it directly and then report the user whose
+    scores changed through update_scores, and the store decides when and how the change reaches the disk.
+    """
+
+    flush_interval = 30.0
+    partitioned = False
+
+    def __init__(self, path):
+        """
+        Initializes a new instance of the ScoreStore class.
+
+        Parameters:
+            path (str): The path where the user scores are stored.
+        """
+        self.path = path
+        self.user_scores = ScoreTable()
+        self.dirty = 0
+
+    def load(self):
+        """
+        Loads the user scores from the storage.
+
+        Returns:
+            dict: A dictionary that maps user IDs to their scores.
+        """
+        raise NotImplementedError
+
+    def changed_externally(self):
+        """
+        Returns `True` if the storage was modified by someone else since the scores were last loaded or written.
+
+        Returns:
+            bool: Whether the in-memory scores may be stale.
+        """
+        raise NotImplementedError
+
+    def for_guild(self, guild_id):
+        """
+        Returns the store holding the scores of the members of a guild. Stores that are not partitioned by guild hold
+        the scores of every guild themselves.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+
+        Returns:
+            ScoreStore: The store of the guild.
+        """
+        return self
+
+    def release_idle(self):
+        """
+        Releases the parts of the storage that were not used recently. Does nothing by default.
+        """
+
+    def fetch_user(self, user_id):
+        """
+        Loads the scores of a user unknown to this process from the storage, for stores shared between processes.
+
+        Parameters:
+            user_id (str): The user id whose scores are fetched.
+
+        Returns:
+            bool: Whether the user was found in the storage.
+        """
+        return False
+
+    def update_scores(self, user_id):
+        """
+        Records that the in-memory scores of the given user changed.
+
+        Parameters:
+            user_id (str): The user id whose scores changed.
+
+        Returns:
+            bool: Whether enough updates piled up to flush before the flush interval ends.
+        """
+        raise NotImplementedError
+
+    def save(self):
+        """
+        Writes every user score to the storage immediately.
+        """
+        raise NotImplementedError
+
+    def serialize(self):
+        """
+        Takes a snapshot of the dirty user scores and marks the store clean.
+
+        Returns:
+            object: The payload to pass to write.
+        """
+        raise NotImplementedError
+
+    def write(self, payload):
+        """
+        Writes a payload taken by serialize to the storage.
+
+        Parameters:
+            payload (object): The payload returned by serialize.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes the user scores to the storage if there are updates that have not been written yet.
+        """
+        if self.dirty:
+            self.save()
+
+    def close(self):
+        """
+        Flushes the remaining updates and releases the storage.
+        """
+        self.flush()
+
+
+class JSONScoreStore(ScoreStore):
+    """
+    A write-behind store for the user scores, persisted as a single JSON file.
+
+    Mutations are applied to the in-memory user_scores dictionary and only counted as dirty. The owner flushes the
+    store once flush_interval seconds have passed or flush_every updates have piled up, and every write replaces the
+    file atomically so a crash never leaves a half-written file behind.
+    """
+
+    def __init__(self, path, flush_interval=30.0, flush_every=50):
+        """
+        Initializes a new instance of the JSONScoreStore class.
+
+        Parameters:
+            path (str): The user scores file path to store user scores.
+            flush_interval (float): Maximum number of seconds dirty scores are kept in memory only.
+            flush_every (int): Number of dirty updates that triggers a flush before the interval ends.
+        """
+        super().__init__(path)
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.write_lock = threading.Lock()
+        self.file_signature = None
+
+    def load(self):
+        """
+        Loads the user scores from the JSON file.
+
+        Returns:
+            dict: A dictionary that maps user IDs to their scores.
+        """
+        self.user_scores = self.read() if os.path.exists(self.path) else ScoreTable()
+        self.dirty = 0
+        self.file_signature = self.read_file_signature()
+        return self.user_scores
+
+    def read(self):
+        """
+        Reads the user scores from the JSON file, which must exist.
+
+        Returns:
+            ScoreTable: The user scores.
+        """
+        with open(self.path, "r") as file:
+            return ScoreTable(json.load(file))
+
+    def read_file_signature(self):
+        """
+        Returns the modification time and size of the JSON file, or None if it does not exist.
+
+        Returns:
+            tuple: The signature of the JSON file.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed_externally(self):
+        """
+        Returns `True` if the JSON file was modified by someone else since the scores were last loaded or written.
+
+        Returns:
+            bool: Whether the in-memory scores may be stale.
+        """
+        return self.read_file_signature() != self.file_signature
+
+    def update_scores(self, user_id):
+        """
+        Records that the in-memory scores of the given user changed. The change is written with the next flush.
+
+        Parameters:
+            user_id (str): The user id whose scores changed.
+
+        Returns:
+            bool: Whether enough updates piled up to flush before the flush interval ends.
+        """
+        return self.mark_dirty()
+
+    def mark_dirty(self):
+        """
+        Records an update of the in-memory user scores that has not been written yet.
+
+        Returns:
+            bool: Whether enough updates piled up to flush before the interval ends.
+        """
+        self.dirty += 1
+        return self.dirty >= self.flush_every
+
+    def serialize(self):
+        """
+        Takes a snapshot of the user scores and marks the store clean. Must be called from the thread mutating the
+        scores, the returned payload can then be written from any thread.
+
+        Returns:
+            str: The user scores encoded as JSON.
+        """
+        payload = json.dumps(self.user_scores.to_dict())
+        self.dirty = 0
+        return payload
+
+    def write(self, payload):
+        """
+        Atomically replaces the JSON file with the given payload by writing a temporary file next to it and renaming
+        it over the old one. If the write fails, the store is marked dirty again so that the next flush retries it.
+
+        Parameters:
+            payload (str): The user scores encoded as JSON, or bytes for a BinaryScoreStore.
+        """
+        directory = os.path.dirname(self.path) or "."
+
+        with self.write_lock:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".user_scores-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb" if isinstance(payload, bytes) else "w") as file:
+                    file.write(payload)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+                self.file_signature = self.read_file_signature()
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                self.mark_dirty()
+                raise
+
+    def save(self):
+        """
+        Writes the user scores to the JSON file immediately, whether they are dirty or not.
+        """
+        self.write(self.serialize())
+
+
+class BinaryScoreStore(JSONScoreStore):
+    """
+    A write-behind store for the user scores, persisted as a ScoreTable serialized to a binary file.
+
+    It flushes like a JSONScoreStore, but every write copies the arrays of the table in bulk instead of encoding every
+    score as JSON, and loading copies them back.
+    """
+
+    def read(self):
+        """
+        Reads the user scores from the binary file, which must exist.
+
+        Returns:
+            ScoreTable: The user scores.
+        """
+        with open(self.path, "rb") as file:
+            return ScoreTable.from_bytes(file.read())
+
+    def serialize(self):
+        """
+        Takes a snapshot of the user scores and marks the store clean. Must be called from the thread mutating the
+        scores, the returned payload can then be written from any thread.
+
+        Returns:
+            bytes: The serialized score table.
+        """
+        payload = self.user_scores.to_bytes()
+        self.dirty = 0
+        return payload
+
+    def migrate_from_json(self, json_path):
+        """
+        Imports the user scores of a JSON score file if the binary file does not exist yet.
+
+        Parameters:
+            json_path (str): The user scores file path of a JSONScoreStore.
+
+        Returns:
+            int: The number of users imported.
+        """
+        if os.path.exists(self.path) or not os.path.exists(json_path):
+            return 0
+
+        self.user_scores = JSONScoreStore(json_path).load()
+        self.save()
+        return len(self.user_scores)
+
+
+class SQLiteScoreStore(ScoreStore):
+    """
+    A store for the user scores backed by an embedded SQLite database in WAL mode.
+
+    Every user has one row per category, and update_scores upserts the rows of a single user, so the cost of an update
+    does not grow with the number of users and an interrupted write never loses the scores already committed.
+
+    A shared store can be used by several processes at once, such as the shards of a ShardedDiscordBot. Instead of
+    overwriting the rows, it adds the difference between the in-memory scores and the scores it last read, and then
+    reads the rows back, so updates made by other processes are never lost. Scores it has never read start from the
+    default scores: their rows are created with the defaults unless another process created them first, and the
+    difference from the defaults is added either way.
+    """
+
+    upsert_query = (
+        "INSERT INTO user_scores (user_id, category, score) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, category) DO UPDATE SET score = excluded.score"
+    )
+
+    insert_default_query = (
+        "INSERT INTO user_scores (user_id, category, score) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, category) DO NOTHING"
+    )
+
+    increment_query = "UPDATE user_scores SET score = score + ? WHERE user_id = ? AND category = ?"
+
+    def __init__(self, path, shared=False, default_scores=None):
+        """
+        Initializes a new instance of the SQLiteScoreStore class and creates its tables if needed.
+
+        Parameters:
+            path (str): The database file path to store user scores.
+            shared (bool): Whether other processes write to the database at the same time.
+            default_scores (dict): The scores new users start from, 0 in every category if None.
+        """
+        super().__init__(path)
+        self.shared = shared
+        self.default_scores = dict(default_scores or {})
+        self.persisted = {}
+        self.data_version = None
+        self.connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS user_scores ("
+                "user_id TEXT NOT NULL, category TEXT NOT NULL, score INTEGER NOT NULL, "
+                "PRIMARY KEY (user_id, category))"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at REAL)")
+
+    def load(self):
+        """
+        Loads the user scores from the database.
+
+        Returns:
+            dict: A dictionary that maps user IDs to their scores.
+        """
+        self.user_scores = ScoreTable()
+        for user_id, category, score in self.connection.execute("SELECT user_id, category, score FROM user_scores"):
+            self.user_scores.setdefault(user_id, {})[category] = score
+
+        if self.shared:
+            self.persisted = {user_id: dict(scores) for user_id, scores in self.user_scores.items()}
+        self.data_version = self.read_data_version()
+        return self.user_scores
+
+    def read_data_version(self):
+        """
+        Returns the data version of the database, which changes whenever another connection commits.
+
+        Returns:
+            int: The data version of the database.
+        """
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed_externally(self):
+        """
+        Returns `True` if another connection committed to the database since the scores were last loaded.
+
+        Returns:
+            bool: Whether the in-memory scores may be stale.
+        """
+        return self.read_data_version() != self.data_version
+
+    def fetch_user(self, user_id):
+        """
+        Loads the scores of a user unknown to this process from the database, if the store is shared.
+
+        Parameters:
+            user_id (str): The user id whose scores are fetched.
+
+        Returns:
+            bool: Whether the user was found in the database.
+        """
+        if not self.shared:
+            return False
+
+        scores = self.read_user(user_id)
+        if not scores:
+            return False
+
+        self.user_scores[user_id] = scores
+        self.persisted[normalize_user_id(user_id)] = dict(scores)
+        return True
+
+    def read_user(self, user_id):
+        """
+        Reads the scores of a user from the database.
+
+        Parameters:
+            user_id (str): The user id whose scores are read.
+
+        Returns:
+            dict: The scores of the user, empty if the user has no rows.
+        """
+        rows = self.connection.execute(
+            "SELECT category, score FROM user_scores WHERE user_id = ?", (normalize_user_id(user_id),)
+        )
+        return dict(rows.fetchall())
+
+    def update_scores(self, user_id):
+        """
+        Upserts the rows of the given user with their in-memory scores. A shared store adds the change since the scores
+        were last read instead, and refreshes the in-memory scores with the rows it reads back.
+
+        Parameters:
+            user_id (str): The user id whose scores changed.
+
+        Returns:
+            bool: Always `False`, since the update is already written.
+        """
+        if not self.shared:
+            with self.connection:
+                self.connection.executemany(self.upsert_query, self.rows(user_id))
+            return False
+
+        key = normalize_user_id(user_id)
+        scores = self.user_scores[user_id]
+        baseline = self.persisted.get(key, {})
+        missing = [category for category in scores if category not in baseline]
+
+        with self.connection:
+            if missing:
+                self.connection.executemany(
+                    self.insert_default_query,
+                    [(key, category, self.default_scores.get(category, 0)) for category in missing],
+                )
+
+            self.connection.executemany(
+                self.increment_query,
+                [
+                    (score - baseline.get(category, self.default_scores.get(category, 0)), key, category)
+                    for category, score in scores.items()
+                ],
+            )
+            fresh = self.read_user(key)
+
+        scores.update(fresh)
+        self.persisted[key] = fresh
+        return False
+
+    def save(self):
+        """
+        Upserts the rows of every user with their in-memory scores in a single transaction.
+        """
+        with self.connection:
+            self.connection.executemany(
+                self.upsert_query, [row for user_id in list(self.user_scores) for row in self.rows(user_id)]
+            )
+
+    def serialize(self):
+        """
+        Returns nothing to write, since every update is upserted as it happens.
+
+        Returns:
+            None
+        """
+        self.dirty = 0
+
+    def write(self, payload):
+        """
+        Does nothing, since every update is upserted as it happens.
+
+        Parameters:
+            payload (None): The payload returned by serialize.
+        """
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        self.connection.close()
+
+    def migrate_from_json(self, json_path):
+        """
+        Imports the user scores of a JSON score file into the database. The migration runs only once; later calls
+        return without reading the file again.
+
+        Parameters:
+            json_path (str): The user scores file path of a JSONScoreStore.
+
+        Returns:
+            int: The number of users imported.
+        """
+        name = "json:" + os.path.abspath(json_path)
+
+        with self.connection:
+            # taking the write lock first makes concurrent migrations from several processes run only once
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.connection.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                return 0
+
+            user_scores = JSONScoreStore(json_path).load()
+            self.connection.executemany(
+                self.upsert_query,
+                [
+                    (normalize_user_id(user_id), category, score)
+                    for user_id, scores in user_scores.items()
+                    for category, score in scores.items()
+                ],
+            )
+            self.connection.execute("INSERT INTO migrations (name, applied_at) VALUES (?, ?)", (name, time.time()))
+
+        self.load()
+        return len(user_scores)
+
+    def rows(self, user_id):
+        """
+        Returns the database rows of the given user.
+
+        Parameters:
+            user_id (str): The user id whose rows are returned.
+
+        Returns:
+            list: (user_id, category, score) tuples.
+        """
+        return [(normalize_user_id(user_id), category, score) for category, score in self.user_scores[user_id].items()]
+
+
+class GuildScoreStore(ScoreStore):
+    """
+    A store keeping separate user scores for every guild, each in its own JSON shard written behind.
+
+    The shard of a guild is a JSONScoreStore loaded from directory the first time the guild is accessed. The owner
+    calls release_idle after every flush, which drops the shards that were not accessed for idle_timeout seconds and,
+    past max_shards, the least recently accessed ones, so that memory follows the active guilds rather than every guild
+    the bot is in. Shards are only dropped once written, so an evicted guild reloads exactly what it had.
+
+    The user_scores of the store are those of the direct messages. The owner can set on_load to a callable, which is
+    called with the guild ID and the user scores of every shard read from its file, and on_evict to one called with
+    the guild ID of every shard dropped from memory.
+    """
+
+    partitioned = True
+
+    def __init__(self, directory, flush_interval=30.0, flush_every=50, idle_timeout=600.0, max_shards=1000):
+        """
+        Initializes a new instance of the GuildScoreStore class, creating directory if needed.
+
+        Parameters:
+            directory (str): The directory the shards are stored in, one JSON file per guild.
+            flush_interval (float): Maximum number of seconds dirty scores are kept in memory only.
+            flush_every (int): Number of dirty updates of a shard that triggers a flush before the interval ends.
+            idle_timeout (float): Number of seconds after its last access a shard is dropped from memory.
+            max_shards (int): Number of shards kept in memory after each flush.
+
+        Raises:
+            ValueError: If the idle timeout or the number of shards is not positive.
+        """
+        if idle_timeout <= 0 or max_shards < 1:
+            raise ValueError("Invalid shard limits.")
+
+        # the scores live in the shards, so the attributes ScoreStore.__init__ sets are properties here
+        self.path = directory
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.idle_timeout = idle_timeout
+        self.max_shards = max_shards
+        self.shards = OrderedDict()
+        self.counts = {"loads": 0, "evictions": 0}
+        self.on_load = None
+        self.on_evict = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def user_scores(self):
+        """
+        ScoreTable: The user scores of the direct messages.
+        """
+        return self.for_guild(None).user_scores
+
+    @user_scores.setter
+    def user_scores(self, user_scores):
+        self.for_guild(None).user_scores = user_scores
+
+    @property
+    def dirty(self):
+        """
+        int: The number of updates of the loaded shards that have not been written yet.
+        """
+        return sum(shard.dirty for shard, _ in self.shards.values())
+
+    def get_shard_path(self, guild_id):
+        """
+        Returns the path of the shard of a guild.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+
+        Returns:
+            str: The path of the JSON file of the shard.
+        """
+        name = "direct" if guild_id is None else str(int(guild_id))
+        return os.path.join(self.path, f"{name}.json")
+
+    def for_guild(self, guild_id):
+        """
+        Returns the shard of a guild, loading it if it is not in memory.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+
+        Returns:
+            JSONScoreStore: The shard of the guild.
+        """
+        entry = self.shards.get(guild_id)
+        if entry is None:
+            shard = JSONScoreStore(self.get_shard_path(guild_id), self.flush_interval, self.flush_every)
+            shard.load()
+            self.counts["loads"] += 1
+        else:
+            shard = entry[0]
+            self.shards.move_to_end(guild_id)
+
+        self.shards[guild_id] = (shard, time.monotonic())
+        if entry is None and self.on_load is not None:
+            self.on_load(guild_id, shard.user_scores)
+
+        return shard
+
+    def release_idle(self):
+        """
+        Drops the shards idle for longer than idle_timeout, and the least recently accessed ones past max_shards,
+        writing them first if they are dirty.
+        """
+        now = time.monotonic()
+        for guild_id, (shard, accessed_at) in list(self.shards.items()):
+            if now - accessed_at < self.idle_timeout and len(self.shards) <= self.max_shards:
+                break
+
+            shard.flush()
+            del self.shards[guild_id]
+            self.counts["evictions"] += 1
+            if self.on_evict is not None:
+                self.on_evict(guild_id)
+
+    def load(self):
+        """
+        Drops every loaded shard, so that each is read from its file again when it is next accessed.
+
+        Returns:
+            dict: The user scores of the direct messages.
+        """
+        self.shards.clear()
+        return self.user_scores
+
+    def changed_externally(self):
+        """
+        Returns `True` if the file of a loaded shard was modified by someone else since it was last loaded or written.
+
+        Returns:
+            bool: Whether some in-memory scores may be stale.
+        """
+        return any(shard.changed_externally() for shard, _ in self.shards.values())
+
+    def update_scores(self, user_id):
+        """
+        Records that the scores of the given user in the direct messages changed.
+
+        Parameters:
+            user_id (str): The user id whose scores changed.
+
+        Returns:
+            bool: Whether enough updates piled up to flush before the flush interval ends.
+        """
+        return self.for_guild(None).update_scores(user_id)
+
+    def save(self):
+        """
+        Writes every loaded shard to its file immediately.
+        """
+        for shard, _ in list(self.shards.values()):
+            shard.save()
+
+    def flush(self):
+        """
+        Writes the loaded shards that have updates that have not been written yet.
+        """
+        for shard, _ in list(self.shards.values()):
+            shard.flush()
+
+    def serialize(self):
+        """
+        Takes a snapshot of the dirty shards and marks them clean.
+
+        Returns:
+            list: (shard, payload) tuples of the dirty shards.
+        """
+        return [(shard, shard.serialize()) for shard, _ in self.shards.values() if shard.dirty]
+
+    def write(self, payload):
+        """
+        Writes the snapshots taken by serialize to the files of their shards. A shard that fails is marked dirty
+        again, and the other shards are still written.
+
+        Parameters:
+            payload (list): The (shard, payload) tuples returned by serialize.
+
+        Raises:
+            OSError: The first error a shard failed with, once every shard was attempted.
+        """
+        error = None
+        for shard, data in payload:
+            try:
+                shard.write(data)
+            except Exception as exception:
+                error = error or exception
+
+        if error is not None:
+            raise error
+
+    def stats(self):
+        """
+        Returns the counters of the store.
+
+        Returns:
+            dict: Number of shards in memory and of dirty updates, and how many times shards were loaded and evicted.
+        """
+        return dict(self.counts, loaded=len(self.shards), dirty=self.dirty)
@@ -0,0 +1,527 @@
+"""
+This script contains the scorer interface the Discord bot scores messages through, and the backends that do not need
+OpenAI: a deterministic local lexicon scorer, a scorer failing over to another one when the first gets slow, and a fake
+OpenAI-compatible HTTP server for load tests, CI and outages.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORD = re.compile(r"[a-z']+")
+REPEATED_CHARACTER = re.compile(r"(.)\1\1")
+
+
+class Scorer:
+    """
+    The interface of the scoring backends.
+
+    A backend implements get_message_score; the asynchronous and batch versions default to running it in the
+    executor, and backends able to do better override them. Backends sending requests add the tokens they consume to
+    the usage dict they are given, and backends with several scoring modes honor the scoring_mode they are given.
+    """
+
+    categories = ['grammar', 'friendliness', 'humor']
+    executor = None
+
+    def generate_default_scores(self):
+        """
+        Generates default scores for each category.
+
+        Returns:
+            dict: default scores for each category
+        """
+        return {"grammar": 10, "friendliness": 10, "humor": 10}
+
+    def get_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Processes the text and generates various scores on different categories.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        raise NotImplementedError
+
+    async def aget_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Asynchronous version of get_message_score that does not block the event loop.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.get_message_score, content, usage, scoring_mode)
+
+    async def aget_batch_scores(self, contents, usage=None, scoring_mode=None):
+        """
+        Generates the scores of several messages.
+
+        Parameters:
+            contents (list): texts to generate scores for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            list: scores for each category, one dict per text in the same order
+        """
+        return list(
+            await asyncio.gather(*(self.aget_message_score(content, usage, scoring_mode) for content in contents))
+        )
+
+    def rating_to_score(self, rating):
+        """
+        Converts a raw rating into a category score.
+
+        Parameters:
+            rating (int): rating between 0 and 10
+
+        Returns:
+            int: score [-1, 0, 1], or -1001 if the rating is out of range
+        """
+        score = ((rating / 5) - 1) * 10
+
+        if score < -10 or score > 10:
+            return -1001
+
+        if score <= 0:
+            return -1
+        if score == 0:
+            return 0
+        if score >= 0:
+            return 1
+
+    def close(self):
+        """
+        Releases the resources of the backend.
+        """
+
+
+class LexiconScorer(Scorer):
+    """
+    A deterministic local backend rating messages with word lists and a few writing heuristics.
+
+    It is far less accurate than a language model, but it is fast, free and always available, which makes it suitable
+    for load tests, CI, and keeping the bot working during an OpenAI outage.
+    """
+
+    # fmt: off
+    positive_words = {
+        "thanks", "thank", "thx", "ty", "please", "love", "great", "awesome", "nice", "welcome", "appreciate",
+        "congrats", "congratulations", "glad", "happy", "kind", "cool", "amazing", "sorry", "hello", "hi", "hey",
+    }
+    negative_words = {
+        "hate", "stupid", "idiot", "dumb", "shut", "garbage", "trash", "ugly", "loser", "sucks", "annoying", "worst",
+        "useless", "moron", "pathetic", "disgusting", "kill",
+    }
+    # fmt: on
+    humor_words = {"lol", "lmao", "rofl", "haha", "hahaha", "lmfao", "joke", "pun", "xd", "jk", "funny", "hilarious"}
+    slang_words = {"u", "ur", "r", "pls", "plz", "idk", "dunno", "gonna", "wanna", "ya", "im", "dont", "cant", "wont"}
+    humor_symbols = {"\U0001f602", "\U0001f923", "\U0001f606", "\U0001f639"}
+
+    def get_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Processes the text and generates various scores on different categories.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        return {category: self.rating_to_score(rating) for category, rating in self.rate(content).items()}
+
+    async def aget_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Asynchronous version of get_message_score. The lexicon is fast enough to run on the event loop.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        return self.get_message_score(content)
+
+    def rate(self, content):
+        """
+        Rates a message in every category on the same 0 to 10 scale as the OpenAI prompts.
+
+        Parameters:
+            content (str): text to rate
+
+        Returns:
+            dict: rating between 0 and 10 for each category
+        """
+        stripped = content.strip()
+        words = WORD.findall(stripped.lower())
+
+        grammar = 10
+        letters = [character for character in stripped if character.isalpha()]
+        if letters and not letters[0].isupper():
+            grammar -= 2
+        if stripped and stripped[-1] not in ".!?\"')":
+            grammar -= 2
+        if len(letters) > 3 and all(character.isupper() for character in letters):
+            grammar -= 3
+        if REPEATED_CHARACTER.search(stripped.lower()):
+            grammar -= 2
+        grammar -= min(3, sum(word in self.slang_words for word in words))
+
+        friendliness = 6
+        friendliness += 2 * sum(word in self.positive_words for word in words)
+        friendliness -= 3 * sum(word in self.negative_words for word in words)
+
+        humor = 2
+        humor += 3 * sum(word in self.humor_words for word in words)
+        humor += 3 * sum(character in self.humor_symbols for character in stripped)
+        if "?" in stripped and ("because" in words or "why" in words and len(words) > 4):
+            humor += 3
+
+        return {
+            "grammar": max(0, min(10, grammar)),
+            "friendliness": max(0, min(10, friendliness)),
+            "humor": max(0, min(10, humor)),
+        }
+
+
+class FailoverScorer(Scorer):
+    """
+    A backend scoring messages with a primary backend, and failing over to a fallback backend whenever the primary
+    one takes longer than latency_threshold seconds, raises, or cannot calculate any category.
+
+    After a failover the fallback backend is used for cooldown seconds before the primary one is tried again.
+    """
+
+    def __init__(self, primary, fallback, latency_threshold=5.0, cooldown=60.0):
+        """
+        Initializes a new instance of the FailoverScorer class.
+
+        Parameters:
+            primary (Scorer): The backend used while it is healthy.
+            fallback (Scorer): The backend used while the primary one is slow or failing.
+            latency_threshold (float): Number of seconds after which the primary backend is considered too slow.
+            cooldown (float): Number of seconds the fallback backend is used after a failover.
+        """
+        self.primary = primary
+        self.fallback = fallback
+        self.latency_threshold = latency_threshold
+        self.cooldown = cooldown
+        self.degraded_until = 0.0
+        self.failovers = 0
+
+    def generate_default_scores(self):
+        """
+        Generates default scores for each category, as the primary backend does.
+
+        Returns:
+            dict: default scores for each category
+        """
+        return self.primary.generate_default_scores()
+
+    def is_degraded(self):
+        """
+        Returns `True` if the fallback backend is in use.
+
+        Returns:
+            bool: Whether the primary backend is being skipped.
+        """
+        return time.monotonic() < self.degraded_until
+
+    def fail_over(self):
+        """
+        Switches to the fallback backend for the cooldown.
+        """
+        self.degraded_until = time.monotonic() + self.cooldown
+        self.failovers += 1
+
+    def get_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Processes the text and generates various scores on different categories. A slow primary backend only triggers
+        a failover for the next messages, since a blocking call cannot be abandoned.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        if self.is_degraded():
+            return self.fallback.get_message_score(content, usage, scoring_mode)
+
+        started = time.monotonic()
+        try:
+            scores = self.primary.get_message_score(content, usage, scoring_mode)
+        except Exception:
+            self.fail_over()
+            return self.fallback.get_message_score(content, usage, scoring_mode)
+
+        if time.monotonic() - started > self.latency_threshold:
+            self.fail_over()
+        if all(score == -1001 for score in scores.values()):
+            self.fail_over()
+            return self.fallback.get_message_score(content, usage, scoring_mode)
+
+        return scores
+
+    async def aget_message_score(self, content, usage=None, scoring_mode=None):
+        """
+        Asynchronous version of get_message_score. A primary backend slower than the threshold is abandoned and the
+        message is scored by the fallback backend right away.
+
+        Parameters:
+            content (str): text to generate score for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            dict: scores for each category
+        """
+        if self.is_degraded():
+            return await self.fallback.aget_message_score(content, usage, scoring_mode)
+
+        try:
+            scores = await asyncio.wait_for(
+                self.primary.aget_message_score(content, usage, scoring_mode), timeout=self.latency_threshold
+            )
+        except Exception:
+            self.fail_over()
+            return await self.fallback.aget_message_score(content, usage, scoring_mode)
+
+        if all(score == -1001 for score in scores.values()):
+            self.fail_over()
+            return await self.fallback.aget_message_score(content, usage, scoring_mode)
+
+        return scores
+
+    async def aget_batch_scores(self, contents, usage=None, scoring_mode=None):
+        """
+        Generates the scores of several messages, with a single failover decision for the whole batch.
+
+        Parameters:
+            contents (list): texts to generate scores for
+            usage (dict): token counts the tokens consumed by the backend are added to, if not None
+            scoring_mode (str): scoring mode to use instead of the backend's own, ignored by backends without modes
+
+        Returns:
+            list: scores for each category, one dict per text in the same order
+        """
+        if self.is_degraded():
+            return await self.fallback.aget_batch_scores(contents, usage, scoring_mode)
+
+        try:
+            return await asyncio.wait_for(
+                self.primary.aget_batch_scores(contents, usage, scoring_mode), timeout=self.latency_threshold
+            )
+        except Exception:
+            self.fail_over()
+            return await self.fallback.aget_batch_scores(contents, usage, scoring_mode)
+
+    def close(self):
+        """
+        Releases the resources of both backends.
+        """
+        self.primary.close()
+        self.fallback.close()
+
+
+class FakeOpenAIServer:
+    """
+    A local HTTP server answering the chat completion requests of OpenAIHandler in the OpenAI response format.
+
+    The ratings come from a LexiconScorer, and every response can be delayed to simulate the latency of the real API.
+    Point an OpenAIHandler at it with api_base=server.url.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, scorer=None):
+        """
+        Initializes a new instance of the FakeOpenAIServer class. The server starts listening with start.
+
+        Parameters:
+            host (str): The host to listen on.
+            port (int): The port to listen on, a free one is picked if 0.
+            latency (float): Number of seconds every response is delayed.
+            scorer (LexiconScorer): The scorer rating the messages, a new one is created if None.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.scorer = scorer if scorer is not None else LexiconScorer()
+        self.server = None
+        self.thread = None
+        self.requests = 0
+
+    @property
+    def url(self):
+        """
+        str: The API base URL of the server.
+        """
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        """
+        Starts serving requests from a background thread.
+
+        Returns:
+            FakeOpenAIServer: The server itself.
+        """
+        fake_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                response = fake_server.complete(request)
+
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for chunk in fake_server.stream_chunks(response):
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    return
+
+                body = json.dumps(response).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="FakeOpenAIServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving requests.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+
+    def complete(self, request):
+        """
+        Builds the chat completion response to a request.
+
+        Parameters:
+            request (dict): The decoded body of the request.
+
+        Returns:
+            dict: The chat completion response.
+        """
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        content = self.answer(prompt)
+
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def stream_chunks(self, response):
+        """
+        Splits a chat completion response into the chunks of a streamed response, one per character.
+
+        Parameters:
+            response (dict): The chat completion response.
+
+        Returns:
+            list: The chat completion chunks.
+        """
+        content = response["choices"][0]["message"]["content"]
+        deltas = [{"role": "assistant"}] + [{"content": character} for character in content] + [{}]
+        return [
+            {
+                "id": response["id"],
+                "object": "chat.completion.chunk",
+                "created": response["created"],
+                "model": response["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}],
+            }
+            for delta in deltas
+        ]
+
+    def answer(self, prompt):
+        """
+        Answers a scoring prompt the way the model is instructed to.
+
+        Parameters:
+            prompt (str): A category, combined or batch prompt followed by the message(s) to rate.
+
+        Returns:
+            str: A single rating, a JSON object of ratings, or a JSON array of them.
+        """
+        if "Your sentences:" in prompt:
+            sentences = prompt.rsplit("Your sentences:", 1)[1].strip().splitlines()
+            messages = [self.parse_sentence(sentence) for sentence in sentences if sentence.strip()]
+            return json.dumps([self.scorer.rate(message) for message in messages])
+
+        instructions, _, message = prompt.rpartition("Your first sentence: ")
+        ratings = self.scorer.rate(message)
+
+        if '"grammar"' in instructions:
+            return json.dumps(ratings)
+        if "grammar" in instructions:
+            return str(ratings["grammar"])
+        if "humor" in instructions:
+            return str(ratings["humor"])
+        return str(ratings["friendliness"])
+
+    def parse_sentence(self, sentence):
+        """
+        Extracts the message from a numbered line of a batch prompt.
+
+        Parameters:
+            sentence (str): A line such as 1. "Hello there!"
+
+        Returns:
+            str: The message.
+        """
+        text = sentence.split(".", 1)[1].strip() if "." in sentence else sentence
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
@@ -0,0 +1,201 @@
+"""
+This script contains the implementation of the TokenBudget class, which accounts the OpenAI tokens spent on every
+guild, channel and user, and tells the Discord bot how far to step down its scoring as their daily budgets run out.
+"""
+
+import threading
+from datetime import date
+
+
+class TokenBudget:
+    """
+    Daily token budgets per guild, channel and user, with adaptive degradation.
+
+    Messages are scored normally while every budget they are charged to has less than combined_at of it spent. Past
+    that they are rated with the single combined prompt, past sampled_at only one message in sample_every of each
+    channel is rated that way, and once a budget is spent they are scored locally without any request. The spent tokens
+    are reset when the day changes.
+    """
+
+    levels = ['full', 'combined', 'sampled', 'local']
+    scopes = ['guild', 'channel', 'user']
+
+    def __init__(
+        self,
+        guild_budget=None,
+        channel_budget=None,
+        user_budget=None,
+        combined_at=0.5,
+        sampled_at=0.8,
+        sample_every=5,
+    ):
+        """
+        Initializes a new instance of the TokenBudget class.
+
+        Parameters:
+            guild_budget (int): Number of tokens a guild may spend per day, unlimited if None.
+            channel_budget (int): Number of tokens a channel may spend per day, unlimited if None.
+            user_budget (int): Number of tokens the messages of a user may spend per day, unlimited if None.
+            combined_at (float): Fraction of a budget past which messages are rated with the combined prompt.
+            sampled_at (float): Fraction of a budget past which only some messages are rated.
+            sample_every (int): One message in this many is rated once a budget is past sampled_at.
+
+        Raises:
+            ValueError: If the thresholds are not increasing fractions, or sample_every is not positive.
+        """
+        if not 0 < combined_at <= sampled_at <= 1 or sample_every < 1:
+            raise ValueError("Invalid budget thresholds.")
+
+        self.budgets = {"guild": guild_budget, "channel": channel_budget, "user": user_budget}
+        self.combined_at = combined_at
+        self.sampled_at = sampled_at
+        self.sample_every = sample_every
+        self.spent = {}
+        self.samples = {}
+        self.totals = dict.fromkeys(self.scopes, 0)
+        self.level_counts = dict.fromkeys(self.levels, 0)
+        self.day = date.today()
+        self.lock = threading.Lock()
+
+    def get_keys(self, guild_id, channel_id, user_id):
+        """
+        Returns the keys of the budgets a message is charged to.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+
+        Returns:
+            list: (scope, ID) tuples, without the scopes whose ID is None.
+        """
+        ids = {"guild": guild_id, "channel": channel_id, "user": user_id}
+        return [(scope, ids[scope]) for scope in self.scopes if ids[scope] is not None]
+
+    def roll_over(self):
+        """
+        Resets the spent tokens if the day changed. Must be called with the lock held.
+        """
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.spent.clear()
+            self.samples.clear()
+            self.totals = dict.fromkeys(self.scopes, 0)
+
+    def fraction_spent(self, guild_id, channel_id, user_id):
+        """
+        Returns the largest fraction spent of the budgets a message is charged to.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+
+        Returns:
+            float: The fraction, 0.0 if none of the budgets is limited.
+        """
+        with self.lock:
+            self.roll_over()
+            fractions = [
+                self.spent.get(key, 0) / self.budgets[key[0]]
+                for key in self.get_keys(guild_id, channel_id, user_id)
+                if self.budgets[key[0]]
+            ]
+
+        return max(fractions, default=0.0)
+
+    def get_level(self, guild_id, channel_id, user_id):
+        """
+        Returns how a message is to be scored.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+
+        Returns:
+            str: "full" to score it normally, "combined" to rate it with the combined prompt, "sampled" to rate it with
+                the combined prompt only if it is sampled, or "local" to score it without any request.
+        """
+        fraction = self.fraction_spent(guild_id, channel_id, user_id)
+
+        if fraction >= 1:
+            level = "local"
+        elif fraction >= self.sampled_at:
+            level = "sampled"
+        elif fraction >= self.combined_at:
+            level = "combined"
+        else:
+            level = "full"
+
+        with self.lock:
+            self.level_counts[level] += 1
+
+        return level
+
+    def should_sample(self, guild_id, channel_id):
+        """
+        Returns `True` for one message in sample_every of a channel.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+
+        Returns:
+            bool: Whether the message is rated.
+        """
+        with self.lock:
+            count = self.samples.get((guild_id, channel_id), 0)
+            self.samples[(guild_id, channel_id)] = count + 1
+
+        return count % self.sample_every == 0
+
+    def record(self, guild_id, channel_id, user_id, tokens):
+        """
+        Charges the tokens spent on a message to its guild, channel and author.
+
+        Parameters:
+            guild_id (int): The ID of the guild, or None for direct messages.
+            channel_id (int): The ID of the channel.
+            user_id (int): The ID of the author.
+            tokens (float): The number of tokens spent.
+        """
+        if not tokens:
+            return
+
+        with self.lock:
+            self.roll_over()
+            for key in self.get_keys(guild_id, channel_id, user_id):
+                self.spent[key] = self.spent.get(key, 0) + tokens
+                self.totals[key[0]] += tokens
+
+    def get_spent(self, scope, scope_id):
+        """
+        Returns the number of tokens spent today by a guild, channel or user.
+
+        Parameters:
+            scope (str): "guild", "channel" or "user".
+            scope_id (int): The ID of the guild, channel or user.
+
+        Returns:
+            float: The number of tokens spent.
+        """
+        with self.lock:
+            self.roll_over()
+            return self.spent.get((scope, scope_id), 0)
+
+    def stats(self):
+        """
+        Returns the counters of the budget.
+
+        Returns:
+            dict: Number of tokens spent today per scope, and number of messages scored at each level.
+        """
+        with self.lock:
+            self.roll_over()
+            return {
+                "tokens": dict(self.totals),
+                "levels": dict(self.level_counts),
+                "tracked": len(self.spent),
+            }
@@ -1,12 +1,33 @@
+import asyncio
 import json
 import os
 import pytest
+import threading
+import urllib.request
 import discord
+import openai
+from aggregates import ScoreAggregates
+from batch_scorer import BatchScorer
+from benchmark import Benchmark, generate_messages, load_messages
 from faker import Faker
-from unittest.mock import Mock
-from discord_bot import DiscordBot
-from openai_handler import OpenAIHandler
-from main import run
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, Mock, PropertyMock, patch
+from debouncer import MessageDebouncer
+from discord_bot import DiscordBot, ShardedDiscordBot
+from leaderboard import Leaderboard, RankingIndex
+from openai_handler import OpenAIHandler, parse_rating, percentile
+from log_writer import LogWriter
+from message_filter import MessageFilter
+from metrics import Metrics
+from prompt_cache import PromptCache
+from request_scheduler import RequestScheduler, TokenBucket
+from sampling import SamplingPolicy
+from score_cache import ScoreCache
+from scorers import FailoverScorer, FakeOpenAIServer, LexiconScorer
+from score_store import BinaryScoreStore, GuildScoreStore, JSONScoreStore, ScoreTable, SQLiteScoreStore, UserScores
+from token_budget import TokenBudget
+from work_queue import WorkQueue
+from main import launch_shards, parse_arguments, run, split_shards
 
 
 @pytest.fixture
@@ -102,6 +123,253 @@ def test_save_user_scores(bot):
     assert test_scores is not None
 
 
+def test_score_store_write_behind(tmp_path):
+    path = tmp_path / "user_scores.json"
+    store = JSONScoreStore(str(path), flush_interval=60.0, flush_every=2)
+    store.load()["user"] = {"grammar": 11, "friendliness": 10, "humor": 10}
+
+    assert not store.mark_dirty()
+    assert not path.exists()
+
+    assert store.mark_dirty()
+    store.flush()
+
+    with open(path, "r") as file:
+        assert json.load(file) == {"user": {"grammar": 11, "friendliness": 10, "humor": 10}}
+    assert store.dirty == 0
+    assert os.listdir(tmp_path) == ["user_scores.json"]
+
+
+def test_failed_flush_is_retried(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    bot.update_scores("user", {"grammar": 1, "friendliness": 0, "humor": -1})
+    bot.flush_event = asyncio.Event()
+    bot.flush_event.set()
+
+    with patch.object(bot, "is_closed", side_effect=[False, True]), patch("os.replace", side_effect=OSError):
+        asyncio.run(bot.flush_user_scores_periodically())
+
+    assert bot.score_store.dirty and os.listdir(tmp_path) == []
+    bot.score_store.flush()
+    with open(bot.user_scores_path, "r") as file:
+        assert json.load(file)["user"]["grammar"] == 11
+
+
+def test_save_updated_scores_writes_behind(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+
+    bot.update_scores("user", {"grammar": 1, "friendliness": 0, "humor": -1})
+
+    assert not os.path.exists(bot.user_scores_path)
+
+    asyncio.run(bot.close())
+
+    with open(bot.user_scores_path, "r") as file:
+        assert json.load(file)["user"] == {"grammar": 11, "friendliness": 10, "humor": 9}
+
+
+def test_sqlite_score_store(tmp_path):
+    path = str(tmp_path / "user_scores.db")
+    store = SQLiteScoreStore(path)
+    store.load()["user"] = {"grammar": 11, "friendliness": 10, "humor": 9}
+
+    assert not store.update_scores("user")
+    store.user_scores["user"]["grammar"] += 1
+    store.update_scores("user")
+    store.close()
+
+    reopened = SQLiteScoreStore(path)
+    assert reopened.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert reopened.load() == {"user": {"grammar": 12, "friendliness": 10, "humor": 9}}
+    reopened.close()
+
+
+def test_sqlite_score_store_migration(tmp_path):
+    json_path = tmp_path / "user_scores.json"
+    json_path.write_text(json.dumps({"1": {"grammar": 12, "friendliness": 10, "humor": 9}}))
+    store = SQLiteScoreStore(str(tmp_path / "user_scores.db"))
+
+    assert store.migrate_from_json(str(json_path)) == 1
+    assert store.user_scores == {"1": {"grammar": 12, "friendliness": 10, "humor": 9}}
+
+    json_path.write_text(json.dumps({"1": {"grammar": 0, "friendliness": 0, "humor": 0}}))
+    assert store.migrate_from_json(str(json_path)) == 0
+    assert store.load()["1"]["grammar"] == 12
+    store.close()
+
+
+def test_user_scores_normalizes_ids():
+    user_scores = UserScores({1: {"grammar": 10}})
+    user_scores["2"] = {"grammar": 20}
+
+    assert 1 in user_scores and "1" in user_scores
+    assert user_scores[2] == {"grammar": 20}
+    assert list(user_scores) == ["1", "2"]
+
+
+def test_me_served_from_memory(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.user_scores = {}
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    bot.update_scores(1234, {"grammar": 1, "friendliness": 0, "humor": 0})
+    message = Mock(author=Mock(id=1234), content="!me")
+    message.channel.send = AsyncMock()
+
+    with patch.object(bot, "load_user_scores") as load_user_scores:
+        asyncio.run(bot.on_message(message))
+
+        load_user_scores.assert_not_called()
+
+    assert "Grammar:** 11**" in message.channel.send.call_args.kwargs["embed"].description
+
+
+def test_get_user_scores_reloads_external_change(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.user_scores = bot.load_user_scores()
+    assert bot.get_user_scores(1234) is None
+
+    with open(bot.user_scores_path, "w") as file:
+        json.dump({"1234": {"grammar": 5, "friendliness": 5, "humor": 5}}, file)
+
+    assert bot.get_user_scores(1234) == {"grammar": 5, "friendliness": 5, "humor": 5}
+
+
+def test_shared_sqlite_score_store(tmp_path):
+    path = str(tmp_path / "user_scores.db")
+    first = SQLiteScoreStore(path, shared=True)
+    second = SQLiteScoreStore(path, shared=True)
+    first.load()
+    second.load()
+
+    first.user_scores["user"] = {"grammar": 11, "friendliness": 10, "humor": 10}
+    first.update_scores("user")
+
+    assert second.fetch_user("user")
+    second.user_scores["user"]["grammar"] += 1
+    second.update_scores("user")
+
+    first.user_scores["user"]["humor"] -= 1
+    first.update_scores("user")
+
+    assert first.user_scores["user"] == {"grammar": 12, "friendliness": 10, "humor": 9}
+    assert SQLiteScoreStore(path).load()["user"] == {"grammar": 12, "friendliness": 10, "humor": 9}
+    first.close()
+    second.close()
+
+
+def test_score_table():
+    table = ScoreTable({1: {"grammar": 10, "friendliness": 10, "humor": 10}, 2: {"grammar": 5}})
+    table[1]["grammar"] += 2
+    table.add(2, {"grammar": 1, "humor": -1}, weight=3)
+    del table[1]
+    table[3] = {"humor": 7}
+
+    assert table == {"2": {"grammar": 8, "humor": -3}, "3": {"humor": 7}}
+    assert len(table.users) == 2 and "grammar" not in table[3]
+
+    copy = ScoreTable.from_bytes(table.to_bytes())
+    assert copy.to_dict() == table.to_dict()
+    assert sorted(copy) == ["2", "3"]
+
+    with pytest.raises(ValueError):
+        table[3]["humor"] = 0.5
+
+
+def test_binary_score_store(tmp_path):
+    json_path = str(tmp_path / "user_scores.json")
+    with open(json_path, "w") as file:
+        json.dump({"1": {"grammar": 12, "friendliness": 10, "humor": 9}}, file)
+
+    store = BinaryScoreStore(str(tmp_path / "user_scores.bin"))
+    assert store.migrate_from_json(json_path) == 1
+    store.user_scores["1"]["humor"] += 1
+    store.update_scores("1")
+    store.flush()
+
+    assert BinaryScoreStore(store.path).load() == {"1": {"grammar": 12, "friendliness": 10, "humor": 10}}
+    assert store.migrate_from_json(json_path) == 0
+
+
+def test_shared_sqlite_score_store_new_user(tmp_path):
+    path = str(tmp_path / "user_scores.db")
+    defaults = {"grammar": 10, "friendliness": 10, "humor": 10}
+    first = SQLiteScoreStore(path, shared=True, default_scores=defaults)
+    second = SQLiteScoreStore(path, shared=True, default_scores=defaults)
+    first.load()
+    second.load()
+
+    first.user_scores["user"] = {"grammar": 11, "friendliness": 10, "humor": 10}
+    second.user_scores["user"] = {"grammar": 10, "friendliness": 12, "humor": 10}
+    first.update_scores("user")
+    second.update_scores("user")
+
+    assert SQLiteScoreStore(path).load()["user"] == {"grammar": 11, "friendliness": 12, "humor": 10}
+    first.close()
+    second.close()
+
+
+def test_guild_score_store(tmp_path):
+    store = GuildScoreStore(str(tmp_path / "guilds"), max_shards=1)
+    store.for_guild(1).user_scores["user"] = {"grammar": 11, "friendliness": 10, "humor": 10}
+    store.for_guild(1).update_scores("user")
+    store.for_guild(2).user_scores["user"] = {"grammar": 9, "friendliness": 10, "humor": 10}
+    store.for_guild(2).update_scores("user")
+
+    assert store.dirty == 2
+    store.write(store.serialize())
+    store.release_idle()
+
+    assert list(store.shards) == [2]
+    assert store.for_guild(1).user_scores["user"]["grammar"] == 11
+    assert store.stats()["loads"] == 3 and store.stats()["evictions"] == 1
+    assert sorted(os.listdir(tmp_path / "guilds")) == ["1.json", "2.json"]
+
+
+def test_scores_partitioned_by_guild(bot, tmp_path):
+    bot.score_store = GuildScoreStore(str(tmp_path / "guilds"))
+    bot.openai_handler.generate_default_scores.side_effect = lambda: {"grammar": 10, "friendliness": 10, "humor": 10}
+    bot.update_scores(1234, {"grammar": 1, "friendliness": 0, "humor": 0}, guild_id=1)
+    bot.update_scores(1234, {"grammar": -1, "friendliness": 0, "humor": 0}, guild_id=2)
+
+    assert bot.get_user_scores(1234, 1)["grammar"] == 11
+    assert bot.get_user_scores(1234, 2)["grammar"] == 9
+    assert bot.get_user_scores(1234) is None
+
+
+def test_guild_eviction_drops_rankings_and_aggregates(tmp_path):
+    store = GuildScoreStore(str(tmp_path / "guilds"), max_shards=1)
+    aggregates = ScoreAggregates(
+        ['grammar', 'friendliness', 'humor'], path=str(tmp_path / "aggregates"), partitioned=True
+    )
+    openai_handler = Mock()
+    openai_handler.generate_default_scores.side_effect = lambda: {"grammar": 10, "friendliness": 10, "humor": 10}
+    bot = DiscordBot(
+        discord.Intents.default(),
+        openai_handler,
+        "scripts/tests_tmp/test_log.txt",
+        None,
+        score_store=store,
+        aggregates=aggregates,
+    )
+    bot.update_scores(1234, {"grammar": 1, "friendliness": 0, "humor": 0}, guild_id=1)
+    bot.update_scores(1234, {"grammar": -1, "friendliness": 0, "humor": 0}, guild_id=2)
+
+    assert aggregates.get_recent(1234, guild_id=1)["day"]["grammar"] == 1
+    assert aggregates.get_recent(1234, guild_id=2)["day"]["grammar"] == -1
+
+    store.write(store.serialize())
+    store.release_idle()
+    assert list(bot.leaderboard.boards) == [2] and sorted(aggregates.guilds) == [2]
+
+    aggregates.reset(1234, 2)
+    assert aggregates.get_recent(1234, guild_id=2) is None
+    assert bot.leaderboard.top(1) == [] and bot.get_user_scores(1234, 1)["grammar"] == 11
+    assert bot.leaderboard.top(1) == [("1234", 31)]
+    assert aggregates.get_recent(1234, guild_id=1)["day"]["messages"] == 1
+
+
 def test_update_log_file(bot):
     test_nickname = Faker().name()
     test_content = Faker().text()
@@ -110,6 +378,7 @@ def test_update_log_file(bot):
         os.remove(bot.log_file_path)
 
     bot.update_log_file(test_nickname, test_content)
+    bot.log_writer.flush()
 
     assert os.path.exists(bot.log_file_path)
 
@@ -120,6 +389,80 @@ def test_update_log_file(bot):
     assert test_nickname + ": " + test_content in log_contents
 
 
+def test_log_writer_rotation(tmp_path):
+    path = str(tmp_path / "log.txt")
+    writer = LogWriter(path, max_batch=2, flush_interval=60.0, max_bytes=1, compress=True)
+
+    writer.write("first\n")
+    writer.write("second\n")
+    writer.flush()
+    writer.write("third\n")
+    writer.close()
+
+    with open(path, "r") as file:
+        assert file.read() == "Log file created.\nthird\n"
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".gz")]) == 1
+    assert writer.stats() == {"queued": 0, "written": 3, "dropped": 0, "errors": 0, "rotations": 1}
+
+
+def test_log_writer_survives_write_errors(tmp_path):
+    writer = LogWriter(str(tmp_path / "missing" / "log.txt"))
+
+    writer.write("lost\n")
+    assert writer.flush(timeout=5)
+    os.mkdir(tmp_path / "missing")
+    writer.write("kept\n")
+    writer.close()
+
+    with open(writer.path, "r") as file:
+        assert file.read() == "Log file created.\nkept\n"
+    assert writer.stats()["errors"] == 1 and writer.stats()["dropped"] == 1
+
+
+def test_log_writer_drops_when_full(tmp_path):
+    writer = LogWriter(str(tmp_path / "log.txt"), max_queue=1)
+    writer.start = Mock()
+
+    writer.write("first\n")
+    writer.write("second\n")
+
+    assert writer.stats()["dropped"] == 1
+
+
+def test_message_filter():
+    message_filter = MessageFilter(guild_rules={42: {"emoji_only": "skip", "min_length": 1}})
+
+    assert message_filter.classify("") == ("skip", "empty")
+    assert message_filter.classify("https://example.com/cat.gif") == ("skip", "link_only")
+    assert message_filter.classify("\U0001f602\U0001f44d\U0001f3fd") == ("neutral", "emoji_only")
+    assert message_filter.classify("<:pepe:123456> <a:party:654321>") == ("neutral", "emoji_only")
+    assert message_filter.classify("k") == ("neutral", "too_short")
+    assert message_filter.classify("look at https://example.com") == ("score", None)
+    assert message_filter.classify("Hello there!") == ("score", None)
+
+    assert message_filter.classify("\U0001f602", guild_id=42) == ("skip", "emoji_only")
+    assert message_filter.classify("k", guild_id=42) == ("score", None)
+
+    assert message_filter.stats()["filtered"] == 6
+    assert message_filter.stats()["api_calls_saved"] == 18
+
+    with pytest.raises(ValueError):
+        MessageFilter(rules={"empty": "ignore"})
+
+
+def test_on_message_filters_trivial_messages(bot):
+    bot.openai_handler.aget_message_score = AsyncMock()
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=Faker().pyint()), content="\U0001f602", guild=None)
+    message.channel.send = AsyncMock()
+
+    asyncio.run(bot.on_message(message))
+
+    bot.openai_handler.aget_message_score.assert_not_awaited()
+    message.channel.send.assert_not_awaited()
+    assert bot.user_scores[message.author.id] == {"grammar": 10, "friendliness": 10, "humor": 10}
+
+
 def test_generate_default_scores(handler):
     test_data = handler.generate_default_scores()
     assert test_data == {"grammar": 10, "friendliness": 10, "humor": 10}
@@ -174,6 +517,867 @@ def test_get_humor_score_invalid(handler):
     assert handler.get_humor_score(content) == expected_score
 
 
+def test_parse_combined_response(handler):
+    response = 'Sure! {"grammar": 9, "friendliness": 7, "humor": 2}'
+    assert handler.parse_combined_response(response) == {"grammar": 9, "friendliness": 7, "humor": 2}
+
+    assert handler.parse_combined_response("9") is None
+    assert handler.parse_combined_response('{"grammar": 9, "friendliness": 7}') is None
+    assert handler.parse_combined_response('{"grammar": "9", "friendliness": 7, "humor": 2}') is None
+    assert handler.parse_combined_response('{"grammar": 9, "friendliness": 7, "humor": 2') is None
+
+
+def test_get_message_score_combined(handler):
+    handler.combined_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    handler.scoring_mode = "combined"
+
+    with patch.object(handler, "create_chat_completion", return_value='{"grammar": 10, "friendliness": 8, "humor": 0}'):
+        scores = handler.get_message_score("Hello world!")
+
+        assert scores == {"grammar": 1, "friendliness": 1, "humor": -1}
+        handler.create_chat_completion.assert_called_once()
+
+
+def test_get_message_score_combined_fallback(handler):
+    handler.combined_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    handler.scoring_mode = "combined"
+
+    with patch.object(handler, "create_chat_completion", side_effect=["not json", "10", "8", "0"]):
+        scores = handler.get_message_score("Hello world!")
+
+        assert scores == {"grammar": 1, "friendliness": 1, "humor": -1}
+        assert handler.create_chat_completion.call_count == 4
+
+
+def test_aget_message_score(handler):
+    with patch.object(handler, "get_category_score", side_effect=lambda category, content, usage=None: 1):
+        scores = asyncio.run(handler.aget_message_score("Hello world!"))
+
+        assert scores == {"grammar": 1, "friendliness": 1, "humor": 1}
+        assert handler.get_category_score.call_count == 3
+
+
+def test_on_message_awaits_async_score(bot):
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 0, "humor": -1})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=Faker().pyint()), content="Hello there!")
+    message.channel.send = AsyncMock()
+
+    asyncio.run(bot.on_message(message))
+
+    bot.openai_handler.aget_message_score.assert_awaited_once_with("Hello there!", usage=None, scoring_mode=None)
+    bot.openai_handler.get_message_score.assert_not_called()
+    message.channel.send.assert_awaited_once()
+    assert bot.user_scores[message.author.id] == {"grammar": 11, "friendliness": 10, "humor": 9}
+
+
+def test_work_queue_overload_policies():
+    async def scenario(policy):
+        queue = WorkQueue(max_size=2, workers=1, overload_policy=policy)
+        handled = []
+
+        queue.put(1, "first")
+        queue.put(2, "second")
+        queue.put(1, "third")
+        queue.put(3, "fourth")
+
+        async def handler(message):
+            handled.append(message)
+
+        queue.start(handler)
+        await queue.join()
+        await queue.stop()
+        return handled, queue.stats()
+
+    handled, stats = asyncio.run(scenario("drop_oldest"))
+    assert handled == ["third", "fourth"]
+    assert stats["dropped"] == 2
+    assert stats["latency"]["score"]["max"] >= 0
+
+    handled, stats = asyncio.run(scenario("coalesce"))
+    assert handled == ["third", "second"]
+    assert (stats["coalesced"], stats["dropped"]) == (1, 1)
+
+    handled, stats = asyncio.run(scenario("log_only"))
+    assert handled == ["first", "second"]
+    assert stats["skipped"] == 2
+    assert stats["processed"] == 2
+
+    with pytest.raises(ValueError):
+        WorkQueue(overload_policy="ignore")
+
+
+def test_work_queue_counts_errors(caplog):
+    metrics = Metrics()
+    queue = WorkQueue(workers=1, metrics=metrics)
+
+    async def scenario():
+        queue.start(AsyncMock(side_effect=KeyError("grammar")))
+        queue.put(1, "first")
+        await queue.join()
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+    assert queue.stats()["failures"] == 1
+    assert 'chatwizard_queue_errors_total{error="KeyError"} 1' in metrics.render()
+    assert "KeyError: 'grammar'" in caplog.text
+
+
+def test_on_message_queues_work(bot):
+    bot.work_queue = WorkQueue(max_size=10, workers=2)
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 0, "humor": -1})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=Faker().pyint()), content="Hello there!")
+    message.channel.send = AsyncMock()
+
+    async def scenario():
+        bot.work_queue.start(bot.score_messages)
+        await bot.on_message(message)
+        message.channel.send.assert_not_awaited()
+        await bot.work_queue.join()
+        await bot.work_queue.stop()
+
+    asyncio.run(scenario())
+
+    message.channel.send.assert_awaited_once()
+    assert bot.work_queue.stats()["processed"] == 1
+    assert bot.user_scores[message.author.id] == {"grammar": 11, "friendliness": 10, "humor": 9}
+
+
+def test_debouncer_merges_messages(bot):
+    bot.debouncer = MessageDebouncer(window=0.05, max_messages=3)
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 1, "humor": 0})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    author = Mock(id=Faker().pyint())
+    channel = Mock(id=1, send=AsyncMock())
+    other_channel = Mock(id=2, send=AsyncMock())
+
+    async def scenario():
+        bot.debouncer.start(bot.submit_messages)
+        for content in ["hey", "how are you", "all good?"]:
+            await bot.on_message(Mock(author=author, channel=other_channel, content=content, guild=None))
+        await bot.on_message(Mock(author=author, channel=channel, content="see you", guild=None))
+        await bot.on_message(Mock(author=author, channel=channel, content="tomorrow", guild=None))
+        assert bot.debouncer.stats()["open_windows"] == 1
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+
+    bot.openai_handler.aget_message_score.assert_any_await("hey\nhow are you\nall good?", usage=None, scoring_mode=None)
+    bot.openai_handler.aget_message_score.assert_any_await("see you\ntomorrow", usage=None, scoring_mode=None)
+    assert bot.openai_handler.aget_message_score.await_count == 2
+    other_channel.send.assert_awaited_once()
+    channel.send.assert_awaited_once()
+    assert bot.user_scores[author.id] == {"grammar": 12, "friendliness": 12, "humor": 10}
+    assert bot.debouncer.stats()["merged"] == 3
+
+
+def test_close_scores_debounced_messages(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.debouncer = MessageDebouncer(window=60.0)
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 0, "humor": 0})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=1234), content="see you", guild=None)
+    message.channel.send = AsyncMock()
+
+    async def scenario():
+        bot.debouncer.start(bot.submit_messages)
+        await bot.on_message(message)
+        await bot.close()
+
+    asyncio.run(scenario())
+
+    message.channel.send.assert_awaited_once()
+    assert bot.user_scores[1234]["grammar"] == 11
+
+
+def test_close_scores_held_messages(bot, tmp_path):
+    bot.user_scores_path = str(tmp_path / "user_scores.json")
+    bot.sampling_policy = SamplingPolicy(mode="sampled", method="reservoir", window=60.0, per_window=1)
+    bot.work_queue = WorkQueue(workers=1)
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 0, "humor": 0})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=1234), content="see you", guild=None)
+    message.channel.send = AsyncMock()
+
+    async def scenario():
+        bot.sampling_policy.start(bot.submit_sampled_message)
+        bot.work_queue.start(bot.score_queued)
+        await bot.on_message(message)
+        await bot.on_message(message)
+        await bot.work_queue.join()
+        await bot.close()
+
+    asyncio.run(scenario())
+
+    message.channel.send.assert_awaited_once()
+    assert bot.user_scores[1234]["grammar"] == 12
+    assert bot.work_queue.stats()["processed"] == 3
+
+
+def test_pooled_session(handler):
+    assert openai.requestssession is handler.session
+    assert handler.session.get_adapter("https://api.openai.com").poolmanager.connection_pool_kw["maxsize"] == 10
+
+    response = {"choices": [{"message": {"content": "5"}}]}
+    with patch("openai.ChatCompletion.create", return_value=Mock(**response)) as create:
+        handler.create_chat_completion("Rate this")
+
+    assert create.call_args.kwargs["request_timeout"] == (5.0, 30.0)
+    assert create.call_args.kwargs["api_key"] == "test_key"
+    assert handler.stats()["requests"] == 1
+    assert handler.stats()["p99"] == handler.stats()["max"]
+
+    handler.close()
+    assert openai.requestssession is None
+    assert handler.owns_executor and handler.executor._shutdown
+
+
+def test_close_cancels_waiting_requests(handler):
+    handler.executor = ThreadPoolExecutor(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    async def scenario():
+        running = asyncio.ensure_future(handler.run_blocking(block))
+        waiting = asyncio.ensure_future(handler.run_blocking(block))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        handler.close()
+        release.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(scenario())
+    assert not handler.pending
+
+
+def test_percentile():
+    samples = list(range(100, 0, -1))
+
+    assert (percentile(samples, 0.5), percentile(samples, 0.95), percentile(samples, 0.99)) == (50, 95, 99)
+    assert percentile([], 0.5) == 0.0
+
+
+def test_metrics():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.increment("requests_total", error="Timeout")
+    metrics.increment("requests_total", 2, error="Timeout")
+    metrics.observe("latency_seconds", 0.5, stage="score")
+    metrics.observe("latency_seconds", 5.0, stage="score")
+    metrics.add_collector("queue", lambda: {"depth": 3, "latency": {"max": 0.5}, "name": "ignored"})
+    rendered = metrics.render()
+
+    assert 'requests_total{error="Timeout"} 3' in rendered
+    assert 'latency_seconds_bucket{stage="score",le="0.1"} 0' in rendered
+    assert 'latency_seconds_bucket{stage="score",le="1.0"} 1' in rendered
+    assert 'latency_seconds_bucket{stage="score",le="+Inf"} 2' in rendered
+    assert 'latency_seconds_count{stage="score"} 2' in rendered
+    assert "queue_depth 3" in rendered
+    assert "queue_latency_max 0.5" in rendered
+    assert "ignored" not in rendered
+
+    port = metrics.start_server(port=0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.read().decode("utf-8") == metrics.render()
+    finally:
+        metrics.stop_server()
+
+    disabled = Metrics(enabled=False)
+    disabled.increment("requests_total")
+    with disabled.timer("latency_seconds"):
+        pass
+    assert disabled.render() == "\n"
+
+
+def test_bot_metrics(bot):
+    bot.metrics = Metrics()
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": -1001, "humor": 0})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=Faker().pyint()), content="Hello there!")
+    message.channel.send = AsyncMock()
+
+    asyncio.run(bot.on_message(message))
+    bot.save_user_scores()
+    rendered = bot.metrics.render()
+
+    assert 'chatwizard_messages_total{action="score"} 1' in rendered
+    assert 'chatwizard_scoring_failures_total{category="friendliness"} 1' in rendered
+    assert "chatwizard_score_update_seconds_count 1" in rendered
+    assert 'chatwizard_persistence_seconds_count{operation="save"} 1' in rendered
+
+
+def test_token_budget():
+    budget = TokenBudget(user_budget=100, sample_every=3)
+
+    assert budget.get_level(1, 2, 3) == "full"
+    budget.record(1, 2, 3, 50)
+    assert budget.get_level(1, 2, 3) == "combined"
+    assert budget.get_level(1, 2, 4) == "full"
+    budget.record(1, 2, 3, 30)
+    assert budget.get_level(1, 2, 3) == "sampled"
+    assert [budget.should_sample(1, 2) for _ in range(4)] == [True, False, False, True]
+    budget.record(1, 2, 3, 20)
+    assert budget.get_level(1, 2, 3) == "local"
+
+    assert budget.get_spent("guild", 1) == 100
+    assert budget.stats()["levels"] == {"full": 2, "combined": 1, "sampled": 1, "local": 1}
+
+    with pytest.raises(ValueError):
+        TokenBudget(combined_at=0.9, sampled_at=0.5)
+
+
+def test_handler_usage(handler):
+    handler.combined_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    response = openai.openai_object.OpenAIObject.construct_from(
+        {
+            "choices": [{"message": {"content": '{"grammar": 10, "friendliness": 10, "humor": 10}'}}],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 5, "total_tokens": 25},
+        }
+    )
+    usage = {}
+
+    with patch("openai.ChatCompletion.create", return_value=response):
+        handler.get_message_score("Hello there!", usage)
+        assert usage == {"prompt_tokens": 60, "completion_tokens": 15, "total_tokens": 75}
+
+        handler.get_message_score("Hello there!", usage, scoring_mode="combined")
+        assert usage["total_tokens"] == 100
+
+
+def test_bot_token_budget(bot):
+    bot.token_budget = TokenBudget(user_budget=100)
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+
+    async def score(content, usage=None, scoring_mode=None):
+        usage["total_tokens"] = usage.get("total_tokens", 0) + 60
+        return {"grammar": 1, "friendliness": 1, "humor": 1}
+
+    bot.openai_handler.aget_message_score = AsyncMock(side_effect=score)
+    author = Mock(id=Faker().pyint())
+
+    for _ in range(3):
+        message = Mock(author=author, content="Thanks, that was really helpful!", guild=None)
+        message.channel.send = AsyncMock()
+        asyncio.run(bot.on_message(message))
+
+    assert [call.kwargs["scoring_mode"] for call in bot.openai_handler.aget_message_score.await_args_list] == [
+        None,
+        "combined",
+    ]
+    assert bot.token_budget.get_spent("user", author.id) == 120
+    assert bot.token_budget.stats()["levels"]["local"] == 1
+    assert bot.user_scores[author.id]["friendliness"] == 13
+
+
+def test_sampling_policy_every():
+    policy = SamplingPolicy(mode="sampled", every=3, guild_modes={1: "off"}, channel_modes={10: "full"})
+
+    assert [policy.sample(None, 20, 5, None) for _ in range(4)] == [3, None, None, 3]
+    assert policy.sample(1, 30, 5, None) is None
+    assert policy.sample(1, 10, 5, None) == 1
+    assert policy.stats()["scored"] == 3
+
+    with pytest.raises(ValueError):
+        SamplingPolicy(channel_modes={10: "sometimes"})
+
+
+def test_sampling_policy_reservoir():
+    policy = SamplingPolicy(mode="sampled", method="reservoir", window=0.05, per_window=2, seed=1)
+    sampled = []
+
+    async def scenario():
+        policy.start(lambda item, weight: sampled.append((item, weight)))
+        for index in range(5):
+            assert policy.sample(None, 20, 5, index) is None
+        assert policy.sample(None, 20, 6, "other") is None
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    weights = {item: weight for item, weight in sampled}
+    assert len(sampled) == 3
+    assert weights["other"] == 1
+    assert all(weights[item] in (2, 3) for item in weights if item != "other")
+    assert policy.round_weight(2.0) == 2
+    assert sum(policy.round_weight(2.5) for _ in range(1000)) in range(2350, 2650)
+
+
+def test_sampled_scores_are_weighted(bot):
+    bot.sampling_policy = SamplingPolicy(mode="sampled", every=4)
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": -1, "humor": 0})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    author = Mock(id=Faker().pyint())
+
+    for _ in range(5):
+        message = Mock(author=author, content="Hello there!", guild=None)
+        message.channel.id = 7
+        message.channel.send = AsyncMock()
+        asyncio.run(bot.on_message(message))
+
+    assert bot.openai_handler.aget_message_score.await_count == 2
+    assert bot.user_scores[author.id] == {"grammar": 18, "friendliness": 2, "humor": 10}
+
+
+def test_sampled_messages_are_filtered_once(bot):
+    bot.sampling_policy = SamplingPolicy(mode="sampled", every=2)
+    bot.message_filter.classify = Mock(return_value=("score", None))
+    bot.openai_handler.aget_message_score = AsyncMock(return_value={"grammar": 1, "friendliness": 1, "humor": 1})
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    message = Mock(author=Mock(id=Faker().pyint()), content="Hello there!", guild=None)
+    message.channel.send = AsyncMock()
+
+    asyncio.run(bot.score_message(message, "Hello there!", weight=2))
+
+    bot.message_filter.classify.assert_not_called()
+    assert bot.user_scores[message.author.id] == {"grammar": 12, "friendliness": 12, "humor": 12}
+
+
+def test_score_aggregates(tmp_path):
+    path = str(tmp_path / "aggregates.json")
+    aggregates = ScoreAggregates(['grammar', 'humor'], half_life=3600, path=path)
+    start = 1_000_000 * 3600
+
+    aggregates.record(1, {"grammar": 2, "humor": -1}, timestamp=start)
+    aggregates.record(1, {"grammar": 1, "humor": 0}, weight=3, timestamp=start + 30 * 60)
+    aggregates.record("1", {"grammar": 4, "humor": 1}, timestamp=start + 2 * 3600)
+
+    recent = aggregates.get_recent(1, timestamp=start + 2 * 3600)
+    assert recent["hour"] == {"grammar": 4, "humor": 1, "messages": 1}
+    assert recent["day"] == {"grammar": 9, "humor": 0, "messages": 5}
+    assert recent["decayed"]["grammar"] == pytest.approx(2 / 4 + 3 * 2**-1.5 + 4)
+
+    recent = aggregates.get_recent(1, timestamp=start + 8 * 24 * 3600)
+    assert recent["day"]["messages"] == 0 and recent["week"]["messages"] == 0
+    assert aggregates.get_recent(2) is None
+
+    aggregates.save()
+    assert ScoreAggregates(['grammar', 'humor'], half_life=3600, path=path).get_recent(
+        1, start
+    ) == aggregates.get_recent(1, start)
+    assert aggregates.stats() == {"guilds": 1, "users": 1, "buffer_bytes": 43 * (3 * 4 + 8)}
+
+    with pytest.raises(ValueError):
+        ScoreAggregates(['grammar'], half_life=0)
+
+
+def test_score_aggregates_append_changed_users(tmp_path):
+    path = str(tmp_path / "aggregates.json")
+    aggregates = ScoreAggregates(['grammar'], path=path)
+    for user_id in range(10):
+        aggregates.record(user_id, {"grammar": 1})
+    aggregates.save()
+    aggregates.record(1, {"grammar": 2})
+    aggregates.reset(2)
+    aggregates.save()
+
+    with open(path, "r") as file:
+        assert len(file.readlines()) == 12
+    assert ScoreAggregates(['grammar'], path=path).get_recent(1)["day"]["grammar"] == 3
+    assert ScoreAggregates(['grammar'], path=path).get_recent(2) is None
+
+    aggregates.record(0, {"grammar": 1})
+    with patch("builtins.open", side_effect=OSError("disk full")), pytest.raises(OSError):
+        aggregates.save()
+    with patch("os.replace", side_effect=OSError("disk full")), pytest.raises(OSError):
+        aggregates.save()
+
+    assert aggregates.dirty == {None: {"0"}} and os.listdir(tmp_path) == ["aggregates.json"]
+    aggregates.save()
+    assert ScoreAggregates(['grammar'], path=path).get_recent(0)["day"]["messages"] == 2
+
+
+def test_aggregates_are_saved_periodically(bot, tmp_path):
+    bot.aggregates = ScoreAggregates(bot.categories, path=str(tmp_path / "aggregates.json"))
+    bot.aggregates.record(1234, {"grammar": 1, "friendliness": 0, "humor": -1})
+    bot.flush_event = asyncio.Event()
+    bot.flush_event.set()
+
+    with patch.object(bot, "is_closed", side_effect=[False, True]):
+        asyncio.run(bot.flush_user_scores_periodically())
+
+    assert not bot.aggregates.dirty
+    assert ScoreAggregates(bot.categories, path=bot.aggregates.path).get_recent(1234)["day"]["messages"] == 1
+
+
+def test_me_shows_recent_scores(bot):
+    bot.openai_handler.generate_default_scores.return_value = {"grammar": 10, "friendliness": 10, "humor": 10}
+    bot.update_scores(1234, {"grammar": 1, "friendliness": 0, "humor": -1}, weight=2)
+    message = Mock(author=Mock(id=1234), content="!me")
+    message.channel.send = AsyncMock()
+
+    asyncio.run(bot.on_message(message))
+
+    description = message.channel.send.call_args.kwargs["embed"].description
+    assert "Grammar:** 12**" in description
+    assert "Last hour:** 2 / 0 / -2** (2 messages)" in description
+
+
+def test_ranking_index():
+    index = RankingIndex(seed=0)
+    scores = {str(member): (member * 7) % 11 for member in range(50)}
+    for member, score in scores.items():
+        index.update(member, score)
+    index.update("3", 20)
+    index.discard("4")
+    scores["3"] = 20
+    del scores["4"]
+
+    expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    assert index.top(5) == expected[:5]
+    assert [index.rank(member) for member, _ in expected] == list(range(1, len(expected) + 1))
+    assert index.rank("4") is None and len(index) == 49
+
+
+def test_top_command(bot):
+    bot.openai_handler.generate_default_scores.side_effect = lambda: {"grammar": 0, "friendliness": 0, "humor": 0}
+    bot.update_scores(1, {"grammar": 3, "friendliness": 1, "humor": 0}, guild_id=9)
+    bot.update_scores(2, {"grammar": 1, "friendliness": 5, "humor": 0}, guild_id=9)
+    bot.update_scores(3, {"grammar": 9, "friendliness": 9, "humor": 9}, guild_id=8)
+    bot.update_scores(1, {"grammar": 0, "friendliness": 4, "humor": 0})
+
+    message = Mock(author=Mock(id=2), content="!top friendliness 1", guild=Mock(id=9))
+    message.channel.send = AsyncMock()
+    asyncio.run(bot.on_message(message))
+    assert message.channel.send.call_args.kwargs["embed"].description == "1. <@1>:** 5**\n\nYou are ranked **#2**."
+
+    message.content = "!top"
+    asyncio.run(bot.on_message(message))
+    assert message.channel.send.call_args.kwargs["embed"].description == "1. <@1>:** 8**\n2. <@2>:** 6**"
+
+    message.content = "!top wit"
+    asyncio.run(bot.on_message(message))
+    assert message.channel.send.call_args.kwargs["embed"].title == "Failure :("
+
+
+def test_leaderboard_is_seeded_from_stored_scores(bot, tmp_path):
+    bot.user_scores = {
+        "1": {"grammar": 3, "friendliness": 1, "humor": 0},
+        "2": {"grammar": 1, "friendliness": 5, "humor": 0},
+        "3": {"grammar": 9, "friendliness": 9, "humor": 9},
+    }
+    guild = Mock(id=9, members=[Mock(id=1), Mock(id=2), Mock(id=4)])
+    with patch.object(DiscordBot, "guilds", new_callable=PropertyMock, return_value=[guild]):
+        asyncio.run(bot.on_ready())
+
+    assert bot.leaderboard.top(9) == [("2", 6), ("1", 4)]
+
+    reloaded = {"1": {"grammar": 13, "friendliness": 1, "humor": 0}, "2": {"grammar": 1, "friendliness": 5, "humor": 0}}
+    with patch.object(RankingIndex, "insert", autospec=True, side_effect=RankingIndex.insert) as insert:
+        bot.leaderboard.refresh(reloaded)
+    assert insert.call_count == 2 and bot.leaderboard.top(9) == [("1", 14), ("2", 6)]
+
+    store = GuildScoreStore(str(tmp_path / "guilds"))
+    store.for_guild(9).user_scores["1"] = {"grammar": 3, "friendliness": 1, "humor": 0}
+    store.save()
+    bot = DiscordBot(
+        discord.Intents.default(), Mock(), bot.log_file_path, None, score_store=GuildScoreStore(store.path)
+    )
+
+    message = Mock(author=Mock(id=2), content="!top", guild=Mock(id=9))
+    message.channel.send = AsyncMock()
+    asyncio.run(bot.on_message(message))
+    assert message.channel.send.call_args.kwargs["embed"].description == "1. <@1>:** 4**"
+
+
+def test_score_cache(tmp_path):
+    path = str(tmp_path / "score_cache.json")
+    cache = ScoreCache(max_entries=2, path=path)
+    cache.put("GG", "v1", {"grammar": 1, "friendliness": 1, "humor": 0})
+
+    assert cache.get("  gg ", "v1") == {"grammar": 1, "friendliness": 1, "humor": 0}
+    assert cache.get("gg", "v2") is None
+
+    cache.put("lol", "v1", {"grammar": 0, "friendliness": 1, "humor": 1})
+    cache.put("thanks!", "v1", {"grammar": 1, "friendliness": 1, "humor": -1})
+    assert cache.get("gg", "v1") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hit_rate"] == 1 / 3
+
+    cache.save()
+    assert ScoreCache(path=path).get("lol", "v1") == {"grammar": 0, "friendliness": 1, "humor": 1}
+
+
+def test_score_cache_expiry():
+    cache = ScoreCache(ttl=-1)
+    cache.put("gg", "v1", {"grammar": 1, "friendliness": 1, "humor": 0})
+
+    assert cache.get("gg", "v1") is None
+
+
+def test_get_message_score_cached(handler):
+    handler.score_cache = ScoreCache()
+
+    with patch.object(handler, "create_chat_completion", return_value="10"):
+        assert handler.get_message_score("gg") == {"grammar": 1, "friendliness": 1, "humor": 1}
+        assert asyncio.run(handler.aget_message_score("GG")) == {"grammar": 1, "friendliness": 1, "humor": 1}
+        assert handler.create_chat_completion.call_count == 3
+
+    with patch.object(handler, "create_chat_completion", return_value="no idea"):
+        handler.get_message_score("lol")
+        handler.get_message_score("lol")
+        assert handler.create_chat_completion.call_count == 6
+
+
+def test_get_batch_scores(handler):
+    handler.batch_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    response = '[{"grammar": 10, "friendliness": 8, "humor": 0}, {"grammar": 11, "friendliness": 8, "humor": 0}]'
+
+    with patch.object(handler, "create_chat_completion", return_value=response):
+        assert handler.get_batch_scores(["first", "second"]) == [{"grammar": 1, "friendliness": 1, "humor": -1}, None]
+
+    with patch.object(handler, "create_chat_completion", return_value='[{"grammar": 10}]'):
+        assert handler.get_batch_scores(["first", "second"]) is None
+
+
+def test_batch_scorer(handler):
+    handler.batch_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    response = '[{"grammar": 10, "friendliness": 8, "humor": 0}, {"grammar": 0, "friendliness": 0, "humor": 10}]'
+    batch_scorer = BatchScorer(handler, max_batch_size=3, max_wait=0.01)
+
+    async def score_messages():
+        return await asyncio.gather(batch_scorer.score("first"), batch_scorer.score("second"))
+
+    with patch.object(handler, "create_chat_completion", return_value=response):
+        first, second = asyncio.run(score_messages())
+
+        handler.create_chat_completion.assert_called_once()
+
+    assert first == {"grammar": 1, "friendliness": 1, "humor": -1}
+    assert second == {"grammar": -1, "friendliness": -1, "humor": 1}
+    assert batch_scorer.stats()["average_batch_size"] == 2
+
+
+def test_batch_scorer_fallback(handler):
+    handler.batch_prompt_path = "scripts/tests_tmp/test_prompt.txt"
+    batch_scorer = BatchScorer(handler, max_batch_size=2, max_wait=60.0)
+
+    async def score_messages():
+        return await asyncio.gather(batch_scorer.score("first"), batch_scorer.score("second"))
+
+    with patch.object(handler, "create_chat_completion", side_effect=["not json"] + ["10"] * 6):
+        first, second = asyncio.run(score_messages())
+
+        assert handler.create_chat_completion.call_count == 7
+
+    assert first == second == {"grammar": 1, "friendliness": 1, "humor": 1}
+
+
+def test_batch_scorer_keeps_the_budget_level(bot):
+    scorer = Mock()
+    scorer.aget_batch_scores = AsyncMock(side_effect=lambda contents, usage, mode: [{"grammar": 1}] * len(contents))
+    bot.batch_scorer = BatchScorer(scorer, max_batch_size=2, max_wait=60.0)
+
+    async def score_messages():
+        return await asyncio.gather(bot.get_message_score("first", {}), bot.get_message_score("second", {}, "sampled"))
+
+    assert asyncio.run(score_messages()) == [{"grammar": 1}, {"grammar": 1}]
+    assert sorted(call.args[::2] for call in scorer.aget_batch_scores.await_args_list) == [
+        (["first"], None),
+        (["second"], "combined"),
+    ]
+
+
+def test_request_scheduler_retries_transient_errors():
+    scheduler = RequestScheduler(base_delay=0.001)
+    request = Mock(side_effect=[openai.error.RateLimitError("slow down"), openai.error.Timeout("timeout"), "response"])
+
+    assert scheduler.submit(request, tokens=10) == "response"
+    assert request.call_count == 3
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["queue_depth"] == 0
+
+
+def test_request_scheduler_gives_up():
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001)
+    request = Mock(side_effect=openai.error.ServiceUnavailableError("unavailable"))
+
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        scheduler.submit(request)
+    assert request.call_count == 3
+
+    request = Mock(side_effect=openai.error.InvalidRequestError("invalid", None))
+    with pytest.raises(openai.error.InvalidRequestError):
+        scheduler.submit(request)
+    assert request.call_count == 1
+    assert scheduler.stats()["failures"] == 2
+
+
+def test_token_bucket():
+    bucket = TokenBucket(60)
+
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.01)
+
+
+def test_get_category_score_transient_error(handler):
+    with patch.object(handler, "create_chat_completion", side_effect=openai.error.RateLimitError("slow down")):
+        assert handler.get_grammar_score("Hello world!") == -1001
+
+
+def test_lexicon_scorer():
+    scorer = LexiconScorer()
+
+    assert scorer.rate("Thanks, that was really helpful!") == {"grammar": 10, "friendliness": 8, "humor": 2}
+    assert scorer.rate("u r so stupid") == {"grammar": 4, "friendliness": 3, "humor": 2}
+    assert scorer.get_message_score("Why did the tomato turn red? Because it saw the salad dressing! lol") == {
+        "grammar": 1,
+        "friendliness": 1,
+        "humor": 1,
+    }
+
+
+def test_failover_scorer():
+    class SlowScorer(LexiconScorer):
+        async def aget_message_score(self, content):
+            await asyncio.sleep(1)
+
+    primary = SlowScorer()
+    fallback = Mock(wraps=LexiconScorer())
+    scorer = FailoverScorer(primary, fallback, latency_threshold=0.01)
+
+    assert asyncio.run(scorer.aget_message_score("Thanks!")) == LexiconScorer().get_message_score("Thanks!")
+    assert scorer.is_degraded()
+    assert scorer.failovers == 1
+
+    scorer.degraded_until = 0.0
+    with patch.object(
+        primary, "get_message_score", return_value={"grammar": -1001, "friendliness": -1001, "humor": -1001}
+    ):
+        assert scorer.get_message_score("Thanks!") == LexiconScorer().get_message_score("Thanks!")
+    assert scorer.failovers == 2
+
+
+def test_fake_openai_server(handler):
+    server = FakeOpenAIServer().start()
+    handler.api_base = server.url
+    handler.grammar_prompt_path = "scripts/prompts/grammar.txt"
+    handler.friendliness_prompt_path = "scripts/prompts/friendliness.txt"
+    handler.humor_prompt_path = "scripts/prompts/humor.txt"
+    handler.combined_prompt_path = "scripts/prompts/combined.txt"
+    handler.batch_prompt_path = "scripts/prompts/batch.txt"
+    content = "Thanks, that was really helpful!"
+    expected = LexiconScorer().get_message_score(content)
+
+    try:
+        assert handler.get_message_score(content) == expected
+        assert handler.get_combined_score(content) == expected
+        assert handler.get_batch_scores([content, "u r so stupid"]) == [
+            expected,
+            LexiconScorer().get_message_score("u r so stupid"),
+        ]
+        assert server.requests == 5
+    finally:
+        server.stop()
+
+
+def test_streaming_rating(handler):
+    server = FakeOpenAIServer().start()
+    handler.api_base = server.url
+    handler.streaming = True
+    handler.grammar_prompt_path = "scripts/prompts/grammar.txt"
+
+    try:
+        assert handler.get_grammar_score("Thanks, that was really helpful!") == handler.rating_to_score(10)
+    finally:
+        server.stop()
+
+    consumed = []
+    rated = threading.Event()
+
+    def stream(**arguments):
+        for piece in ["I would", " rate it ", "7", "/10", " because", " it is mostly fine."]:
+            if piece == " because":
+                rated.wait(5)
+            consumed.append(piece)
+            yield Mock(choices=[{"delta": {"content": piece}}])
+
+    with patch("openai.ChatCompletion.create", side_effect=stream) as create:
+        assert handler.get_grammar_score("Hello world") == handler.rating_to_score(7)
+        assert consumed == ["I would", " rate it ", "7", "/10"]
+        rated.set()
+        handler.executor.shutdown(wait=True)
+
+    assert consumed[-1] == " it is mostly fine."
+    assert create.call_args.kwargs["max_tokens"] == 5
+    assert create.call_args.kwargs["stream"] is True
+
+
+def test_parse_rating():
+    assert parse_rating("7") == 7
+    assert parse_rating(" 10.") == 10
+    assert parse_rating("Rating: 3 out of 10") == 3
+
+    with pytest.raises(ValueError):
+        parse_rating("I cannot rate this.")
+
+
+def test_benchmark(tmp_path):
+    results = Benchmark(generate_messages(12, authors=3), concurrency=2).run()
+
+    assert results["replies"] == 12
+    assert results["api_calls_per_message"] == 3
+    assert results["persisted_bytes_per_message"] > 0
+    assert results["stages"]["get_message_score"]["count"] == 12
+    assert results["stages"]["save_user_scores"]["p99"] >= results["stages"]["save_user_scores"]["p50"]
+
+    log_path = tmp_path / "log.txt"
+    log_path.write_text("Log file created.\nalice: Hello there!\nbob: Hi: how are you?\nalice: Fine\n")
+    assert load_messages(str(log_path)) == [(0, "Hello there!"), (1, "Hi: how are you?"), (0, "Fine")]
+
+
+def test_invalid_scoring_mode():
+    with pytest.raises(ValueError):
+        OpenAIHandler(
+            api_key="test_key",
+            grammar_prompt_path="scripts/tests_tmp/test_prompt.txt",
+            friendliness_prompt_path="scripts/tests_tmp/test_prompt.txt",
+            humor_prompt_path="scripts/tests_tmp/test_prompt.txt",
+            scoring_mode="invalid",
+        )
+
+
+def test_prompt_cache(tmp_path):
+    prompt_path = tmp_path / "prompt.txt"
+    prompt_path.write_text("First prompt: ")
+    cache = PromptCache()
+
+    assert cache.get(str(prompt_path)) == "First prompt: "
+    assert cache.get(str(prompt_path)) == "First prompt: "
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    prompt_path.write_text("Edited prompt: ")
+    os.utime(prompt_path, ns=(0, 0))
+
+    assert cache.get(str(prompt_path)) == "Edited prompt: "
+    assert cache.stats()["misses"] == 2
+
+
+def test_prompt_version_follows_prompt_edits(tmp_path):
+    prompt_path = tmp_path / "prompt.txt"
+    prompt_path.write_text("Rate this: {message}")
+    handler = OpenAIHandler(
+        api_key="test_key",
+        grammar_prompt_path=str(prompt_path),
+        friendliness_prompt_path=str(prompt_path),
+        humor_prompt_path=str(prompt_path),
+    )
+    version = handler.get_prompt_version()
+
+    with patch("hashlib.sha256") as sha256:
+        assert handler.get_prompt_version() == version
+        sha256.assert_not_called()
+
+    prompt_path.write_text("Rate this message: {message}")
+    os.utime(prompt_path, ns=(0, 0))
+    assert handler.get_prompt_version() != version
+
+
 def test_get_corresponding_word(bot):
     assert bot.get_corresponding_word('grammar', 1) == 'Appropriate'
     assert bot.get_corresponding_word('grammar', 0) == 'Mediocre'
@@ -207,6 +1411,43 @@ def test_score_to_word(bot):
         bot.score_to_word(score_map, 3)
 
 
+def test_sharded_bot():
+    bot = ShardedDiscordBot(
+        intents=discord.Intents.default(),
+        openai_handler=Mock(),
+        log_file_path="scripts/tests_tmp/test_log.txt",
+        user_scores_path="scripts/tests_tmp/test_user_scores.json",
+        shard_count=4,
+        shard_ids=[1, 3],
+    )
+
+    assert isinstance(bot, discord.AutoShardedClient)
+    assert bot.shard_count == 4
+    assert bot.shard_ids == [1, 3]
+
+
+def test_split_shards():
+    assert split_shards(5, 2) == [[0, 2, 4], [1, 3]]
+    assert split_shards(2, 4) == [[0], [1]]
+
+
+def test_parse_arguments():
+    arguments = parse_arguments(["openai", "discord", "--shards", "4", "--processes", "2", "--score-backend", "sqlite"])
+
+    assert arguments.open_ai_api_key == "openai"
+    assert arguments.shards == 4
+    assert arguments.processes == 2
+    assert arguments.score_backend == "sqlite"
+
+    with pytest.raises(SystemExit):
+        parse_arguments(["openai", "discord", "--processes", "2"])
+
+
+def test_launch_shards_requires_sqlite():
+    with pytest.raises(ValueError):
+        launch_shards("openai", "discord", shard_count=4, processes=2)
+
+
 def test_run_invalid():
     open_ai_api_key = '12345'
     discord_api_key = '67890'
@@ -0,0 +1,198 @@
+"""
+This script contains the implementation of the WorkQueue class, which bounds the scoring work the Discord bot takes on
+during bursts of messages and hands it to a fixed pool of workers.
+"""
+
+import asyncio
+import logging
+import time
+
+from metrics import NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    A bounded queue between the Discord gateway and the scorer, drained by a fixed number of worker tasks.
+
+    When the queue is full, the overload policy decides what happens to a new message: "drop_oldest" discards the
+    message that waited the longest, "coalesce" replaces the pending message of the same author with the new one and
+    drops it if its author has none pending, and "log_only" does not score the new message at all, so that it only
+    ends up in the log file.
+    """
+
+    overload_policies = ['drop_oldest', 'coalesce', 'log_only']
+
+    def __init__(self, max_size=1000, workers=4, overload_policy="drop_oldest", metrics=None):
+        """
+        Initializes a new instance of the WorkQueue class.
+
+        Parameters:
+            max_size (int): Maximum number of messages waiting to be scored.
+            workers (int): Number of messages scored at the same time.
+            overload_policy (str): What to do with a new message when the queue is full, one of overload_policies.
+            metrics (Metrics): The metrics the errors of the handler are counted in, by type, in addition to being
+                logged; not counted if None.
+
+        Raises:
+            ValueError: If the overload policy, the size or the number of workers is not valid.
+        """
+        if overload_policy not in self.overload_policies:
+            raise ValueError("Invalid overload policy.")
+
+        if max_size < 1 or workers < 1:
+            raise ValueError("Invalid work queue size.")
+
+        self.max_size = max_size
+        self.workers = workers
+        self.overload_policy = overload_policy
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.pending = {}
+        self.handler = None
+        self.tasks = []
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.failures = 0
+        self.max_depth = 0
+        self.latencies = {"queue": [0.0, 0.0, 0], "score": [0.0, 0.0, 0]}
+
+    def start(self, handler):
+        """
+        Starts the worker tasks on the running event loop.
+
+        Parameters:
+            handler (callable): Coroutine function scoring a message, called with the message.
+        """
+        self.handler = handler
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Cancels the worker tasks. Messages still waiting in the queue are not scored.
+        """
+        for task in self.tasks:
+            task.cancel()
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def put(self, key, message):
+        """
+        Queues a message to be scored, applying the overload policy if the queue is full.
+
+        Parameters:
+            key (int): The key messages are coalesced by, usually the ID of the author.
+            message (object): The message to score as handed to the handler, the Discord bot queues lists of merged
+                messages.
+
+        Returns:
+            bool: Whether the message will be scored.
+        """
+        entry = [key, message, time.monotonic()]
+
+        if self.queue.full():
+            if self.overload_policy == "log_only":
+                self.skipped += 1
+                return False
+
+            if self.overload_policy == "coalesce":
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    self.dropped += 1
+                    return False
+
+                waiting[1] = message
+                self.coalesced += 1
+                return True
+
+            oldest = self.queue.get_nowait()
+            self.queue.task_done()
+            self.forget(oldest)
+            self.dropped += 1
+
+        self.queue.put_nowait(entry)
+        self.pending[key] = entry
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def forget(self, entry):
+        """
+        Removes a queued entry from the pending entries of its key, unless a newer entry replaced it.
+
+        Parameters:
+            entry (list): The [key, message, enqueued_at] entry leaving the queue.
+        """
+        if self.pending.get(entry[0]) is entry:
+            del self.pending[entry[0]]
+
+    async def work(self):
+        """
+        Scores queued messages one after another until the worker is cancelled.
+        """
+        while True:
+            entry = await self.queue.get()
+            self.forget(entry)
+
+            started = time.monotonic()
+            self.record("queue", started - entry[2])
+
+            try:
+                await self.handler(entry[1])
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:
+                logger.exception("Could not score a queued message.")
+                self.failures += 1
+                self.metrics.increment("chatwizard_queue_errors_total", error=type(exception).__name__)
+            finally:
+                self.record("score", time.monotonic() - started)
+                self.queue.task_done()
+
+    async def join(self):
+        """
+        Waits until every queued message has been scored.
+        """
+        await self.queue.join()
+
+    def record(self, stage, latency):
+        """
+        Records the latency of a stage of a message.
+
+        Parameters:
+            stage (str): The stage, "queue" for the time waited in the queue or "score" for the time scoring took.
+            latency (float): The number of seconds the stage took.
+        """
+        totals = self.latencies[stage]
+        totals[0] += latency
+        totals[1] = max(totals[1], latency)
+        totals[2] += 1
+
+    def stats(self):
+        """
+        Returns the counters of the work queue.
+
+        Returns:
+            dict: Queue depth, number of messages queued, scored, dropped, coalesced, skipped and failed, and the
+                average and maximum latency of each stage.
+        """
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "latency": {
+                stage: {"average": total / count if count else 0.0, "max": maximum}
+                for stage, (total, maximum, count) in self.latencies.items()
+            },
+        }